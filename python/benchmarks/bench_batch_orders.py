@@ -0,0 +1,95 @@
+"""
+Measure the time to re-quote a ladder of LEVELS orders on FTX against a local HTTP server answering after LATENCY
+seconds, as a stand-in for the round trip to the venue.
+
+Compared:
+    - sequential: one FtxManager.place_order() / cancel of the order after the other
+    - batch: FtxManager.place_orders() / cancel_orders(), with an order worker per level
+
+Run from the python working directory:
+    python -m benchmarks.bench_batch_orders
+"""
+import itertools
+import json
+import logging
+import os
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Thread
+import gateways.ftx.ftx as ftx
+from lib.http_client import HttpClient
+from lib.interface import InstrumentDetails, NewOrderSingle, Side, OrderType
+
+LEVELS = 10
+LATENCY = 0.02
+REPEAT = 5
+
+_order_ids = itertools.count(1)
+
+
+class OrdersHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        order = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        order.update({'id': next(_order_ids), 'type': 'limit', 'createdAt': '2021-09-09T15:48:04.320464+00:00'})
+        self.respond({'success': True, 'result': order})
+
+    def do_DELETE(self):
+        if self.headers['Content-Length']:
+            self.rfile.read(int(self.headers['Content-Length']))
+        self.respond({'success': True, 'result': 'Order queued for cancellation'})
+
+    def respond(self, message: dict):
+        time.sleep(LATENCY)
+        body = json.dumps(message).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def requote_sequential(manager: ftx.FtxManager, orders: [NewOrderSingle]) -> None:
+    for order in list(manager.get_orders('BTC-PERP')):
+        manager.cancel_order('BTC-PERP', order.order_id)
+    for order in orders:
+        manager.place_order(order)
+
+
+def requote_batch(manager: ftx.FtxManager, orders: [NewOrderSingle]) -> None:
+    manager.cancel_orders('BTC-PERP', [order.order_id for order in manager.get_orders('BTC-PERP')])
+    manager.place_orders(orders)
+
+
+def measure(requote, manager: ftx.FtxManager) -> float:
+    """ Return the mean time of a re-quote (cancel then place the ladder) in milliseconds """
+    start = time.perf_counter()
+    for i in range(REPEAT):
+        orders = [NewOrderSingle('BTC-PERP', Side.Buy, 0.001, OrderType.Limit, price=30000 - level - i)
+                  for level in range(LEVELS)]
+        requote(manager, orders)
+    return (time.perf_counter() - start) / REPEAT * 1e3
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, filename=os.devnull)
+
+    server = ThreadingHTTPServer(('localhost', 0), OrdersHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://localhost:{}'.format(server.server_port)
+
+    manager = ftx.FtxManager('BTC-PERP', api_key='key', api_secret='secret', order_workers=LEVELS)
+    manager._rest_url = url
+    manager._http = HttpClient(url, pool_size=LEVELS)
+    manager._instrument_static['BTC-PERP'] = InstrumentDetails('BTC-PERP', tick_size=1.0, quantity_size=0.0001)
+
+    print('re-quote of {} levels, {:.0f} ms round trip, in ms'.format(LEVELS, LATENCY * 1e3))
+    for name, requote in (('sequential', requote_sequential), ('batch', requote_batch)):
+        print('{:<12} {:>8.1f}'.format(name, measure(requote, manager)))
+
+    server.shutdown()
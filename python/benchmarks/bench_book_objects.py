@@ -0,0 +1,79 @@
+"""
+Measure the cost of the market data objects built on every book update, by replaying the recorded FTX order book
+messages in tests/ftx/samples/orderbooks.txt through each order book processor.
+
+Reported per processor:
+    - time per update (handle + get_orderbook)
+    - bytes retained per OrderBook (10 Tier + 1 OrderBook at depth 5)
+    - number of garbage collections triggered by the replay, while the books are kept alive by a consumer
+
+Run from the python working directory:
+    python -m benchmarks.bench_book_objects
+"""
+import gc
+import json
+import os
+import time
+import tracemalloc
+import gateways.ftx.ftx as ftx
+
+SAMPLES = os.path.join(os.path.dirname(__file__), '..', 'tests', 'ftx', 'samples', 'orderbooks.txt')
+REPEAT = 200
+
+
+def load_messages() -> [dict]:
+    messages = []
+    with open(SAMPLES) as f:
+        for line in f:
+            if 'Received: ' in line:
+                data = json.loads(line.split('Received: ', 1)[1])
+                if data.get('channel') == 'orderbook':
+                    messages.append(data)
+    return messages
+
+
+def replay(processor, messages: [dict], keep: list = None):
+    for message in messages:
+        processor.handle(message)
+        # force a rebuild on every update, to measure the object cost
+        processor.changed = True
+        processor._order_book = None
+        order_book = processor.get_orderbook()
+        if keep is not None:
+            keep.append(order_book)
+
+
+def measure(processor_class, messages: [dict]):
+    processor = processor_class('BTC-PERP', depth=5, tick_size=1.0)
+
+    # time per update
+    replay(processor, messages)
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        replay(processor, messages)
+    per_update_us = (time.perf_counter() - start) / (REPEAT * len(messages)) * 1e6
+
+    # garbage collections triggered
+    books = []
+    collections_before = sum(stat['collections'] for stat in gc.get_stats())
+    for _ in range(REPEAT):
+        replay(processor, messages, books)
+    collections = sum(stat['collections'] for stat in gc.get_stats()) - collections_before
+
+    # memory retained per order book
+    books = []
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    replay(processor, messages, books)
+    retained = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    print('{:<28} {:>8.2f} us/update {:>8.0f} bytes/book {:>6} gc runs'.format(
+        processor_class.__name__, per_update_us, retained / len(books), collections))
+
+
+if __name__ == '__main__':
+    samples = load_messages()
+    print('{} messages x {} repeats'.format(len(samples), REPEAT))
+    for cls in (ftx.OrderBookProcessor, ftx.SortedOrderBookProcessor, ftx.LadderOrderBookProcessor):
+        measure(cls, samples)
@@ -0,0 +1,67 @@
+"""
+Measure the websocket message decoding cost of each installed JSON decoder (see lib/json_decoder.py), on the recorded
+FTX order book messages in tests/ftx/samples/orderbooks.txt and dYdX v3_orderbook messages in tests/dydx/samples.txt.
+
+Reported per decoder and sample set, starting from the frame bytes, for the default receive path (the frame is decoded
+to str by websockets, then parsed) and for the bytes_frames=True receive path (the frame bytes are parsed directly):
+    - time per message
+    - throughput in MB/s
+
+Run from the python working directory:
+    python -m benchmarks.bench_json_decoder
+"""
+import json
+import os
+import time
+from lib.json_decoder import JSON_DECODERS
+
+SAMPLES = os.path.join(os.path.dirname(__file__), '..', 'tests')
+REPEAT = 200
+
+
+def load_ftx_messages() -> [str]:
+    messages = []
+    with open(os.path.join(SAMPLES, 'ftx', 'samples', 'orderbooks.txt')) as f:
+        for line in f:
+            if 'Received: ' in line:
+                message = line.split('Received: ', 1)[1].strip()
+                if json.loads(message).get('channel') == 'orderbook':
+                    messages.append(message)
+    return messages
+
+
+def load_dydx_messages() -> [str]:
+    messages = []
+    with open(os.path.join(SAMPLES, 'dydx', 'samples.txt')) as f:
+        for line in f:
+            if line.startswith('< '):
+                message = line[2:].strip()
+                if json.loads(message).get('channel') == 'v3_orderbook':
+                    messages.append(message)
+    return messages
+
+
+def measure(decode, frames: [bytes]) -> float:
+    """ Return the time per message in microseconds """
+    for frame in frames:
+        decode(frame)
+
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        for frame in frames:
+            decode(frame)
+    return (time.perf_counter() - start) / (REPEAT * len(frames)) * 1e6
+
+
+if __name__ == '__main__':
+    for sample_name, messages in (('ftx', load_ftx_messages()), ('dydx', load_dydx_messages())):
+        frames = [message.encode() for message in messages]
+        mean_size = sum(len(frame) for frame in frames) / len(frames)
+        print('{}: {} messages, {:.0f} bytes per message'.format(sample_name, len(messages), mean_size))
+
+        for name, loads in JSON_DECODERS.items():
+            paths = (('str', lambda frame: loads(frame.decode('utf-8'))), ('bytes', loads))
+            for path_name, decode in paths:
+                per_message_us = measure(decode, frames)
+                print('    {:<8} {:<6} {:8.2f} us/message {:8.1f} MB/s'.format(
+                    name, path_name, per_message_us, mean_size / per_message_us))
@@ -0,0 +1,96 @@
+"""
+Compare the FTX order book processors on the update path and on depth queries, to choose a book_type.
+
+Scenarios:
+    - replay: the recorded messages in tests/ftx/samples/orderbooks.txt, with the book rebuilt only when the
+      visible levels have changed, as FtxManager does
+    - deep book: a synthetic book of LEVELS contiguous ticks per side around the mid, updated at random levels
+      (a tenth of the updates empty a level, which is refilled later) while the mid drifts
+    - deep query: the deep book, reading the cumulative size of the best QUERY_LEVELS levels after every update
+
+Run from the python working directory:
+    python -m benchmarks.bench_ladder
+"""
+import random
+import time
+import numpy as np
+import gateways.ftx.ftx as ftx
+from benchmarks.bench_book_objects import load_messages
+
+PROCESSORS = (ftx.OrderBookProcessor, ftx.SortedOrderBookProcessor, ftx.LadderOrderBookProcessor)
+REPEAT = 200
+LEVELS = 2000
+UPDATES = 50000
+QUERY_LEVELS = 200
+
+
+def replay(processor, messages: [dict]) -> None:
+    for message in messages:
+        processor.handle(message)
+        if processor.changed:
+            processor.get_orderbook()
+
+
+def deep_book_messages(seed: int = 1) -> [dict]:
+    """ A partial of LEVELS ticks per side, then single level updates around a drifting mid """
+    rng = random.Random(seed)
+    mid = 40000
+    bids = [[float(mid - i), 1.0] for i in range(1, LEVELS + 1)]
+    asks = [[float(mid + i), 1.0] for i in range(1, LEVELS + 1)]
+    messages = [{'market': 'BTC-PERP', 'data': {'action': 'partial', 'time': 1.0, 'bids': bids, 'asks': asks}}]
+
+    book = {'bids': {price for price, _ in bids}, 'asks': {price for price, _ in asks}}
+    for i in range(UPDATES):
+        if i % 1000 == 0:
+            mid += rng.choice((-1, 1))
+        side = rng.choice(('bids', 'asks'))
+        distance = int(rng.expovariate(1 / 50)) % LEVELS + 1
+        price = float(mid - distance if side == 'bids' else mid + distance)
+
+        # only existing levels are emptied
+        if price in book[side] and rng.random() < 0.1:
+            size = 0.0
+            book[side].discard(price)
+        else:
+            size = round(rng.uniform(0.1, 5), 1)
+            book[side].add(price)
+
+        data = {'action': 'update', 'time': 2.0 + i, 'bids': [], 'asks': []}
+        data[side].append([price, size])
+        messages.append({'market': 'BTC-PERP', 'data': data})
+    return messages
+
+
+def cumulative_depth(processor, levels: int) -> np.ndarray:
+    if isinstance(processor, ftx.LadderOrderBookProcessor):
+        return processor.get_cumulative_depth('bids', levels)
+    if isinstance(processor, ftx.SortedOrderBookProcessor):
+        return np.cumsum([tier.size for tier in processor.get_tiers('bids', levels)])
+    return np.cumsum([size for _, size in sorted(processor._orderbooks['bids'].items(), reverse=True)[:levels]])
+
+
+def time_replay(processor_class, messages: [dict], repeat: int) -> float:
+    processor = processor_class('BTC-PERP', depth=5, tick_size=1.0)
+    replay(processor, messages)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        replay(processor, messages)
+    return (time.perf_counter() - start) / (repeat * len(messages)) * 1e6
+
+
+def time_deep_query(processor_class, messages: [dict]) -> float:
+    processor = processor_class('BTC-PERP', depth=5, tick_size=1.0)
+    start = time.perf_counter()
+    for message in messages:
+        processor.handle(message)
+        cumulative_depth(processor, QUERY_LEVELS)
+    return (time.perf_counter() - start) / len(messages) * 1e6
+
+
+if __name__ == '__main__':
+    samples = load_messages()
+    deep = deep_book_messages()
+    print('{:<28} {:>14} {:>14} {:>14}'.format('us/message', 'replay', 'deep book', 'deep query'))
+    for cls in PROCESSORS:
+        print('{:<28} {:>14.2f} {:>14.2f} {:>14.2f}'.format(
+            cls.__name__, time_replay(cls, samples, REPEAT), time_replay(cls, deep, 1), time_deep_query(cls, deep)))
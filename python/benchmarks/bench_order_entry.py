@@ -0,0 +1,110 @@
+"""
+Measure the time from the FtxManager.place_order() call to the order bytes being written to the socket, against a
+local HTTP server over a pooled keep-alive connection.
+
+Compared:
+    - before: the previous order entry path, which hashes the API secret again for every signature, prepares the
+      request twice, rounds the size with Decimal and formats the log line before sending
+    - after: FtxManager.place_order()
+
+Run from the python working directory:
+    python -m benchmarks.bench_order_entry
+"""
+import hmac
+import logging
+import os
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Thread
+from requests import Request
+import gateways.ftx.ftx as ftx
+from lib.http_client import HttpClient, TimedHTTPConnection
+from lib.interface import InstrumentDetails, NewOrderSingle, Side, OrderType
+
+ORDERS = 2000
+
+# time at which the last chunk of a request was written to the socket
+_last_send = [0.0]
+
+
+class OrdersHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        body = b'{"success": true, "result": {}}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def record_send(send):
+    def timed_send(self, data):
+        send(self, data)
+        _last_send[0] = time.perf_counter()
+    return timed_send
+
+
+def place_order_before(manager: ftx.FtxManager, nos: NewOrderSingle) -> str:
+    """ The order entry path before the fast path, kept here as the baseline """
+    client_id = manager._id_generator.next()
+    instrument_static = manager._instrument_static.get(nos.symbol)
+    data = ftx.get_place_order_message(nos, instrument_static, client_id)
+    logging.info('sending order: {}'.format(data))
+
+    request = Request('POST', manager._rest_url + '/orders', json=data)
+    ts = int(time.time() * 1000)
+    prepared = request.prepare()
+    signature_payload = f'{ts}{prepared.method}{prepared.path_url}'.encode()
+    if prepared.body:
+        signature_payload += prepared.body
+    signature = hmac.new(manager._api_secret.encode(), signature_payload, 'sha256').hexdigest()
+    request.headers['FTX-KEY'] = manager._api_key
+    request.headers['FTX-SIGN'] = signature
+    request.headers['FTX-TS'] = str(ts)
+
+    response = manager._http.send(request.prepare()).json()
+    logging.info(response)
+    return client_id if response['success'] else None
+
+
+def measure(place_order, manager: ftx.FtxManager, nos: NewOrderSingle) -> [float]:
+    """ Return the sorted call to socket times in microseconds """
+    for _ in range(100):
+        place_order(manager, nos)
+
+    delays = []
+    for _ in range(ORDERS):
+        start = time.perf_counter()
+        place_order(manager, nos)
+        delays.append((_last_send[0] - start) * 1e6)
+    return sorted(delays)
+
+
+if __name__ == '__main__':
+    # log lines are written, as in production, to a file
+    logging.basicConfig(level=logging.INFO, filename=os.devnull)
+    TimedHTTPConnection.send = record_send(TimedHTTPConnection.send)
+
+    server = ThreadingHTTPServer(('localhost', 0), OrdersHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://localhost:{}'.format(server.server_port)
+
+    manager = ftx.FtxManager('BTC-PERP', api_key='key', api_secret='secret')
+    manager._rest_url = url
+    manager._http = HttpClient(url, pool_size=1)
+    manager._instrument_static['BTC-PERP'] = InstrumentDetails('BTC-PERP', tick_size=1.0, quantity_size=0.0001)
+    order = NewOrderSingle('BTC-PERP', Side.Buy, 0.0123, OrderType.Limit, price=30000)
+
+    print('{} orders, call to bytes on socket in us'.format(ORDERS))
+    for name, place in (('before', place_order_before), ('after', ftx.FtxManager.place_order)):
+        delays = measure(place, manager, order)
+        print('{:<8} median {:>8.1f}   p99 {:>8.1f}'.format(name, delays[len(delays) // 2], delays[int(len(delays) * 0.99)]))
+
+    server.shutdown()
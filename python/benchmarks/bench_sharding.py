@@ -0,0 +1,107 @@
+"""
+Measure how the processing delay of FTX order book updates scales with the number of symbols, for one manager and
+for the symbols sharded over SHARDS managers (ShardedManager), each on its own event loop thread.
+
+Each manager reads from a stand-in websocket fed by a producer thread, every symbol receives updates in bursts of
+BURST messages at RATE messages per second on average. The delay is measured from the time the producer hands a
+message to the websocket (its 'time' field) to the depth callback.
+
+Run from the python working directory:
+    python -m benchmarks.bench_sharding
+"""
+import asyncio
+import json
+import random
+import time
+from threading import Thread
+import gateways.ftx.ftx as ftx
+from lib.sharding import ShardedManager
+
+SYMBOL_COUNTS = (4, 16, 64, 128)
+SHARDS = 4
+RATE = 50
+BURST = 10
+DURATION = 3.0
+
+
+class QueueWebSocket:
+    """ Stands in for the websocket of a manager, the frames are put from the producer thread """
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+        self._queue = asyncio.Queue()
+        self.messages = []
+
+    def put(self, frame: str) -> None:
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, frame)
+
+    async def recv(self) -> str:
+        return await self._queue.get()
+
+    async def send(self, message: str) -> None:
+        pass
+
+
+def book_frame(symbol: str, action: str, mid: int, rng: random.Random) -> str:
+    if action == 'partial':
+        bids = [[float(mid - i), 1.0] for i in range(1, 101)]
+        asks = [[float(mid + i), 1.0] for i in range(1, 101)]
+    else:
+        side = [[float(mid - rng.randint(1, 5)), round(rng.uniform(0.1, 5), 1)]]
+        bids, asks = (side, []) if rng.random() < 0.5 else ([], [[2 * mid - side[0][0], side[0][1]]])
+    return json.dumps({'channel': 'orderbook', 'market': symbol, 'type': action,
+                       'data': {'action': action, 'time': time.perf_counter(), 'checksum': 0,
+                                'bids': bids, 'asks': asks}})
+
+
+def run(symbol_count: int, shards: int) -> [float]:
+    """ Return the sorted delays in microseconds """
+    symbols = {'SYM{}-PERP'.format(i) for i in range(symbol_count)}
+    manager = ShardedManager(ftx.FtxManager, symbols, shards, name='bench')
+    delays = []
+
+    def on_book(symbol, book):
+        delays.append((time.perf_counter() - book.timestamp) * 1e6)
+
+    manager.register_depth_callback(on_book)
+
+    sockets = {}
+    for shard in manager.managers:
+        shard._ws = QueueWebSocket(shard._loop)
+        shard._loop_thread.start()
+        for symbol in shard._symbol:
+            sockets[symbol] = shard._ws
+
+    rng = random.Random(1)
+    for symbol in symbols:
+        sockets[symbol].put(book_frame(symbol, 'partial', 40000, rng))
+    time.sleep(0.5)
+    delays.clear()
+
+    # bursts of updates of random symbols, RATE updates per second per symbol on average
+    interval = BURST / (RATE * symbol_count)
+    symbol_list = sorted(symbols)
+    start = time.perf_counter()
+    next_burst = start
+    while next_burst - start < DURATION:
+        now = time.perf_counter()
+        if now < next_burst:
+            time.sleep(min(next_burst - now, 0.001))
+            continue
+        symbol = rng.choice(symbol_list)
+        for _ in range(BURST):
+            sockets[symbol].put(book_frame(symbol, 'update', 40000, rng))
+        next_burst += rng.expovariate(1 / interval)
+
+    time.sleep(0.5)
+    manager.stop()
+    return sorted(delays)
+
+
+if __name__ == '__main__':
+    print('{} updates per symbol per second in bursts of {}, delay to depth callback in us'.format(RATE, BURST))
+    print('{:>8} {:>7} {:>10} {:>10} {:>10}'.format('symbols', 'shards', 'updates', 'median', 'p99'))
+    for count in SYMBOL_COUNTS:
+        for shards in (1, SHARDS):
+            result = run(count, shards)
+            print('{:>8} {:>7} {:>10} {:>10.0f} {:>10.0f}'.format(
+                count, shards, len(result), result[len(result) // 2], result[int(len(result) * 0.99)]))
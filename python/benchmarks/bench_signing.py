@@ -0,0 +1,65 @@
+"""
+Measure the time to get the STARK signature of a dYdX order, as paid by DydxManager.place_order() before the request
+is sent.
+
+Compared:
+    - inline: the dydx3 client signing on the order entry thread, as without signing workers
+    - on demand: an order that was not pre-signed, signed on the process pool
+    - pre-signed: an order of the grid pre-signed around the book
+
+Run from the python working directory:
+    python -m benchmarks.bench_signing
+"""
+import time
+from gateways.dydx.stark_signing import StarkOrderSigner, sign_order
+from lib.identifier import OrderIdGenerator
+from lib.orderbook import PriceTicks
+
+ORDERS = 50
+STARK_PRIVATE_KEY = '0x' + '1' * 63
+NETWORK_ID = 1
+POSITION_ID = 12345
+
+
+def report(name: str, delays: [float]) -> None:
+    delays = sorted(delays)
+    print('{:<12} median {:>10.1f}   max {:>10.1f}'.format(name, delays[len(delays) // 2], delays[-1]))
+
+
+if __name__ == '__main__':
+    ids = OrderIdGenerator('bench')
+    signer = StarkOrderSigner(NETWORK_ID, STARK_PRIVATE_KEY, ids)
+    signer.prewarm()
+    signer.position_id = POSITION_ID
+    expiration = signer.expiration(3600)
+    price_ticks = PriceTicks(1.0)
+
+    print('{} orders, time to signature in us'.format(ORDERS))
+
+    delays = []
+    for i in range(ORDERS):
+        start = time.perf_counter()
+        sign_order(NETWORK_ID, STARK_PRIVATE_KEY, POSITION_ID, ids.next(), 'BTC-USD', 'BUY', '0.01',
+                   price_ticks.to_str(40000 - i), '0.001', expiration)
+        delays.append((time.perf_counter() - start) * 1e6)
+    report('inline', delays)
+
+    delays = []
+    for i in range(ORDERS):
+        start = time.perf_counter()
+        signer.sign('BTC-USD', 'BUY', '0.02', price_ticks.to_str(40000 - i), '0.001', expiration)
+        delays.append((time.perf_counter() - start) * 1e6)
+    report('on demand', delays)
+
+    signer.presign_grid('BTC-USD', 40000, 40001, ['0.03'], ORDERS, price_ticks, '0.001', expiration)
+    while signer.get_stats()['pending']:
+        time.sleep(0.1)
+    delays = []
+    for i in range(ORDERS):
+        start = time.perf_counter()
+        signer.sign('BTC-USD', 'BUY', '0.03', price_ticks.to_str(40000 - i), '0.001', expiration)
+        delays.append((time.perf_counter() - start) * 1e6)
+    report('pre-signed', delays)
+
+    print(signer.get_stats())
+    signer.shutdown()
@@ -20,15 +20,65 @@ import websockets
 import asyncio
 import time
 import json
-from threading import Thread
-from lib.interface import OrderBook, Tier, Order, Side, NewOrderSingle, OrderType, InstrumentDetails
+from threading import Thread, Lock
+from lib.interface import OrderBook, Tier, Order, Side, NewOrderSingle, OrderType, InstrumentDetails, BookDelta
 import logging
-from lib.math_utils import to_nearest
+import sys
+from types import FunctionType, MethodType
 from collections import defaultdict
 from typing import DefaultDict
-from operator import itemgetter
-from datetime import datetime, timedelta
 from lib.identifier import OrderIdGenerator
+from lib.orderbook import SortedBookSide, PriceTicks, OrderBookView, BookChannelError, BOOK_SIDES
+from lib.ladder import PriceLadder, BID, ASK, DEFAULT_CAPACITY
+from lib.conflation import BookConflator
+from lib.dispatcher import CallbackDispatcher
+from lib.subscribers import SubscriberRegistry, Subscriber, INLINE
+from lib.json_decoder import get_json_decoder
+from lib.ws_protocol import BytesClientProtocol
+from lib.router import MessageRouter
+from lib.arbitration import FeedArbiter
+from lib.runtime import GatewayRuntime
+from lib.metrics import DurationStats
+from lib.order_entry import OrderEntryExecutor, OrderResult, ClosedOrders, DEFAULT_ORDER_WORKERS
+from concurrent.futures import Future
+from lib.http_client import HttpClient, DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT
+from gateways.dydx.stark_signing import StarkOrderSigner, DEFAULT_PRESIGN_CACHE_SIZE
+import dydx3.helpers.requests as dydx_requests
+
+
+# tombstones older than this number of offsets behind the latest update are evicted
+DEFAULT_TOMBSTONE_WINDOW = 100000
+
+# lifetime in seconds of the orders, the minimum expiration time is 1 minute
+LIMIT_ORDER_LIFETIME = 3600
+IOC_ORDER_LIFETIME = 300
+
+LIMIT_FEE = '0.001'
+
+
+def _request_function(http: HttpClient):
+    """ A copy of dydx3.helpers.requests.request() that sends its requests through an HttpClient """
+    def send_request(uri, method, headers=None, **kwargs):
+        return http.request(method.upper(), uri, headers=headers, **kwargs)
+
+    request = dydx_requests.request
+    request_globals = dict(vars(dydx_requests), send_request=send_request)
+    return FunctionType(request.__code__, request_globals, request.__name__, request.__defaults__)
+
+
+def _use_http_client(module, request) -> None:
+    """
+        Bind the methods of a dydx3 client module, e.g. Public or Private, that call the module-level request() to
+        the given request function, on this module instance only
+    """
+    if getattr(module, '_dydx_request', None) is request:
+        return
+    module_globals = dict(sys.modules[type(module).__module__].__dict__, request=request)
+    for name, method in vars(type(module)).items():
+        if isinstance(method, FunctionType) and 'request' in method.__code__.co_names:
+            bound = FunctionType(method.__code__, module_globals, name, method.__defaults__, method.__closure__)
+            setattr(module, name, MethodType(bound, module))
+    module._dydx_request = request
 
 
 class ReadyCheck:
@@ -59,7 +109,21 @@ class DydxManager:
                  api_k=None,
                  api_p=None,
                  name='dydx',
-                 depth_levels=5):
+                 depth_levels=5,
+                 book_type='sorted',
+                 lazy_books=False,
+                 conflate=False,
+                 dispatcher: CallbackDispatcher = None,
+                 json_decoder='json',
+                 bytes_frames=False,
+                 order_workers=DEFAULT_ORDER_WORKERS,
+                 http_pool_size=None,
+                 http_timeouts=(DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT),
+                 tombstone_window=DEFAULT_TOMBSTONE_WINDOW,
+                 signing_workers=0,
+                 presign_cache_size=DEFAULT_PRESIGN_CACHE_SIZE,
+                 book_feeds=1,
+                 runtime: GatewayRuntime = None):
 
         # support string or set of string
         if isinstance(symbol, str):
@@ -98,8 +162,12 @@ class DydxManager:
         self._conn = None
         self._ws = None
 
-        # to run async io
-        self._loop = asyncio.new_event_loop()
+        # to run async io, the event loop is shared with other gateways on a runtime, otherwise run on a dedicated thread
+        self._name = name
+        self._runtime = runtime
+        if runtime:
+            runtime.register(name)
+        self._loop = runtime.loop if runtime else asyncio.new_event_loop()
 
         # to store instrument static data
         self._instrument_static = {}
@@ -107,8 +175,24 @@ class DydxManager:
         # positions
         self._positions = {}
 
-        # open orders
+        # open orders, also updated by the order entry threads as soon as an order is placed or canceled
         self._open_orders = {}
+        self._orders_lock = Lock()
+        self._closed_orders = ClosedOrders()
+
+        # orders are signed and sent from a thread pool, so several can be in flight
+        self._order_entry = OrderEntryExecutor(order_workers, name='{}-orders'.format(name))
+
+        # keep-alive connections shared by all the REST calls, by default one per order worker. The dydx3 client sends
+        # its requests through a module-level session, the modules of this manager's client are bound to this pool
+        # instead, see _use_http_client(), so that each manager has its own connections and the dydx3 session is left
+        # untouched. Each order worker has its own session on the pool, see OrderEntryExecutor
+        connect_timeout, read_timeout = http_timeouts
+        self._http = HttpClient(API_HOST_MAINNET, pool_size=http_pool_size or order_workers,
+                                connect_timeout=connect_timeout, read_timeout=read_timeout,
+                                headers=dict(dydx_requests.session.headers))
+        self._dydx_request = _request_function(self._http)
+        _use_http_client(self._client_public, self._dydx_request)
 
         # StarkWare-specific positionId. This is required for signing and can be fetched from the account endpoints.
         self._position_id = None
@@ -116,19 +200,59 @@ class DydxManager:
         # to signal reconnect
         self._signal_reconnect = False
 
-        # this is a dedicated thread to run all async concurrent tasks
-        self._loop_thread = Thread(target=self._run_async_tasks, daemon=True, name=name)
+        # this is a dedicated thread to run all async concurrent tasks, none on a runtime
+        self._loop_thread = None if runtime else Thread(target=self._run_async_tasks, daemon=True, name=name)
+
+        # account events received while the REST snapshots are requested, applied on top of them, see _on_snapshot
+        self._account_buffer = None
+        self._snapshot_generation = 0
+
+        # symbols whose order book is resubscribed -> time.time_ns() of the failure, failures and recovery times
+        self._recovering = {}
+        self._book_failures = defaultdict(int)
+        self._book_recoveries = defaultdict(DurationStats)
+
+        # time to reconnect and resubscribe the websocket, and to request the REST snapshots
+        self._reconnect_downtime = DurationStats()
+        self._snapshot_duration = DurationStats()
 
         # readiness and circuit breaker flag
         self._ready_check = ReadyCheck()
 
         # order book processor, one per symbol
+        if book_type not in BOOK_PROCESSORS:
+            raise ValueError('book_type must be one of {}'.format(list(BOOK_PROCESSORS)))
+        processor_class = BOOK_PROCESSORS[book_type]
         self._orderbook_processors = {}
         self._orderbooks = {}
         for sym in self._symbol:
-            self._orderbook_processors[sym] = OrderBookProcessor(sym, depth=depth_levels)
+            self._orderbook_processors[sym] = processor_class(sym, depth=depth_levels, lazy=lazy_books,
+                                                              tombstone_window=tombstone_window)
             self._orderbooks[sym] = None
 
+        # publish the books once per batch of buffered messages instead of once per message
+        self._conflator = BookConflator() if conflate else None
+
+        # run the depth and execution callbacks on the dispatcher thread instead of the event loop
+        if dispatcher and lazy_books:
+            raise ValueError('lazy_books cannot be used with a dispatcher, books are read from another thread')
+        self._dispatcher = dispatcher
+
+        # additional depth and execution subscribers, each with its own delivery policy
+        self._lazy_books = lazy_books
+        self._subscribers = SubscriberRegistry(name)
+
+        # websocket message decoding, bytes_frames passes the raw frame bytes to the decoder
+        self._json_loads = get_json_decoder(json_decoder)
+        self._ws_protocol = BytesClientProtocol if bytes_frames else None
+        self._router = self._init_router()
+
+        # with several book feeds, the order books are also received over book_feeds - 1 market data connections and
+        # each update is applied from the first connection delivering it, the main connection is feed 0
+        self._book_feeds = book_feeds
+        self._arbiter = FeedArbiter(book_feeds) if book_feeds > 1 else None
+        self._feed_ws = {}
+
         # to measure price cross duration
         self._price_cross_timer = None
 
@@ -139,23 +263,57 @@ class DydxManager:
         # client order id generator
         self._id_generator = OrderIdGenerator(prefix=name)
 
+        # price and size rounding of each instrument, the strings sent are also the keys of the pre-signed orders
+        self._price_ticks = {}
+        self._quantity_ticks = {}
+
+        # with signing workers, orders are signed on a process pool and can be pre-signed, see presign_orders(),
+        # otherwise the dydx3 client signs them on the order entry thread
+        self._signer = None
+        if self._has_keys and signing_workers:
+            self._signer = StarkOrderSigner(NETWORK_ID_MAINNET, stark_private_key, self._id_generator,
+                                            workers=signing_workers, cache_size=presign_cache_size)
+
     def connect(self):
         logging.info('Initializing connection')
 
+        if self._dispatcher:
+            self._dispatcher.start()
+
+        # open the REST connections ahead of the first order
+        self._http.prewarm()
+        if self._signer:
+            self._signer.prewarm()
+
         # get instrument static data
         self._get_static()
+        self._set_book_tick_sizes()
 
-        self._loop.run_until_complete(self._reconnect_ws())
+        if self._runtime:
+            self._runtime.run(self._name, self._reconnect_ws())
 
-        logging.info("starting event loop thread")
-        self._loop_thread.start()
+            logging.info("starting tasks on the runtime")
+            for coro in self._async_tasks():
+                self._runtime.spawn(self._name, coro)
+        else:
+            self._loop.run_until_complete(self._reconnect_ws())
+
+            logging.info("starting event loop thread")
+            self._loop_thread.start()
 
     def reconnect(self):
         """ A signal to reconnect """
         self._signal_reconnect = True
 
+    def _set_book_tick_sizes(self):
+        """ Key the order books by integer ticks of each instrument """
+        for sym, processor in self._orderbook_processors.items():
+            instrument_static = self._instrument_static.get(sym)
+            if instrument_static:
+                processor.set_tick_size(instrument_static.tick_size)
+
     def _init_cache(self):
-        # initialize data with REST APIs
+        # initialize data with REST APIs, on an executor thread
         if self._has_keys:
             self._get_account()
             self._get_positions()
@@ -163,17 +321,20 @@ class DydxManager:
         else:
             logging.info('Not getting account, position and order snapshot due to missing keys')
 
-        self._ready_check.snapshot_ready = True
-
     async def _reconnect_ws(self):
         self._ready_check = ReadyCheck()
 
         # get the private module
         if self._has_keys:
             self._client_private = self._client.private
+            _use_http_client(self._client_private, self._dydx_request)
 
-        # initialize cache
-        self._init_cache()
+        # every book is subscribed again
+        self._recovering.clear()
+
+        # account events are buffered from the subscription until the REST snapshots are done
+        self._snapshot_generation += 1
+        self._account_buffer = []
 
         # ws connect and authenticate
         await self._connect_authenticate_ws()
@@ -184,11 +345,40 @@ class DydxManager:
         logging.info('WS - Connected')
         self._ready_check.ws_connected = True
 
+        # initialize cache on a thread, the market data is processed meanwhile
+        generation = self._snapshot_generation
+        start = time.time_ns()
+        snapshot = self._loop.run_in_executor(None, self._init_cache)
+        snapshot.add_done_callback(lambda future: self._on_snapshot(generation, start, future))
+
+    def _on_snapshot(self, generation: int, start: int, future: asyncio.Future):
+        """ Apply the account events buffered while the REST snapshots were requested, on the event loop """
+        if generation != self._snapshot_generation:
+            # superseded by a later reconnect
+            return
+
+        buffered, self._account_buffer = self._account_buffer, None
+        if future.exception():
+            logging.error('failed to initialize cache, reconnecting: %s', future.exception())
+            self._signal_reconnect = True
+            return
+        self._snapshot_duration.add(time.time_ns() - start)
+
+        # the account messages carry the orders by order id and the absolute position sizes, applied in order they
+        # leave the store as of the last message
+        for data in buffered:
+            self._on_accounts(data)
+
+        logging.info('Snapshot ready, %s buffered account events', len(buffered))
+        self._ready_check.snapshot_ready = True
+
     async def _connect_authenticate_ws(self):
         logging.info('WS - Connecting')
-        self._conn = websockets.connect(self._ws_url)
+        self._conn = websockets.connect(self._ws_url, create_protocol=self._ws_protocol)
         try:
             self._ws = await self._conn.__aenter__()
+            if self._arbiter:
+                self._arbiter.feed_up(0)
         except Exception as e:
             logging.error(e)
 
@@ -236,14 +426,24 @@ class DydxManager:
 
     def stop(self):
         logging.info("stopping")
-        self._loop.stop()
+        if self._runtime:
+            self._runtime.unregister(self._name)
+        else:
+            self._loop.stop()
+        if self._signer:
+            self._signer.shutdown(wait=False)
         self._ready_check = None
 
     def _run_async_tasks(self):
         """ Run the following tasks concurrently in the current thread """
-        self._loop.create_task(self._listen_forever())
+        for coro in self._async_tasks():
+            self._loop.create_task(coro)
         self._loop.run_forever()
 
+    def _async_tasks(self) -> list:
+        """ The coroutines run for the lifetime of the gateway, on its own loop thread or on the runtime """
+        return [self._listen_forever()] + [self._listen_book_feed(feed) for feed in range(1, self._book_feeds)]
+
     async def _listen_forever(self):
         """ This is the main callback that process incoming WebSocket messages from server """
 
@@ -252,7 +452,11 @@ class DydxManager:
             if not self._ws:
                 logging.error("websocket disconnected, reconnecting")
                 self._ready_check.ws_connected = False
+                if self._arbiter:
+                    self._arbiter.feed_down(0)
+                start = time.time_ns()
                 await self._reconnect_ws()
+                self._reconnect_downtime.add(time.time_ns() - start)
 
             if self._signal_reconnect:
                 logging.info("received reconnect signal")
@@ -266,11 +470,10 @@ class DydxManager:
                 response = await asyncio.wait_for(self._ws.recv(), timeout=10)
 
                 # process the message
-                if response == 'ping':
-                    logging.info("Received ping")
-                    await self._send_ws('pong')
-                else:
-                    self._process_websocket_message(response)
+                await self._handle_response(response)
+
+                if self._conflator:
+                    await self._drain_buffered_messages()
 
             except (asyncio.TimeoutError, websockets.exceptions.ConnectionClosed) as e:
                 logging.error('connection issue, resetting ws: %s' % e)
@@ -278,81 +481,236 @@ class DydxManager:
                 self._ready_check.ws_connected = False
                 self._ws = None
 
+            except BookChannelError as e:
+                logging.error('%s, resubscribing: %s', e, e.__cause__)
+                await self._resubscribe_book(e.symbol)
+
             except Exception as e:
                 logging.error('encountered issue, resetting ws: %s' % e)
                 logging.error('last response: %s' % response)
                 self._ready_check.ws_connected = False
                 self._ws = None
 
-    def _process_websocket_message(self, message: str):
-        # convert JSON string to data dictionary
-        data = json.loads(message)
+    async def _handle_response(self, response: str):
+        if response == 'ping' or response == b'ping':
+            logging.info("Received ping")
+            await self._send_ws('pong')
+        else:
+            self._process_websocket_message(response)
+
+    async def _drain_buffered_messages(self, ws=None, handle=None):
+        """ Apply the messages already received by the websocket, by default the main one, then publish the changed
+            books once """
+        ws = ws or self._ws
+        handle = handle or self._handle_response
+        conflator = self._conflator
+        count = 1
+        while ws.messages and count < conflator.max_batch:
+            await handle(await ws.recv())
+            count += 1
+        conflator.message_count += count
+
+        for market, processor in conflator.drain():
+            try:
+                self._publish_book(market, processor)
+            except Exception as e:
+                raise BookChannelError(market) from e
 
-        data_type = data['type']
+    async def _listen_book_feed(self, feed: int):
+        """ Receive the order books over an additional connection, arbitrated with the other feeds """
+        router = self._init_book_feed_router(feed)
+        ws = None
 
-        if 'connected' == data_type:
-            logging.info(message)
-            return
+        async def handle(response):
+            if response == 'ping' or response == b'ping':
+                await ws.send('pong')
+            else:
+                router.route(response)
 
-        if 'error' == data_type:
-            # {"type":"error","message":"Invalid message: could not parse","connection_id":"decf6ea9-5531-4a3a-aae7-f1580bfbd003","message_id":416}
-            logging.error('encountered error message: %s' % message)
-            return
+        while True:
+            try:
+                if ws is None:
+                    logging.info('WS - Connecting order book feed %s', feed)
+                    ws = await websockets.connect(self._ws_url, create_protocol=self._ws_protocol)
+                    self._feed_ws[feed] = ws
+                    self._arbiter.feed_up(feed)
+                    for sym in self._symbol:
+                        await ws.send(json.dumps({'type': 'subscribe', 'channel': 'v3_orderbook', 'id': sym,
+                                                  'includeOffsets': True}))
 
-        channel = data['channel']
+                await handle(await asyncio.wait_for(ws.recv(), timeout=10))
 
-        if 'v3_accounts' == channel:
-            logging.info(message)
-            contents = data['contents']
+                if self._conflator:
+                    await self._drain_buffered_messages(ws, handle)
 
-            if 'orders' in contents and contents['orders']:
-                order_events = process_orders_ws(contents['orders'], self._open_orders)
+            except BookChannelError as e:
+                logging.error('%s, resubscribing: %s', e, e.__cause__)
+                await self._resubscribe_book(e.symbol)
+
+            except Exception as e:
+                logging.error('order book feed %s: connection issue, reconnecting: %s', feed, e)
+                self._feed_ws.pop(feed, None)
+                self._arbiter.feed_down(feed)
+                ws = None
+                await asyncio.sleep(1)
+
+    async def _resubscribe_book(self, symbol: str):
+        """ Unsubscribe and subscribe again the order book of one symbol, the other channels are kept """
+        self._book_failures[symbol] += 1
+        self._recovering[symbol] = time.time_ns()
+        if self._arbiter:
+            self._arbiter.reset(symbol)
+        try:
+            await self._send_ws(json.dumps({'type': 'unsubscribe', 'channel': 'v3_orderbook', 'id': symbol}))
+            await self._send_ws(json.dumps({'type': 'subscribe', 'channel': 'v3_orderbook', 'id': symbol,
+                                            'includeOffsets': True}))
+        except Exception as e:
+            logging.error('failed to resubscribe %s, resetting ws: %s', symbol, e)
+            self._ready_check.ws_connected = False
+            self._ws = None
+
+    def _on_book_recovered(self, symbol: str):
+        start = self._recovering.pop(symbol)
+        self._book_recoveries[symbol].add(time.time_ns() - start)
+        logging.info('order book of %s recovered', symbol)
+
+    def _publish_book(self, market: str, processor):
+        """ Rebuild the book of a market and pass it to the depth callback """
+        order_book = processor.get_orderbook()
+        self._orderbooks[market] = order_book
+
+        if self._depth_callback:
+            if self._dispatcher:
+                self._dispatcher.submit_book(self._depth_callback, market, order_book)
+            else:
+                self._depth_callback(market, order_book)
+
+        self._subscribers.publish_book(market, order_book)
 
+    def _process_websocket_message(self, message: str):
+        self._router.route(message)
+
+    def _init_router(self) -> MessageRouter:
+        """ Route the frames by type and channel, the messages that are only logged are not decoded """
+        router = MessageRouter(self._json_loads)
+        router.add_route('connected', '"type":"connected"', logging.info, decode=False)
+        # {"type":"error","message":"Invalid message: could not parse","connection_id":"decf6ea9-5531-4a3a-aae7-f1580bfbd003","message_id":416}
+        router.add_route('error', '"type":"error"', self._on_error, decode=False)
+        router.add_route('v3_orderbook', '"v3_orderbook"', self._on_orderbook)
+        router.add_route('v3_accounts', '"v3_accounts"', self._on_accounts)
+        router.set_default(logging.info)
+        return router
+
+    def _init_book_feed_router(self, feed: int) -> MessageRouter:
+        """ Route the frames of an additional book feed, only the order books are processed """
+        router = MessageRouter(self._json_loads)
+        router.add_route('connected', '"type":"connected"', logging.info, decode=False)
+        router.add_route('error', '"type":"error"', self._on_error, decode=False)
+        router.add_route('v3_orderbook', '"v3_orderbook"', lambda data: self._on_orderbook(data, feed))
+        router.set_default(logging.info)
+        return router
+
+    def _on_error(self, message: str):
+        logging.error('encountered error message: %s' % message)
+
+    def _on_accounts(self, data: dict):
+        if self._account_buffer is not None:
+            self._account_buffer.append(data)
+            return
+
+        logging.info(data)
+        contents = data['contents']
+
+        if 'orders' in contents and contents['orders']:
+            with self._orders_lock:
+                order_events = process_orders_ws(contents['orders'], self._open_orders)
                 for order_event in order_events:
-                    if order_event and self._id_generator.match(order_event.client_id):
-                        if self._execution_callback:
-                            # callback if this order event is originated from this connection
+                    if order_event.status is not OrderStatus.OPEN:
+                        self._closed_orders.add(order_event.order_id)
+
+            for order_event in order_events:
+                if order_event and self._id_generator.match(order_event.client_id):
+                    if self._execution_callback:
+                        # callback if this order event is originated from this connection
+                        if self._dispatcher:
+                            self._dispatcher.submit_event(self._execution_callback, order_event)
+                        else:
                             self._execution_callback(order_event)
-                    else:
-                        logging.info("Received execution that is not originated from this connection")
 
-            if 'positions' in contents and contents['positions']:
-                process_positions_ws(contents['positions'], self._positions)
+                    self._subscribers.publish_event(order_event)
+                else:
+                    logging.info("Received execution that is not originated from this connection")
 
-            if 'fills' in contents and contents['fills']:
-                pass
+        if 'positions' in contents and contents['positions']:
+            process_positions_ws(contents['positions'], self._positions)
 
-            if not self._ready_check.account_stream_ready:
-                logging.info('Websocket account stream ready')
-                self._ready_check.account_stream_ready = True
-
-        elif 'v3_orderbook' == channel:
-            # logging.info('book -> %s' % message)
-
-            market = data['id']
-            processor = self._orderbook_processors.get(market)
-            processor.handle(data)
-            updated_order_book = processor.get_orderbook()
-            self._orderbooks[market] = updated_order_book
-
-            if data_type == 'subscribed':
-                """ we have received initial snapshot """
-                logging.info('Websocket depth snapshot: {}'.format(message))
-                # check if we have snapshot for all symbols
-                all_depth_ready = True
-                for symbol, processor in self._orderbook_processors.items():
-                    if not processor.ready():
-                        all_depth_ready = False
-                        break
-
-                if all_depth_ready:
-                    logging.info('Websocket depth stream ready')
-                    self._ready_check.depth_stream_ready = True
-                else:
-                    logging.info('Websocket depth stream not ready yet')
+        if 'fills' in contents and contents['fills']:
+            pass
+
+        if not self._ready_check.account_stream_ready:
+            logging.info('Websocket account stream ready')
+            self._ready_check.account_stream_ready = True
 
-            if self._depth_callback:
-                self._depth_callback(market, updated_order_book)
+    def _on_orderbook(self, data: dict, feed: int = 0):
+        # logging.info('book -> %s' % data)
+
+        market = data['id']
+        recovering = market in self._recovering
+        if recovering and data['type'] != 'subscribed':
+            # updates of the previous subscription and the unsubscribed response, until the new snapshot
+            return
+
+        if self._arbiter and not self._arbitrate(market, data, feed):
+            # already received over another feed
+            return
+
+        try:
+            self._handle_orderbook(market, data)
+        except Exception as e:
+            raise BookChannelError(market) from e
+
+        if recovering:
+            self._on_book_recovered(market)
+
+    def _handle_orderbook(self, market: str, data: dict):
+        processor = self._orderbook_processors.get(market)
+        processor.handle(data)
+
+        if data['type'] == 'subscribed':
+            """ we have received initial snapshot """
+            logging.info('Websocket depth snapshot: {}'.format(data))
+            self._check_depth_ready()
+
+        # skip the rebuild and callback if the update is outside of the visible depth
+        if processor.changed:
+            if self._conflator:
+                self._conflator.add(market, processor)
+            else:
+                self._publish_book(market, processor)
+
+    def _check_depth_ready(self):
+        # check if we have snapshot for all symbols
+        all_depth_ready = all(p.ready() for p in self._orderbook_processors.values())
+
+        if all_depth_ready:
+            logging.info('Websocket depth stream ready')
+            self._ready_check.depth_stream_ready = True
+        else:
+            logging.info('Websocket depth stream not ready yet')
+
+    def _arbitrate(self, market: str, data: dict, feed: int) -> bool:
+        """ Return True if the order book message is the first copy received, identified by its offset """
+        action = data['type']
+        if action == 'channel_data':
+            return self._arbiter.accept(feed, market, int(data['contents']['offset']))
+
+        if action == 'subscribed':
+            if self._arbiter.accept_snapshot(feed, market):
+                return True
+            # the book is kept up to date by another feed
+            self._check_depth_ready()
+            return False
+        return True
 
     """ ----------------------------------- """
     """             REST API                """
@@ -373,12 +731,16 @@ class DydxManager:
         response = self._client_private.get_account()
         data = response.data
         self._position_id = data['account']['positionId']
+        if self._signer:
+            self._signer.position_id = self._position_id
 
     def _get_orders(self):
         logging.info('REST - Requesting open orders')
         response = self._client_private.get_orders()
         all_orders = response.data
-        self._open_orders = process_orders(all_orders)
+        open_orders = process_orders(all_orders)
+        with self._orders_lock:
+            self._open_orders = open_orders
 
     def _get_positions(self):
         logging.info('REST - Requesting positions')
@@ -396,8 +758,11 @@ class DydxManager:
         return self._ready_check is not None and self._ready_check.not_ready()
 
     def get_ticker(self, contract_name: str) -> OrderBook:
-        """ To get latest orderbook """
-        return self._orderbooks.get(contract_name)
+        """ To get latest orderbook, with lazy_books only its top of book as the view reads the event loop books """
+        order_book = self._orderbooks.get(contract_name)
+        if self._lazy_books and order_book:
+            return order_book.top_of_book()
+        return order_book
 
     def register_depth_callback(self, callback):
         """ a depth callback function takes two argument: (contract_name:str, book: OrderBook) """
@@ -409,6 +774,43 @@ class DydxManager:
         assert_param_counts(callback, 1)
         self._execution_callback = callback
 
+    def add_depth_subscriber(self, callback, policy: str = INLINE, symbols: {str} = None) -> Subscriber:
+        """ add a depth callback function next to the registered one: (contract_name:str, book: OrderBook)
+            policy is one of inline, threaded or conflated, symbols restricts the books delivered (all if None) """
+        assert_param_counts(callback, 2)
+        if self._lazy_books and policy != INLINE:
+            raise ValueError('lazy_books can only be delivered inline, books are read from another thread')
+        return self._subscribers.add_depth(callback, policy, symbols)
+
+    def add_execution_subscriber(self, callback, policy: str = INLINE, symbols: {str} = None) -> Subscriber:
+        """ add an execution callback function next to the registered one: (event: OrderEvent)
+            events are never conflated, a conflated subscriber receives every event in order """
+        assert_param_counts(callback, 1)
+        return self._subscribers.add_execution(callback, policy, symbols)
+
+    def remove_subscriber(self, subscriber: Subscriber):
+        self._subscribers.remove(subscriber)
+
+    def get_http_timings(self) -> list:
+        """ Return the latency breakdown (RequestTiming) of the latest REST requests, oldest first """
+        return list(self._http.timings)
+
+    def get_message_rates(self) -> dict:
+        """ Return the number of websocket messages per second of each channel since the previous call """
+        return self._router.get_rates()
+
+    def get_conflation_stats(self) -> dict:
+        """ Return the number of batches, messages, visible book updates and updates conflated into a later book """
+        return self._conflator.get_stats() if self._conflator else {}
+
+    def register_delta_callback(self, callback):
+        """ a delta callback function takes two arguments: (contract_name:str, delta: BookDelta)
+            it is called from the order book processor with the level changes of every message, stale updates
+            (offset not higher than the level offset) are not included """
+        assert_param_counts(callback, 2)
+        for processor in self._orderbook_processors.values():
+            processor.delta_callback = callback
+
     def get_delta(self, contract_name: str) -> float:
         """ To get position from position manager """
         if contract_name in self._positions:
@@ -428,30 +830,36 @@ class DydxManager:
 
     def place_order(self, nos: NewOrderSingle) -> str:
         """ Place an order. Return client order id """
-        client_id = self._id_generator.next()
-        order_type = None
-        time_in_force = None
-        expiration_epoch_seconds = None
+        return self._place_order(nos).client_id
 
+    def _place_order(self, nos: NewOrderSingle) -> OrderResult:
         if nos.type is OrderType.Limit:
             order_type = ORDER_TYPE_LIMIT
             time_in_force = TIME_IN_FORCE_GTT
             # to expire one hour from now
-            expiration_epoch = datetime.utcnow() + timedelta(hours=1)
-
+            lifetime = LIMIT_ORDER_LIFETIME
         elif nos.type is OrderType.IOC:
             order_type = ORDER_TYPE_LIMIT
             time_in_force = TIME_IN_FORCE_IOC
             # minimum expiration time is 1 minute
-            expiration_epoch = datetime.utcnow() + timedelta(minutes=5)
+            lifetime = IOC_ORDER_LIFETIME
         else:
             raise Exception("Unsupported order type")
 
-        size = str(to_nearest(nos.quantity, self._instrument_static.get(nos.symbol).qty_increment))
-        price = str(nos.price)
+        price_ticks, quantity_ticks = self._get_ticks(nos.symbol)
+        size = quantity_ticks.to_str(quantity_ticks.to_ticks(nos.quantity))
+        price = price_ticks.to_str(price_ticks.to_ticks(nos.price))
         side = ORDER_SIDE_BUY if nos.side == Side.Buy else ORDER_SIDE_SELL
 
-        expiration_iso = expiration_epoch.strftime('%Y-%m-%dT%H:%M:%S.%f',)[:-3] + 'Z'
+        if self._signer:
+            # pre-signed with its client id, or signed now on the signing pool
+            expiration_epoch_seconds = self._signer.expiration(lifetime)
+            client_id, signature = self._signer.sign(nos.symbol, side, size, price, LIMIT_FEE,
+                                                     expiration_epoch_seconds)
+        else:
+            client_id = self._id_generator.next()
+            expiration_epoch_seconds = int(time.time() + lifetime)
+            signature = None
 
         placed_order = self._client_private.create_order(
             position_id=self._position_id,
@@ -461,14 +869,130 @@ class DydxManager:
             post_only=nos.post_only,
             size=size,
             price=price,
-            limit_fee='0.001',
-            expiration=expiration_iso,
+            limit_fee=LIMIT_FEE,
+            expiration_epoch_seconds=expiration_epoch_seconds,
             time_in_force=time_in_force,
-            client_id=client_id
+            client_id=client_id,
+            signature=signature
         )
         logging.info(placed_order)
 
-        return client_id
+        order = parse_order(placed_order.data['order'])
+        self._add_open_order(order)
+        return OrderResult(nos.symbol, client_id, order.order_id, success=True)
+
+    def place_orders(self, orders: [NewOrderSingle]) -> [OrderResult]:
+        """
+            Place orders concurrently, up to order_workers at a time, over the pooled connections. Return a result per
+            order, in the order of the orders. The orders are in get_orders() as soon as they are accepted
+        """
+        return self._order_entry.run_batch(self._place_order, orders)
+
+    def cancel_order(self, contract_name: str, order_id: str) -> OrderResult:
+        """ Cancel an order by order id """
+        return self.cancel_orders(contract_name, [order_id])[0]
+
+    def cancel_orders(self, contract_name: str, order_ids: [str]) -> [OrderResult]:
+        """
+            Cancel orders concurrently by order id. Return a result per order, in the order of the order ids.
+            The orders are removed from get_orders() before the requests are sent, and restored if a cancel fails
+        """
+        removed = [self._pop_open_order(contract_name, order_id) for order_id in order_ids]
+        results = self._order_entry.run_batch(self._cancel_order, [(contract_name, order_id) for order_id in order_ids])
+        for order_id, order, result in zip(order_ids, removed, results):
+            result.symbol = contract_name
+            result.order_id = order_id
+            if not result.success and order:
+                self._add_open_order(order)
+        return results
+
+    def _cancel_order(self, request: (str, str)) -> OrderResult:
+        contract_name, order_id = request
+        response = self._client_private.cancel_order(order_id=order_id)
+        logging.info('canceled order: %s, response: %s', order_id, response.data)
+        return OrderResult(contract_name, order_id=order_id, success=True)
+
+    def cancel_all_orders(self, contract_name: str) -> OrderResult:
+        """ Cancel all the orders of a symbol, they are removed from get_orders() and restored if the cancel fails """
+        with self._orders_lock:
+            removed = self._open_orders.pop(contract_name, {})
+        try:
+            response = self._client_private.cancel_all_orders(market=contract_name)
+            logging.info('canceled all orders: %s, response: %s', contract_name, response.data)
+            result = OrderResult(contract_name, success=True)
+        except Exception as e:
+            logging.error('cancel all orders failed: %s, %s', contract_name, e)
+            result = OrderResult(contract_name, error=e)
+        if not result.success:
+            for order in removed.values():
+                self._add_open_order(order)
+        return result
+
+    def _add_open_order(self, order: Order):
+        """ Store an order ahead of its websocket update, unless it has closed in the meantime """
+        with self._orders_lock:
+            if order.order_id not in self._closed_orders:
+                self._open_orders.setdefault(order.symbol, {})[order.order_id] = order
+
+    def _pop_open_order(self, contract_name: str, order_id: str) -> Order:
+        with self._orders_lock:
+            return self._open_orders.get(contract_name, {}).pop(order_id, None)
+
+    def presign_orders(self, contract_name: str, sizes: [float], levels: int = 3,
+                       order_type: OrderType = OrderType.Limit) -> int:
+        """
+            Sign ahead of time the orders of the given sizes around the current book of a symbol, see
+            StarkOrderSigner.presign_grid(). Requires signing_workers. Return the number of orders submitted
+        """
+        if not self._signer:
+            raise ValueError('pre-signing requires signing_workers')
+        orderbook = self._orderbooks.get(contract_name)
+        if not orderbook or not orderbook.bids or not orderbook.asks:
+            return 0
+
+        lifetime = LIMIT_ORDER_LIFETIME if order_type is OrderType.Limit else IOC_ORDER_LIFETIME
+        expiration_epoch_seconds = self._signer.expiration(lifetime)
+        # the orders signed for an earlier expiration bucket will not be placed anymore
+        self._signer.discard_expired(expiration_epoch_seconds)
+
+        price_ticks, quantity_ticks = self._get_ticks(contract_name)
+        sizes = [quantity_ticks.to_str(quantity_ticks.to_ticks(size)) for size in sizes]
+        return self._signer.presign_grid(contract_name, orderbook.bids[0].price, orderbook.asks[0].price, sizes,
+                                         levels, price_ticks, LIMIT_FEE, expiration_epoch_seconds)
+
+    def get_recovery_stats(self) -> dict:
+        """ Return the order book failures and recovery times of each symbol resubscribed """
+        return {symbol: dict(self._book_recoveries[symbol].get_stats(), failures=failures)
+                for symbol, failures in self._book_failures.items()}
+
+    def get_feed_stats(self) -> dict:
+        """ Win rate and lead time of each book feed, None with a single feed """
+        return self._arbiter.get_stats() if self._arbiter else None
+
+    def get_reconnect_stats(self) -> dict:
+        """ Return the websocket reconnect downtime and the REST snapshot durations """
+        return {'downtime': self._reconnect_downtime.get_stats(), 'snapshot': self._snapshot_duration.get_stats()}
+
+    def get_signing_stats(self) -> dict:
+        """ Return the pre-signed order hits and misses, empty without signing workers """
+        return self._signer.get_stats() if self._signer else {}
+
+    def _get_ticks(self, contract_name: str) -> (PriceTicks, PriceTicks):
+        price_ticks = self._price_ticks.get(contract_name)
+        if price_ticks is None:
+            instrument_static = self._instrument_static[contract_name]
+            price_ticks = PriceTicks(instrument_static.tick_size)
+            self._price_ticks[contract_name] = price_ticks
+            self._quantity_ticks[contract_name] = PriceTicks(instrument_static.quantity_size)
+        return price_ticks, self._quantity_ticks[contract_name]
+
+    async def place_order_async(self, nos: NewOrderSingle) -> str:
+        """ Place an order without blocking the event loop. Return client order id """
+        return await self._order_entry.run(self.place_order, nos)
+
+    def submit_order(self, nos: NewOrderSingle) -> Future:
+        """ Place an order from any thread without blocking. Return a Future of the client order id """
+        return self._order_entry.submit(self.place_order, nos)
 
     def get_tick_size(self, contract_name: str):
         if contract_name in self._instrument_static:
@@ -480,10 +1004,17 @@ class DydxManager:
     def get_quantity_size(self, contract_name: str):
         if contract_name in self._instrument_static:
             instrument_static = self._instrument_static.get(contract_name)
-            return instrument_static.qty_increment
+            return instrument_static.quantity_size
         else:
             return 0
 
+    def get_book_stats(self, contract_name: str) -> dict:
+        """ Return the level and tombstone counts of the order book of a symbol """
+        processor = self._orderbook_processors.get(contract_name)
+        if processor is None:
+            return {}
+        return processor.get_book_stats()
+
 
 class OrderBookProcessor:
     """
@@ -495,18 +1026,47 @@ class OrderBookProcessor:
         A given price level should be updated if and only if an update for the price level is received with a
         higher offset than what you have stored. To get a per-price level offset in the initial response,
         you can set includeOffsets to true when subscribing.
+
+        A level updated to size 0 is removed from the book and only its offset is kept as a tombstone, so that an
+        older update for the same price is still rejected. Tombstones more than tombstone_window offsets behind the
+        latest update are evicted, an update delayed by more than the window could then recreate the level.
     """
-    def __init__(self, symbol: str, depth=5):
+    def __init__(self, symbol: str, depth=5, tick_size: float = None, lazy=False,
+                 tombstone_window: int = DEFAULT_TOMBSTONE_WINDOW):
         self._symbol = symbol
         self._depth = depth
 
-        # a map that contain bids and asks sides, then each side is a map of price -> (offset, quantity)
-        self._orderbooks: DefaultDict[str, DefaultDict[float, PriceLevel]] = defaultdict(lambda: defaultdict(PriceLevel))
+        # price levels are keyed by integer ticks
+        self._ticks = PriceTicks(tick_size)
+
+        # a map that contain bids and asks sides, then each side is a map of price ticks -> (offset, quantity)
+        # for the non-empty levels
+        self._orderbooks: DefaultDict[str, DefaultDict[int, PriceLevel]] = defaultdict(lambda: defaultdict(PriceLevel))
         self._timestamp = 0
 
-        # latest order book
+        # offset of the removed levels for each side, price ticks -> offset in order of insertion (i.e. of offset)
+        self._tombstones = {'bids': {}, 'asks': {}}
+        self._tombstone_window = tombstone_window
+        self._evicted_count = 0
+
+        # sorted index of the non-empty price levels for each side, maintained as updates are applied
+        self._sorted_levels = {'bids': SortedBookSide(descending=True), 'asks': SortedBookSide(descending=False)}
+
+        # latest order book, rebuilt only when an update has changed the top depth levels
         self._clean_order_book = None
 
+        # True if the last message has changed the top depth levels
+        self.changed = False
+
+        # incremented on every change of the top depth levels, to detect stale OrderBookView
+        self.version = 0
+
+        # return OrderBookView instead of materializing all the tiers
+        self._lazy = lazy
+
+        # called with (symbol, BookDelta) for every message handled
+        self.delta_callback = None
+
     def handle(self, message: dict) -> {}:
         """ Handle update, and return a signal (a map) if there is a cross """
         market = message['id']
@@ -515,29 +1075,57 @@ class OrderBookProcessor:
 
         data = message['contents']
 
+        # applied level changes, only collected if someone listens
+        levels = [] if self.delta_callback else None
+
         signal = {}
-        if message['type'] == 'subscribed':
+        snapshot = message['type'] == 'subscribed'
+        if snapshot:
             """ The initial response will contain the state of the order book """
             self._reset()
-            self._handle_snapshot(data)
+            self._handle_snapshot(data, levels)
+            self.changed = True
         else:
-            signal = self._handle_update(data)
+            self.changed = False
+            signal = self._handle_update(data, levels)
+
+        if self.changed:
+            self._clean_order_book = None
+            self.version += 1
 
         self._timestamp = time.time_ns()
 
+        if levels is not None:
+            self.delta_callback(self._symbol, BookDelta(timestamp=self._timestamp, snapshot=snapshot, levels=levels))
+
         return signal
 
-    def _handle_snapshot(self, data):
+    def _handle_snapshot(self, data, levels: list = None):
+        to_ticks = self._ticks.to_ticks
         for side in {'bids', 'asks'}:
             book = self._orderbooks[side]
+            sorted_levels = self._sorted_levels[side]
+            empty_levels = []
             for update_layer in data[side]:
                 offset = int(update_layer['offset'])
                 price = float(update_layer['price'])
                 size = float(update_layer['size'])
+                ticks = to_ticks(price)
                 if size:
-                    book[price] = PriceLevel(price, offset, size)
+                    level = PriceLevel(price, offset, size)
+                    book[ticks] = level
+                    sorted_levels.set(ticks, level)
+                    if levels is not None:
+                        levels.append((BOOK_SIDES[side], price, size, offset))
+                else:
+                    empty_levels.append((offset, ticks))
 
-    def _handle_update(self, data):
+            # keep the tombstones in order of offset for the eviction
+            tombstones = self._tombstones[side]
+            for offset, ticks in sorted(empty_levels):
+                tombstones[ticks] = offset
+
+    def _handle_update(self, data, levels: list = None):
         """ Handle update and return a signal if crossed (and remove the opposite side of update that crossed)
             A signal is a map that shows current TOB, and the update side that has caused a crossed
             {'wrong': (3809.7, 3809.6), 'wrong_side': 'bid'}
@@ -547,62 +1135,105 @@ class OrderBookProcessor:
         update_offset = int(data['offset'])
 
         # apply update
+        depth = self._depth
+        to_ticks = self._ticks.to_ticks
         for side in {'bids', 'asks'}:
             book = self._orderbooks[side]
+            tombstones = self._tombstones[side]
+            sorted_levels = self._sorted_levels[side]
             for price, size in data[side]:
                 price = float(price)
                 size = float(size)
-                if price not in book:
-                    # new
-                    book[price] = PriceLevel(price, update_offset, size)
-                else:
-                    previous_offset = book[price].get_offset()
-                    if update_offset > previous_offset:
-                        book[price].update(update_offset, size)
+                ticks = to_ticks(price)
+
+                level = book.get(ticks)
+                previous_offset = level.get_offset() if level is not None else tombstones.get(ticks)
+                if previous_offset is not None and update_offset <= previous_offset:
+                    logging.info(
+                        "Skipping price update -> side={}, existing offset={}, update offset={}, price={}, size={}".format(
+                            side, previous_offset, update_offset, price, size))
+                    continue
+
+                if levels is not None:
+                    levels.append((BOOK_SIDES[side], price, size, update_offset))
+
+                # check visibility before the sorted index is updated, a level removed or set to its size is unchanged
+                if not self.changed and size != (level.get_size() if level is not None else 0):
+                    self.changed = sorted_levels.within(ticks, depth)
+
+                # keep the book and the sorted index in line with the non-empty levels
+                if size:
+                    if level is None:
+                        level = PriceLevel(price, update_offset, size)
+                        book[ticks] = level
+                        tombstones.pop(ticks, None)
                     else:
-                        logging.info(
-                            "Skipping price update -> side={}, existing offset={}, update offset={}, price={}, size={}".format(
-                                side, previous_offset, update_offset, price, size))
-                        continue
+                        level.update(update_offset, size)
+                    sorted_levels.set(ticks, level)
+                else:
+                    if level is not None:
+                        del book[ticks]
+                        sorted_levels.remove(ticks)
+                    # re-insert to keep the tombstones in order of offset
+                    tombstones.pop(ticks, None)
+                    tombstones[ticks] = update_offset
+
+        self._evict_tombstones(update_offset - self._tombstone_window)
+
+    def _evict_tombstones(self, min_offset: int) -> None:
+        """ Drop the tombstones with an offset lower than min_offset, oldest first """
+        for tombstones in self._tombstones.values():
+            while tombstones:
+                ticks = next(iter(tombstones))
+                if tombstones[ticks] >= min_offset:
+                    break
+                del tombstones[ticks]
+                self._evicted_count += 1
+
+    def get_book_stats(self) -> dict:
+        """ Return the number of levels and tombstones held, and the number of tombstones evicted so far """
+        return {'levels': sum(len(self._orderbooks[side]) for side in ('bids', 'asks')),
+                'tombstones': sum(len(tombstones) for tombstones in self._tombstones.values()),
+                'evicted': self._evicted_count}
 
     def get_best_bid(self):
-        if self._orderbooks['bids']:
-            return max(price for price, level in list(self._orderbooks['bids'].items()) if level.get_size())
-        return None
+        best = self._sorted_levels['bids'].best()
+        return None if best is None else self._ticks.to_price(best)
 
     def get_sorted_bids(self):
-        sorted_bids = sorted(
-            [(price, level) for price, level in list(self._orderbooks['bids'].items()) if level.get_size()],
-            key=itemgetter(0),
-            reverse=True)
-        return [p for (p, s) in sorted_bids]
+        to_price = self._ticks.to_price
+        return [to_price(t) for t in self._sorted_levels['bids'].prices()]
 
     def get_sorted_asks(self):
-        sorted_asks = sorted(
-            [(price, level) for price, level in list(self._orderbooks['asks'].items()) if level.get_size()],
-            key=itemgetter(0),
-            reverse=False)
-        return [p for (p, s) in sorted_asks]
+        to_price = self._ticks.to_price
+        return [to_price(t) for t in self._sorted_levels['asks'].prices()]
 
     def get_best_ask(self):
-        if self._orderbooks['asks']:
-            return min(price for price, level in list(self._orderbooks['asks'].items()) if level.get_size())
-        return None
+        best = self._sorted_levels['asks'].best()
+        return None if best is None else self._ticks.to_price(best)
 
     def get_orderbook(self) -> OrderBook:
         if self._timestamp == 0:
             return 0
 
-        sorted_orderbooks = {side: sorted(
-            [(price, level) for price, level in list(self._orderbooks[side].items()) if level.get_size()],
-            key=itemgetter(0),
-            reverse=(True if side == 'bids' else False)
-        )
-        for side in {'bids', 'asks'}}
-
-        return OrderBook(timestamp=self._timestamp,
-                         bids=[Tier(price=p, size=s.get_size(), quote_id=s.get_offset()) for (p, s) in sorted_orderbooks['bids'][:self._depth]],
-                         asks=[Tier(price=p, size=s.get_size(), quote_id=s.get_offset()) for (p, s) in sorted_orderbooks['asks'][:self._depth]])
+        if self._clean_order_book is None:
+            if self._lazy:
+                self._clean_order_book = OrderBookView(timestamp=self._timestamp, source=self)
+            else:
+                self._clean_order_book = OrderBook(timestamp=self._timestamp,
+                                                   bids=self.get_tiers('bids'),
+                                                   asks=self.get_tiers('asks'))
+        return self._clean_order_book
+
+    def get_tiers(self, side: str, n: int = None) -> [Tier]:
+        """ Return the best n tiers of 'bids' or 'asks', up to the book depth if n is None """
+        to_price = self._ticks.to_price
+        return [Tier(price=to_price(t), size=s.get_size(), quote_id=s.get_offset())
+                for (t, s) in self._sorted_levels[side].top(self._depth if n is None else n)]
+
+    def get_tier_count(self, side: str) -> int:
+        """ Return the number of tiers of 'bids' or 'asks' within the book depth """
+        return min(self._depth, len(self._sorted_levels[side]))
 
     def _reset(self) -> None:
         if 'bids' in self._orderbooks:
@@ -611,12 +1242,225 @@ class OrderBookProcessor:
         if 'asks' in self._orderbooks:
             del self._orderbooks['asks']
 
+        for sorted_levels in self._sorted_levels.values():
+            sorted_levels.clear()
+
+        for tombstones in self._tombstones.values():
+            tombstones.clear()
+
         self._timestamp = 0
+        self._clean_order_book = None
+
+    def set_tick_size(self, tick_size: float) -> None:
+        """ Set the instrument tick size used to key the price levels, the book is cleared until next snapshot """
+        self._ticks = PriceTicks(tick_size)
+        self._reset()
+        self.version += 1
 
     def ready(self) -> bool:
         return self._timestamp > 0
 
 
+class LadderOrderBookProcessor:
+    """
+        Same interface as OrderBookProcessor, backed by a dense price ladder centred on the mid that stores the size
+        and the offset of each tick. A level update is an array write, and deep reads such as get_cumulative_depth()
+        are vectorized, which suits liquid markets where the populated book is a contiguous band of ticks. Requires
+        the tick size of the instrument to be set. Loading a snapshot costs more than with OrderBookProcessor, the
+        far levels of a dYdX snapshot go to the overflow of the ladder. See benchmarks/bench_ladder.py for when the
+        ladder beats the sorted book.
+
+        As in OrderBookProcessor, only the offset of an empty level is kept, and evicted once it is more than
+        tombstone_window offsets behind the latest update, whether the level is inside or outside of the window.
+    """
+    def __init__(self, symbol: str, depth=5, tick_size: float = None, capacity: int = DEFAULT_CAPACITY, lazy=False,
+                 tombstone_window: int = DEFAULT_TOMBSTONE_WINDOW):
+        self._symbol = symbol
+        self._depth = depth
+
+        # price levels are keyed by integer ticks
+        self._ticks = PriceTicks(tick_size)
+        self._ladder = PriceLadder(capacity, with_offsets=True)
+        self._tombstone_window = tombstone_window
+        self._timestamp = 0
+
+        # latest order book, rebuilt only when an update has changed the top depth levels
+        self._clean_order_book = None
+
+        # True if the last message has changed the top depth levels
+        self.changed = False
+
+        # incremented on every change of the top depth levels, to detect stale OrderBookView
+        self.version = 0
+
+        # return OrderBookView instead of materializing all the tiers
+        self._lazy = lazy
+
+        # called with (symbol, BookDelta) for every message handled
+        self.delta_callback = None
+
+    def handle(self, message: dict) -> {}:
+        market = message['id']
+        if market != self._symbol:
+            raise ValueError("Received message for market {} but this processor is for {}".format(market, self._symbol))
+
+        data = message['contents']
+
+        # applied level changes, only collected if someone listens
+        levels = [] if self.delta_callback else None
+
+        signal = {}
+        snapshot = message['type'] == 'subscribed'
+        if snapshot:
+            """ The initial response will contain the state of the order book """
+            self._reset()
+            self._handle_snapshot(data, levels)
+            self.changed = True
+        else:
+            self.changed = False
+            signal = self._handle_update(data, levels)
+
+        if self.changed:
+            self._clean_order_book = None
+            self.version += 1
+
+        self._timestamp = time.time_ns()
+
+        if levels is not None:
+            self.delta_callback(self._symbol, BookDelta(timestamp=self._timestamp, snapshot=snapshot, levels=levels))
+
+        return signal
+
+    def _handle_snapshot(self, data, levels: list = None):
+        ladder = self._ladder
+        to_ticks = self._ticks.to_ticks
+        book_levels = []
+        empty_levels = []
+        for side, name in ((BID, 'bids'), (ASK, 'asks')):
+            for update_layer in data[name]:
+                size = float(update_layer['size'])
+                price = float(update_layer['price'])
+                offset = int(update_layer['offset'])
+                if size:
+                    book_levels.append((side, to_ticks(price), size, offset))
+                    if levels is not None:
+                        levels.append((BOOK_SIDES[name], price, size, offset))
+                else:
+                    empty_levels.append((offset, side, to_ticks(price)))
+
+        # place the window on the mid once and load the levels best first, instead of recentring on every better
+        # level outside of the window as the levels are loaded
+        ladder.center(get_mid_ticks(book_levels))
+        book_levels.sort(key=lambda level: -level[1] if level[0] == BID else level[1])
+        for side, ticks, size, offset in book_levels:
+            ladder.set(side, ticks, size, offset)
+
+        # keep the tombstones in order of offset for the eviction, once the window is placed on the book
+        for offset, side, ticks in sorted(empty_levels):
+            ladder.set(side, ticks, 0, offset)
+
+    def _handle_update(self, data, levels: list = None):
+        update_offset = int(data['offset'])
+
+        depth = self._depth
+        ladder = self._ladder
+        to_ticks = self._ticks.to_ticks
+        for side, name in ((BID, 'bids'), (ASK, 'asks')):
+            for price, size in data[name]:
+                price = float(price)
+                size = float(size)
+                ticks = to_ticks(price)
+
+                previous_offset = ladder.get_offset(side, ticks)
+                if previous_offset is not None and update_offset <= previous_offset:
+                    logging.info(
+                        "Skipping price update -> side={}, existing offset={}, update offset={}, price={}, size={}".format(
+                            name, previous_offset, update_offset, price, size))
+                    continue
+
+                if levels is not None:
+                    levels.append((BOOK_SIDES[name], price, size, update_offset))
+
+                # a level removed or set to its size is unchanged
+                if not self.changed and size != ladder.size(side, ticks):
+                    self.changed = ladder.within(side, ticks, depth)
+
+                ladder.set(side, ticks, size, update_offset)
+
+        ladder.evict_tombstones(update_offset - self._tombstone_window)
+
+    def get_best_bid(self):
+        best = self._ladder.best(BID)
+        return None if best is None else self._ticks.to_price(best)
+
+    def get_sorted_bids(self):
+        to_price = self._ticks.to_price
+        return [to_price(t) for t in self._ladder.top(BID)[0]]
+
+    def get_sorted_asks(self):
+        to_price = self._ticks.to_price
+        return [to_price(t) for t in self._ladder.top(ASK)[0]]
+
+    def get_best_ask(self):
+        best = self._ladder.best(ASK)
+        return None if best is None else self._ticks.to_price(best)
+
+    def get_book_stats(self) -> dict:
+        """ Return the number of levels and tombstones held, and the number of tombstones evicted so far """
+        levels, tombstones = self._ladder.level_counts()
+        return {'levels': levels, 'tombstones': tombstones, 'evicted': self._ladder.evicted_count}
+
+    def get_cumulative_depth(self, side: str, levels: int = None):
+        """ Return the cumulative size of the best levels of 'bids' or 'asks' as a NumPy array """
+        return self._ladder.cumulative_depth(BID if side == 'bids' else ASK, levels or self._depth)
+
+    def get_orderbook(self) -> OrderBook:
+        if self._timestamp == 0:
+            return 0
+
+        if self._clean_order_book is None:
+            if self._lazy:
+                self._clean_order_book = OrderBookView(timestamp=self._timestamp, source=self)
+            else:
+                self._clean_order_book = OrderBook(timestamp=self._timestamp,
+                                                   bids=self.get_tiers('bids'),
+                                                   asks=self.get_tiers('asks'))
+        return self._clean_order_book
+
+    def get_tiers(self, side: str, n: int = None) -> [Tier]:
+        """ Return the best n tiers of 'bids' or 'asks', up to the book depth if n is None """
+        ticks, sizes, offsets = self._ladder.top(BID if side == 'bids' else ASK, self._depth if n is None else n)
+        to_price = self._ticks.to_price
+        return [Tier(price=to_price(t), size=s, quote_id=o) for (t, s, o) in zip(ticks, sizes, offsets)]
+
+    def get_tier_count(self, side: str) -> int:
+        """ Return the number of tiers of 'bids' or 'asks' within the book depth """
+        return len(self._ladder.top(BID if side == 'bids' else ASK, self._depth)[0])
+
+    def _reset(self) -> None:
+        self._ladder.clear()
+        self._timestamp = 0
+        self._clean_order_book = None
+
+    def set_tick_size(self, tick_size: float) -> None:
+        """ Set the instrument tick size used to key the price levels, the book is cleared until next snapshot """
+        self._ticks = PriceTicks(tick_size)
+        self._reset()
+        self.version += 1
+
+    def ready(self) -> bool:
+        return self._timestamp > 0
+
+
+def get_mid_ticks(book_levels: [tuple]):
+    """ Return the mid of the (side, ticks, ...) levels of a snapshot, the best price if one side is empty """
+    best_bid = max((level[1] for level in book_levels if level[0] == BID), default=None)
+    best_ask = min((level[1] for level in book_levels if level[0] == ASK), default=None)
+    if best_bid is None or best_ask is None:
+        return best_ask if best_bid is None else best_bid
+    return (best_bid + best_ask) // 2
+
+
 class PriceLevel:
     def __init__(self, price: float, offset: int, size: float):
         self._price = price
@@ -638,6 +1482,13 @@ class PriceLevel:
         return self._offset
 
 
+# order book implementations selectable by DydxManager(book_type=...)
+BOOK_PROCESSORS = {
+    'sorted': OrderBookProcessor,
+    'ladder': LadderOrderBookProcessor,
+}
+
+
 def process_orders(message: dict) -> dict:
     # {"orders": [{"id": "296b2791d908f6867ce6555630d33656a284d48192dbb20fdab57db92aed9f8", "clientId": "4785304725173323", "accountId": "d82d13a7-473d-59c7-bcfc-031ed100d62b", "market": "BTC-USD", "side": "BUY", "price": "30000", "triggerPrice": None, "trailingPercent": None, "size": "0.001", "remainingSize": "0.001", "type": "LIMIT", "createdAt": "2021-09-18T14:06:25.111Z", "unfillableAt": None, "expiresAt": "2021-10-16T14:06:21.498Z", "status": "OPEN", "timeInForce": "GTT", "postOnly": False, "cancelReason": None}]}
     store = {}
@@ -693,6 +1544,7 @@ def process_orders_ws(orders: dict, store: dict) -> [OrderEvent]:
         status = data.get('status')
         client_id = data.get('clientId')
         order = parse_order(data)
+        filled_quantity = float(data['size']) - float(data['remainingSize'])
 
         if 'OPEN' == status:
             # insert to store
@@ -701,7 +1553,7 @@ def process_orders_ws(orders: dict, store: dict) -> [OrderEvent]:
 
             store[order.symbol][order.order_id] = order
 
-            order_events.append(OrderEvent(contract_name=order.symbol, order_id=order.order_id, status=OrderStatus.OPEN, client_id=client_id))
+            order_event = OrderEvent(contract_name=order.symbol, order_id=order.order_id, status=OrderStatus.OPEN, client_id=client_id)
 
         elif 'FILLED' == status:
             # remove from store
@@ -710,7 +1562,7 @@ def process_orders_ws(orders: dict, store: dict) -> [OrderEvent]:
             except KeyError:
                 # ok
                 pass
-            order_events.append(OrderEvent(contract_name=order.symbol, order_id=order.order_id, status=OrderStatus.MATCHED, client_id=client_id))
+            order_event = OrderEvent(contract_name=order.symbol, order_id=order.order_id, status=OrderStatus.MATCHED, client_id=client_id)
 
         elif 'CANCELED' == status:
             # remove from store
@@ -720,7 +1572,12 @@ def process_orders_ws(orders: dict, store: dict) -> [OrderEvent]:
                 # ok
                 pass
             cancel_reason = data.get('cancelReason')
-            order_events.append(OrderEvent(contract_name=order.symbol, order_id=order.order_id, status=OrderStatus.CANCELED, canceled_reason=cancel_reason, client_id=client_id))
+            order_event = OrderEvent(contract_name=order.symbol, order_id=order.order_id, status=OrderStatus.CANCELED, canceled_reason=cancel_reason, client_id=client_id)
+        else:
+            continue
+
+        order_event.filled_quantity = filled_quantity
+        order_events.append(order_event)
 
     return order_events
 
@@ -0,0 +1,203 @@
+import logging
+import math
+import multiprocessing
+import time
+from collections import OrderedDict
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from threading import Lock
+from dydx3.constants import ORDER_SIDE_BUY, ORDER_SIDE_SELL
+from dydx3.starkex.order import SignableOrder
+from lib.identifier import OrderIdGenerator
+from lib.orderbook import PriceTicks
+
+# number of processes signing orders, the STARK signature takes tens of milliseconds of pure Python
+DEFAULT_SIGNING_WORKERS = 2
+
+# upper bound of pre-signed orders kept, the oldest are dropped first
+DEFAULT_PRESIGN_CACHE_SIZE = 2000
+
+# order expirations are rounded up to a multiple of this number of seconds, so that an order placed within the same
+# bucket has the same expiration as the orders pre-signed for it
+DEFAULT_EXPIRATION_BUCKET = 60
+
+
+def sign_order(network_id: int, stark_private_key: str, position_id, client_id: str, market: str, side: str,
+               size: str, price: str, limit_fee: str, expiration_epoch_seconds: int) -> str:
+    """ Sign an order with the STARK key, module level so that it can run in a worker process """
+    order = SignableOrder(network_id=network_id, position_id=position_id, client_id=client_id, market=market,
+                          side=side, human_size=size, human_price=price, limit_fee=limit_fee,
+                          expiration_epoch_seconds=expiration_epoch_seconds)
+    return order.sign(stark_private_key)
+
+
+class StarkOrderSigner:
+    """
+        Signs dYdX orders on a process pool, off the GIL of the gateway, and keeps a bounded cache of orders signed
+        ahead of time.
+
+        The client id is part of the signed payload, so each pre-signed order is assigned its client id when it is
+        signed, and a cache entry is used by one order only. Orders are keyed by
+        (market, side, size, price, limit_fee, expiration): the size and price are the strings sent to the API and
+        the expiration is rounded to the bucket, see expiration(). An order that was not pre-signed is signed on
+        demand, still on the pool.
+    """
+    def __init__(self, network_id: int, stark_private_key: str, id_generator: OrderIdGenerator,
+                 workers: int = DEFAULT_SIGNING_WORKERS, cache_size: int = DEFAULT_PRESIGN_CACHE_SIZE,
+                 expiration_bucket: int = DEFAULT_EXPIRATION_BUCKET, executor: Executor = None):
+        self._network_id = network_id
+        self._stark_private_key = stark_private_key
+        self._id_generator = id_generator
+
+        # StarkWare-specific positionId, known once the account has been requested
+        self.position_id = None
+
+        self.cache_size = cache_size
+        self.expiration_bucket = expiration_bucket
+
+        # spawned rather than forked, the gateway process runs several threads
+        self._executor = executor or ProcessPoolExecutor(max_workers=workers,
+                                                         mp_context=multiprocessing.get_context('spawn'))
+
+        # key -> (client_id, signature), oldest first, and key -> Future of the orders being pre-signed
+        self._lock = Lock()
+        self._cache = OrderedDict()
+        self._pending = {}
+
+        self._workers = workers
+        self.hit_count = 0
+        self.pending_hit_count = 0
+        self.miss_count = 0
+        self.presign_count = 0
+        self.evicted_count = 0
+        self.expired_count = 0
+        self.skipped_count = 0
+
+    def prewarm(self) -> None:
+        """ Start the worker processes ahead of the first order, each imports dydx3 when it starts """
+        futures = [self._executor.submit(sign_order, self._network_id, self._stark_private_key, 0, 'prewarm',
+                                         'BTC-USD', ORDER_SIDE_BUY, '1', '1', '0', 0) for _ in range(self._workers)]
+        for future in futures:
+            future.result()
+
+    def expiration(self, lifetime: float, now: float = None) -> int:
+        """ Expiration in epoch seconds of an order that lives at least lifetime seconds, rounded up to the bucket """
+        now = time.time() if now is None else now
+        return int(math.ceil((now + lifetime) / self.expiration_bucket) * self.expiration_bucket)
+
+    def sign(self, market: str, side: str, size: str, price: str, limit_fee: str,
+             expiration_epoch_seconds: int) -> (str, str):
+        """ Return (client_id, signature) of an order, pre-signed if available, otherwise signed now """
+        key = (market, side, size, price, limit_fee, expiration_epoch_seconds)
+        with self._lock:
+            entry = self._cache.pop(key, None)
+            pending = None if entry else self._pending.pop(key, None)
+            if entry:
+                self.hit_count += 1
+            elif pending:
+                self.pending_hit_count += 1
+            else:
+                self.miss_count += 1
+
+        if entry:
+            return entry
+        if pending:
+            # being pre-signed, the result is taken out of the cache by this order
+            try:
+                return pending.result()
+            except Exception as e:
+                # the pre-signed client id may have been sent, the order is signed again with a new one
+                logging.warning('pre-signed order %s failed, signing it now: %s', key, e)
+
+        client_id = self._id_generator.next()
+        future = self._submit(client_id, key)
+        return client_id, future.result()
+
+    def presign(self, orders: [tuple]) -> int:
+        """
+            Sign (market, side, size, price, limit_fee, expiration_epoch_seconds) orders ahead of time, skipping the
+            ones already signed. The orders being signed count toward the cache size, the orders beyond it are not
+            submitted. Return the number of orders submitted
+        """
+        submitted = 0
+        with self._lock:
+            for key in orders:
+                key = tuple(key)
+                if key in self._cache or key in self._pending:
+                    continue
+                if len(self._pending) >= self.cache_size:
+                    self.skipped_count += 1
+                    continue
+                client_id = self._id_generator.next()
+                future = Future()
+                self._pending[key] = future
+                self._submit(client_id, key).add_done_callback(
+                    lambda f, key=key, client_id=client_id, future=future: self._on_presigned(key, client_id, f, future))
+                submitted += 1
+            self.presign_count += submitted
+        return submitted
+
+    def presign_grid(self, market: str, best_bid: float, best_ask: float, sizes: [str], levels: int,
+                     price_ticks: PriceTicks, limit_fee: str, expiration_epoch_seconds: int) -> int:
+        """
+            Pre-sign the orders likely to be placed around the current book: for each size, buys at the best bid
+            and the levels below it, sells at the best ask and the levels above it, and the orders crossing the spread.
+            Return the number of orders submitted
+        """
+        bid_ticks = price_ticks.to_ticks(best_bid)
+        ask_ticks = price_ticks.to_ticks(best_ask)
+        prices = {ORDER_SIDE_BUY: [ask_ticks] + [bid_ticks - i for i in range(levels)],
+                  ORDER_SIDE_SELL: [bid_ticks] + [ask_ticks + i for i in range(levels)]}
+        orders = []
+        for side, side_ticks in prices.items():
+            for ticks in side_ticks:
+                price = price_ticks.to_str(ticks)
+                for size in sizes:
+                    orders.append((market, side, size, price, limit_fee, expiration_epoch_seconds))
+        return self.presign(orders)
+
+    def discard_expired(self, expiration_epoch_seconds: int) -> int:
+        """ Drop the pre-signed orders expiring before the given expiration, they will not be used anymore """
+        with self._lock:
+            expired = [key for key in self._cache if key[-1] < expiration_epoch_seconds]
+            for key in expired:
+                del self._cache[key]
+            self.expired_count += len(expired)
+        return len(expired)
+
+    def _submit(self, client_id: str, key: tuple) -> Future:
+        market, side, size, price, limit_fee, expiration_epoch_seconds = key
+        return self._executor.submit(sign_order, self._network_id, self._stark_private_key, self.position_id,
+                                     client_id, market, side, size, price, limit_fee, expiration_epoch_seconds)
+
+    def _on_presigned(self, key: tuple, client_id: str, signed: Future, future: Future) -> None:
+        if signed.exception():
+            logging.error('failed to pre-sign order %s: %s', key, signed.exception())
+            with self._lock:
+                self._pending.pop(key, None)
+            future.set_exception(signed.exception())
+            return
+
+        entry = (client_id, signed.result())
+        with self._lock:
+            # not taken by an order while being signed
+            if self._pending.pop(key, None) is future:
+                self._cache[key] = entry
+                while self._cache and len(self._cache) + len(self._pending) > self.cache_size:
+                    self._cache.popitem(last=False)
+                    self.evicted_count += 1
+        future.set_result(entry)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {'hits': self.hit_count,
+                    'pending_hits': self.pending_hit_count,
+                    'misses': self.miss_count,
+                    'presigned': self.presign_count,
+                    'cached': len(self._cache),
+                    'pending': len(self._pending),
+                    'evicted': self.evicted_count,
+                    'expired': self.expired_count,
+                    'skipped': self.skipped_count}
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._executor.shutdown(wait=wait)
@@ -1,20 +1,34 @@
 import websockets
 import asyncio
-import requests
-from requests import Request, Session
+from requests import Request, PreparedRequest
 import json
 import time
 import hmac
-from threading import Thread
-from lib.interface import OrderBook, Tier, Order, Side, NewOrderSingle, OrderType, InstrumentDetails
+from threading import Thread, Lock
+from lib.interface import OrderBook, Tier, Order, Side, NewOrderSingle, OrderType, InstrumentDetails, BookDelta
 from lib.callback_utils import assert_param_counts
 from lib.math_utils import to_nearest
 from lib.events import OrderEvent, OrderStatus
 from lib.identifier import OrderIdGenerator
+from lib.orderbook import SortedBookSide, PriceTicks, OrderBookView, BookChannelError
+from lib.ladder import PriceLadder, BID, ASK, DEFAULT_CAPACITY
+from lib.conflation import BookConflator
+from lib.dispatcher import CallbackDispatcher
+from lib.subscribers import SubscriberRegistry, Subscriber, INLINE
+from lib.json_decoder import get_json_decoder
+from lib.ws_protocol import BytesClientProtocol
+from lib.router import MessageRouter
+from lib.arbitration import FeedArbiter
+from lib.runtime import GatewayRuntime
+from lib.order_entry import OrderEntryExecutor, OrderResult, ClosedOrders, DEFAULT_ORDER_WORKERS
+from concurrent.futures import Future
+from lib.http_client import HttpClient, DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT
 import logging
 from collections import defaultdict
 from typing import DefaultDict
 from operator import itemgetter
+from datetime import datetime
+from lib.metrics import DurationStats
 
 
 """ Class to maintain readiness check """
@@ -42,7 +56,11 @@ URL_REST = 'https://ftx.com/api'
 
 
 class FtxManager:
-    def __init__(self, symbol: {str}, api_key=None, api_secret=None, name='FTX'):
+    def __init__(self, symbol: {str}, api_key=None, api_secret=None, name='FTX', depth_levels=5, book_type='dict',
+                 lazy_books=False, conflate=False, dispatcher: CallbackDispatcher = None, json_decoder='json',
+                 bytes_frames=False, order_workers=DEFAULT_ORDER_WORKERS, http_pool_size=None,
+                 http_timeouts=(DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT), book_feeds=1,
+                 runtime: GatewayRuntime = None):
 
         self._url = URL_WS
         self._rest_url = URL_REST
@@ -55,31 +73,99 @@ class FtxManager:
         else:
             raise ValueError('symbol must either be str or {str}')
 
-        self._loop = asyncio.new_event_loop()
+        # the event loop is shared with other gateways on a runtime, otherwise run on a dedicated thread
+        self._name = name
+        self._runtime = runtime
+        if runtime:
+            runtime.register(name)
+        self._loop = runtime.loop if runtime else asyncio.new_event_loop()
         self._conn = None
         self._ws = None
         self._api_key = api_key
         self._api_secret = api_secret
         self._nonce = 0
+
+        # keyed HMAC state, copied for each signature instead of hashing the key again
+        self._hmac = hmac.new(api_secret.encode(), digestmod='sha256') if api_secret else None
         self._signal_reconnect = False
 
         # static data
         self._instrument_static = {}
 
+        # size rounding of each instrument, precomputed for the order entry
+        self._quantity_ticks = {}
+
         # order book processor, one per symbol
+        if book_type not in BOOK_PROCESSORS:
+            raise ValueError('book_type must be one of {}'.format(list(BOOK_PROCESSORS)))
+        processor_class = BOOK_PROCESSORS[book_type]
+        processor_options = {}
+        if lazy_books:
+            # depth callbacks receive OrderBookView, only supported by the sorted books
+            if book_type == 'dict':
+                raise ValueError('lazy_books requires book_type sorted or ladder')
+            processor_options['lazy'] = True
         self._orderbook_processors = {}
         for sym in self._symbol:
-            self._orderbook_processors[sym] = OrderBookProcessor(sym)
+            self._orderbook_processors[sym] = processor_class(sym, depth=depth_levels, **processor_options)
         self._orderbooks = {}
 
+        # publish the books once per batch of buffered messages instead of once per message
+        self._conflator = BookConflator() if conflate else None
+
+        # run the depth and execution callbacks on the dispatcher thread instead of the event loop
+        if dispatcher and lazy_books:
+            raise ValueError('lazy_books cannot be used with a dispatcher, books are read from another thread')
+        self._dispatcher = dispatcher
+
+        # additional depth and execution subscribers, each with its own delivery policy
+        self._lazy_books = lazy_books
+        self._subscribers = SubscriberRegistry(name)
+
+        # websocket message decoding, bytes_frames passes the raw frame bytes to the decoder
+        self._json_loads = get_json_decoder(json_decoder)
+        self._ws_protocol = BytesClientProtocol if bytes_frames else None
+        self._router = self._init_router()
+
+        # with several book feeds, the order books are also received over book_feeds - 1 market data connections and
+        # each update is applied from the first connection delivering it, the main connection is feed 0
+        self._book_feeds = book_feeds
+        self._arbiter = FeedArbiter(book_feeds) if book_feeds > 1 else None
+        self._feed_ws = {}
+
         # positions
         self._positions = {}
 
-        # open orders
+        # open orders, also updated by the order entry threads as soon as an order is placed or canceled
         self._open_orders = {}
+        self._orders_lock = Lock()
+        self._closed_orders = ClosedOrders()
 
-        # this is a dedicated thread to run all async concurrent tasks
-        self._loop_thread = Thread(target=self._run_async_tasks, daemon=True, name=name)
+        # orders are sent from a thread pool, so several can be in flight
+        self._order_entry = OrderEntryExecutor(order_workers, name='{}-orders'.format(name))
+
+        # keep-alive connections shared by all the REST calls, by default one per order worker
+        connect_timeout, read_timeout = http_timeouts
+        self._http = HttpClient(URL_REST, pool_size=http_pool_size or order_workers,
+                                connect_timeout=connect_timeout, read_timeout=read_timeout)
+
+        # this is a dedicated thread to run all async concurrent tasks, none on a runtime
+        self._loop_thread = None if runtime else Thread(target=self._run_async_tasks, daemon=True, name=name)
+
+        # account events received while the REST snapshots are requested, applied on top of them, see _on_snapshot
+        self._account_buffer = None
+        self._snapshot_generation = 0
+        self._snapshot_start = 0
+        self._positions_time = 0
+
+        # symbols whose order book is resubscribed -> time.time_ns() of the failure, failures and recovery times
+        self._recovering = {}
+        self._book_failures = defaultdict(int)
+        self._book_recoveries = defaultdict(DurationStats)
+
+        # time to reconnect and resubscribe the websocket, and to request the REST snapshots
+        self._reconnect_downtime = DurationStats()
+        self._snapshot_duration = DurationStats()
 
         # readiness and circuit breaker flag
         self._ready_check = ReadyCheck()
@@ -95,35 +181,63 @@ class FtxManager:
     def connect(self):
         logging.info('Initializing connection')
 
+        if self._dispatcher:
+            self._dispatcher.start()
+
+        # open the REST connections ahead of the first order
+        self._http.prewarm()
+
         # get instrument static data
         self._get_static()
+        self._set_book_tick_sizes()
+
+        if self._runtime:
+            self._runtime.run(self._name, self._reconnect_ws())
 
-        self._loop.run_until_complete(self._reconnect_ws())
+            logging.info("starting tasks on the runtime")
+            for coro in self._async_tasks():
+                self._runtime.spawn(self._name, coro)
+        else:
+            self._loop.run_until_complete(self._reconnect_ws())
 
-        logging.info("starting event loop thread")
-        self._loop_thread.start()
+            logging.info("starting event loop thread")
+            self._loop_thread.start()
 
     def reconnect(self):
         """ A signal to reconnect """
         self._signal_reconnect = True
 
+    def _set_book_tick_sizes(self):
+        """ Key the order books by integer ticks of each instrument """
+        for sym, processor in self._orderbook_processors.items():
+            instrument_static = self._instrument_static.get(sym)
+            if instrument_static:
+                processor.set_tick_size(instrument_static.tick_size)
+
     def _has_keys(self) -> bool:
         return self._api_key and self._api_secret
 
     def _init_cache(self):
-        # initialize data with REST APIs
+        # initialize data with REST APIs, on an executor thread
         if self._has_keys():
-            self._get_positions()
-            self._get_wallet_balances()
+            self._get_position_snapshot()
             self._get_orders()
 
-        self._ready_check.snapshot_ready = True
+    def _get_position_snapshot(self):
+        """ Request the positions and wallet balances, and record when the responses have arrived """
+        self._get_positions()
+        self._get_wallet_balances()
+        self._positions_time = time.time()
 
     async def _reconnect_ws(self):
         self._ready_check = ReadyCheck()
 
-        # initialize cache
-        self._init_cache()
+        # every book is subscribed again
+        self._recovering.clear()
+
+        # account events are buffered from the subscription until the REST snapshots are done
+        self._snapshot_generation += 1
+        self._account_buffer = []
 
         # ws connect and authenticate
         await self._connect_authenticate_ws()
@@ -131,9 +245,53 @@ class FtxManager:
         # subscribe to all channel
         await self._subscribe_all()
 
+        # initialize cache on a thread, the market data is processed meanwhile
+        generation = self._snapshot_generation
+        start = time.time_ns()
+        self._snapshot_start = time.time()
+        snapshot = self._loop.run_in_executor(None, self._init_cache)
+        snapshot.add_done_callback(lambda future: self._on_snapshot(generation, start, future))
+
+    def _on_snapshot(self, generation: int, start: int, future: asyncio.Future):
+        """ Apply the account events buffered while the REST snapshots were requested, on the event loop """
+        if generation != self._snapshot_generation:
+            # superseded by a later reconnect
+            return
+
+        if future.exception():
+            self._account_buffer = None
+            logging.error('failed to initialize cache, reconnecting: %s', future.exception())
+            self._signal_reconnect = True
+            return
+
+        # fills are added to the positions: the ones executed before the positions were requested are already in the
+        # snapshot and skipped, the ones executed after the responses are applied. A fill executed while the
+        # positions were requested may or may not be in the snapshot, so the positions are requested again
+        ambiguous = [data for handler, data in self._account_buffer if handler == self._on_fills and
+                     self._snapshot_start <= get_fill_time(data) <= self._positions_time]
+        if ambiguous:
+            logging.info('%s fills executed while the positions were requested, requesting them again',
+                         len(ambiguous))
+            self._snapshot_start = time.time()
+            positions = self._loop.run_in_executor(None, self._get_position_snapshot)
+            positions.add_done_callback(lambda f: self._on_snapshot(generation, start, f))
+            return
+
+        buffered, self._account_buffer = self._account_buffer, None
+        self._snapshot_duration.add(time.time_ns() - start)
+
+        # order updates are applied by order id
+        for handler, data in buffered:
+            if handler == self._on_fills and get_fill_time(data) < self._snapshot_start:
+                continue
+            handler(data)
+
+        logging.info('Snapshot ready, %s buffered account events', len(buffered))
+        self._ready_check.snapshot_ready = True
+
     async def _connect_authenticate_ws(self):
         logging.info('WS - Connect and authenticating')
-        self._conn = websockets.connect(self._url)
+        self._conn = websockets.connect(self._url, create_protocol=self._ws_protocol)
 
         try:
             self._ws = await self._conn.__aenter__()
@@ -142,7 +300,7 @@ class FtxManager:
                 # try authenticate
                 ts = int(time.time() * 1000)
                 signature_payload = f'{ts}websocket_login'.encode()
-                signature = hmac.new(self._api_secret.encode(), signature_payload, 'sha256').hexdigest()
+                signature = self._sign(signature_payload)
                 msg_auth = \
                     {
                         "op": "login",
@@ -156,6 +314,8 @@ class FtxManager:
 
             # connected
             self._ready_check.ws_connected = True
+            if self._arbiter:
+                self._arbiter.feed_up(0)
 
         except Exception as e:
             logging.error(e)
@@ -192,20 +352,34 @@ class FtxManager:
 
     def stop(self):
         logging.info("stopping")
-        self._loop.stop()
+        if self._runtime:
+            self._runtime.unregister(self._name)
+        else:
+            self._loop.stop()
         self._ready_check = None
 
     def _run_async_tasks(self):
         """ Run the following tasks concurrently in the current thread """
-        self._loop.create_task(self._listen_forever())
-        self._loop.create_task(self._keep_alive_websocket())
+        for coro in self._async_tasks():
+            self._loop.create_task(coro)
         self._loop.run_forever()
 
+    def _async_tasks(self) -> list:
+        """ The coroutines run for the lifetime of the gateway, on its own loop thread or on the runtime """
+        return [self._listen_forever(), self._keep_alive_websocket()] + \
+               [self._listen_book_feed(feed) for feed in range(1, self._book_feeds)]
+
     async def _keep_alive_websocket(self):
         while True:
             await asyncio.sleep(15)
             logging.info("Sending ping to WebSocket server")
             await self._ws.send('{"op": "ping"}')
+            for feed, ws in list(self._feed_ws.items()):
+                try:
+                    await ws.send('{"op": "ping"}')
+                except Exception as e:
+                    # reconnected by the feed listener
+                    logging.error('order book feed %s: ping failed: %s', feed, e)
 
     async def _listen_forever(self):
         """ This is the main callback that process incoming WebSocket messages from server """
@@ -215,7 +389,11 @@ class FtxManager:
             if not self._ws:
                 logging.error("websocket disconnected, reconnecting")
                 self._ready_check.ws_connected = False
+                if self._arbiter:
+                    self._arbiter.feed_down(0)
+                start = time.time_ns()
                 await self._reconnect_ws()
+                self._reconnect_downtime.add(time.time_ns() - start)
 
             if self._signal_reconnect:
                 logging.info("received reconnect signal")
@@ -231,74 +409,231 @@ class FtxManager:
                 # process the message
                 self._process_websocket_message(response)
 
+                if self._conflator:
+                    await self._drain_buffered_messages()
+
             except (asyncio.TimeoutError, websockets.exceptions.ConnectionClosed) as e:
                 logging.error('connection issue, resetting ws: %s' % e)
                 self._ready_check.ws_connected = False
                 self._ws = None
 
+            except BookChannelError as e:
+                logging.error('%s, resubscribing: %s', e, e.__cause__)
+                await self._resubscribe_book(e.symbol)
+
             except Exception as e:
                 logging.error('encountered issue, resetting ws: %s' % e)
                 self._ready_check.ws_connected = False
                 self._ws = None
 
-    def _process_websocket_message(self, message: str):
-        data = json.loads(message)
-
-        if 'type' in data and data['type'] == 'subscribed':
-            logging.info('Received subscription response: ' + message)
-            # subscription successful response
-            # {"type": "subscribed", "channel": "orderbook", "market": "BTC-PERP"}
-            # {"type": "subscribed", "channel": "orders"}
-            channel = data['channel']
-            if channel == 'orders':
-                logging.info('Websocket order stream ready')
-                self._ready_check.orders_stream_ready = True
-            elif channel == 'fills':
-                logging.info('Websocket fill stream ready')
-                self._ready_check.position_stream_ready = True
-
-        elif 'channel' in data and data['channel'] == 'orderbook':
-            market = data['market']
-            processor = self._orderbook_processors.get(market)
-            processor.handle(data)
-            order_book = processor.get_orderbook()
-            self._orderbooks[market] = order_book
-
-            if self._depth_callback:
+    async def _drain_buffered_messages(self, ws=None, process=None):
+        """ Apply the messages already received by the websocket, by default the main one, then publish the changed
+            books once """
+        ws = ws or self._ws
+        process = process or self._process_websocket_message
+        conflator = self._conflator
+        count = 1
+        while ws.messages and count < conflator.max_batch:
+            process(await ws.recv())
+            count += 1
+        conflator.message_count += count
+
+        for market, processor in conflator.drain():
+            try:
+                self._publish_book(market, processor)
+            except Exception as e:
+                raise BookChannelError(market) from e
+
+    async def _listen_book_feed(self, feed: int):
+        """ Receive the order books over an additional connection, arbitrated with the other feeds """
+        router = self._init_book_feed_router(feed)
+        ws = None
+        while True:
+            try:
+                if ws is None:
+                    logging.info('WS - Connecting order book feed %s', feed)
+                    ws = await websockets.connect(self._url, create_protocol=self._ws_protocol)
+                    self._feed_ws[feed] = ws
+                    self._arbiter.feed_up(feed)
+                    for sym in self._symbol:
+                        await ws.send(json.dumps({'op': 'subscribe', 'channel': 'orderbook', 'market': sym}))
+
+                router.route(await asyncio.wait_for(ws.recv(), timeout=10))
+
+                if self._conflator:
+                    await self._drain_buffered_messages(ws, router.route)
+
+            except BookChannelError as e:
+                logging.error('%s, resubscribing: %s', e, e.__cause__)
+                await self._resubscribe_book(e.symbol)
+
+            except Exception as e:
+                logging.error('order book feed %s: connection issue, reconnecting: %s', feed, e)
+                self._feed_ws.pop(feed, None)
+                self._arbiter.feed_down(feed)
+                ws = None
+                await asyncio.sleep(1)
+
+    async def _resubscribe_book(self, symbol: str):
+        """ Unsubscribe and subscribe again the order book of one symbol, the other channels are kept """
+        self._book_failures[symbol] += 1
+        self._recovering[symbol] = time.time_ns()
+        if self._arbiter:
+            self._arbiter.reset(symbol)
+        try:
+            await self._send_ws(json.dumps({'op': 'unsubscribe', 'channel': 'orderbook', 'market': symbol}))
+            await self._send_ws(json.dumps({'op': 'subscribe', 'channel': 'orderbook', 'market': symbol}))
+        except Exception as e:
+            logging.error('failed to resubscribe %s, resetting ws: %s', symbol, e)
+            self._ready_check.ws_connected = False
+            self._ws = None
+
+    def _on_book_recovered(self, symbol: str):
+        start = self._recovering.pop(symbol)
+        self._book_recoveries[symbol].add(time.time_ns() - start)
+        logging.info('order book of %s recovered', symbol)
+
+    def _publish_book(self, market: str, processor):
+        """ Rebuild the book of a market and pass it to the depth callback """
+        order_book = processor.get_orderbook()
+        self._orderbooks[market] = order_book
+
+        if self._depth_callback:
+            if self._dispatcher:
+                self._dispatcher.submit_book(self._depth_callback, market, order_book)
+            else:
                 self._depth_callback(market, order_book)
 
-            if data['type'] == 'partial':
-                """ we have received initial snapshot """
-                logging.info('Websocket depth snapshot: {}'.format(message))
-                # check if we have snapshot for all symbols
-                all_depth_ready = True
-                for symbol, processor in self._orderbook_processors.items():
-                    if not processor.ready():
-                        all_depth_ready = False
-                        break
-
-                if all_depth_ready:
-                    logging.info('Websocket depth stream ready')
-                    self._ready_check.depth_stream_ready = True
-
-        elif 'channel' in data and data['channel'] == 'fills':
-            logging.info(message)
-            process_fills(data, self._positions)
-
-        elif 'channel' in data and data['channel'] == 'orders':
-            logging.info(message)
-            order_event = process_orders_ws(data, self._open_orders)
+        self._subscribers.publish_book(market, order_book)
 
-            if order_event and self._id_generator.match(order_event.client_id):
-                if self._execution_callback:
-                    # callback if this order event is originated from this connection
-                    self._execution_callback(order_event)
+    def _process_websocket_message(self, message: str):
+        self._router.route(message)
+
+    def _init_router(self) -> MessageRouter:
+        """ Route the frames by channel, the messages that are only logged are not decoded """
+        router = MessageRouter(self._json_loads)
+        # {"type": "subscribed", "channel": "orderbook", "market": "BTC-PERP"}, checked first as it names a channel
+        router.add_route('subscribed', '"subscribed"', self._on_subscribed)
+        router.add_route('orderbook', '"orderbook"', self._on_orderbook)
+        router.add_route('fills', '"fills"', self._on_fills)
+        router.add_route('orders', '"orders"', self._on_orders)
+        router.add_route('pong', '"pong"', logging.info, decode=False)
+        router.set_default(logging.info)
+        return router
+
+    def _init_book_feed_router(self, feed: int) -> MessageRouter:
+        """ Route the frames of an additional book feed, only the order books are processed """
+        router = MessageRouter(self._json_loads)
+        router.add_route('subscribed', '"subscribed"', logging.info, decode=False)
+        router.add_route('orderbook', '"orderbook"', lambda data: self._on_orderbook(data, feed))
+        router.set_default(logging.info)
+        return router
+
+    def _on_subscribed(self, data: dict):
+        logging.info('Received subscription response: {}'.format(data))
+        # subscription successful response
+        # {"type": "subscribed", "channel": "orderbook", "market": "BTC-PERP"}
+        # {"type": "subscribed", "channel": "orders"}
+        channel = data['channel']
+        if channel == 'orders':
+            logging.info('Websocket order stream ready')
+            self._ready_check.orders_stream_ready = True
+        elif channel == 'fills':
+            logging.info('Websocket fill stream ready')
+            self._ready_check.position_stream_ready = True
+
+    def _on_orderbook(self, data: dict, feed: int = 0):
+        market = data['market']
+        recovering = market in self._recovering
+        if recovering and data['type'] != 'partial':
+            # updates of the previous subscription and the unsubscribed response, until the new snapshot
+            return
+
+        if self._arbiter and not self._arbitrate(market, data, feed):
+            # already received over another feed
+            return
+
+        try:
+            self._handle_orderbook(market, data)
+        except Exception as e:
+            raise BookChannelError(market) from e
+
+        if recovering:
+            self._on_book_recovered(market)
+
+    def _handle_orderbook(self, market: str, data: dict):
+        processor = self._orderbook_processors.get(market)
+        processor.handle(data)
+
+        # skip the rebuild and callback if the update is outside of the visible depth
+        if processor.changed:
+            if self._conflator:
+                self._conflator.add(market, processor)
             else:
-                logging.info("Received execution that is not originated from this connection")
+                self._publish_book(market, processor)
+
+        if data['type'] == 'partial':
+            """ we have received initial snapshot """
+            logging.info('Websocket depth snapshot: {}'.format(data))
+            self._check_depth_ready()
+
+    def _check_depth_ready(self):
+        # check if we have snapshot for all symbols
+        all_depth_ready = True
+        for symbol, processor in self._orderbook_processors.items():
+            if not processor.ready():
+                all_depth_ready = False
+                break
+
+        if all_depth_ready:
+            logging.info('Websocket depth stream ready')
+            self._ready_check.depth_stream_ready = True
+
+    def _arbitrate(self, market: str, data: dict, feed: int) -> bool:
+        """ Return True if the order book message is the first copy received, identified by its time and checksum """
+        action = data['type']
+        if action == 'update':
+            update = data['data']
+            return self._arbiter.accept(feed, market, update['time'], (update['time'], update['checksum']))
+
+        if action == 'partial':
+            if self._arbiter.accept_snapshot(feed, market, data['data']['time']):
+                return True
+            # the book is kept up to date by another feed
+            self._check_depth_ready()
+            return False
+        return True
+
+    def _on_fills(self, data: dict):
+        if self._account_buffer is not None:
+            self._account_buffer.append((self._on_fills, data))
+            return
 
-        else:
-            logging.info(message)
+        logging.info(data)
+        process_fills(data, self._positions)
+
+    def _on_orders(self, data: dict):
+        if self._account_buffer is not None:
+            self._account_buffer.append((self._on_orders, data))
+            return
 
+        logging.info(data)
+        with self._orders_lock:
+            order_event = process_orders_ws(data, self._open_orders)
+            if order_event and order_event.status is not OrderStatus.OPEN:
+                self._closed_orders.add(order_event.order_id)
+
+        if order_event and self._id_generator.match(order_event.client_id):
+            if self._execution_callback:
+                # callback if this order event is originated from this connection
+                if self._dispatcher:
+                    self._dispatcher.submit_event(self._execution_callback, order_event)
+                else:
+                    self._execution_callback(order_event)
+
+            self._subscribers.publish_event(order_event)
+        else:
+            logging.info("Received execution that is not originated from this connection")
 
     """ ----------------------------------- """
     """             REST API                """
@@ -306,7 +641,7 @@ class FtxManager:
 
     def _get_static(self):
         logging.info('REST - Requesting static data')
-        resp = requests.get(URL_REST + '/markets')
+        resp = self._http.get('/markets')
         message = resp.json()
         for data in message['result']:
             contract_name = data.get('name')
@@ -314,12 +649,15 @@ class FtxManager:
                                                   tick_size=float(data.get('priceIncrement')),
                                                   quantity_size=float(data.get('sizeIncrement')))
             self._instrument_static[contract_name] = instrument_static
+            self._quantity_ticks[contract_name] = PriceTicks(instrument_static.quantity_size)
 
     def _get_orders(self):
         logging.info('REST - Requesting open orders')
         data = self._private_request('/orders')
         logging.info(data)
-        self._open_orders = process_orders(data)
+        open_orders = process_orders(data)
+        with self._orders_lock:
+            self._open_orders = open_orders
 
     def _get_positions(self):
         logging.info('REST - Requesting positions')
@@ -335,31 +673,44 @@ class FtxManager:
         self._positions = {**self._positions, **balances}
 
     def _private_request(self, method: str) -> object:
-        request = Request('GET', URL_REST + method)
-        self._set_private_header(request)
-        session = Session()
-        response = session.send(request.prepare())
-        return response.json()
+        return self._send_private(Request('GET', self._rest_url + method))
 
     def _private_request_post(self, method: str, data: dict) -> object:
-        request = Request('POST', URL_REST + method, json=data)
-        self._set_private_header(request)
-        session = Session()
-        response = session.send(request.prepare())
+        # serialized once, the signature is computed over the bytes sent
+        body = json.dumps(data, separators=(',', ':')).encode()
+        return self._send_private(Request('POST', self._rest_url + method, data=body,
+                                          headers={'Content-Type': 'application/json'}))
+
+    def _private_request_delete(self, method: str, data: dict = None) -> object:
+        if data is None:
+            return self._send_private(Request('DELETE', self._rest_url + method))
+        body = json.dumps(data, separators=(',', ':')).encode()
+        return self._send_private(Request('DELETE', self._rest_url + method, data=body,
+                                          headers={'Content-Type': 'application/json'}))
+
+    def _send_private(self, request: Request) -> object:
+        """ Prepare the request once, sign the prepared method, path and body, and send it """
+        prepared = request.prepare()
+        self._set_private_header(prepared)
+        response = self._http.send(prepared)
         return response.json()
 
-    def _set_private_header(self, request: Request):
-        ts = int(time.time() * 1000)
-        prepared = request.prepare()
+    def _set_private_header(self, prepared: PreparedRequest):
+        ts = str(int(time.time() * 1000))
 
-        signature_payload = f'{ts}{prepared.method}{prepared.path_url}'.encode()
+        signature_payload = (ts + prepared.method + prepared.path_url).encode()
         if prepared.body:
             signature_payload += prepared.body
 
-        signature = hmac.new(self._api_secret.encode(), signature_payload, 'sha256').hexdigest()
-        request.headers['FTX-KEY'] = self._api_key
-        request.headers['FTX-SIGN'] = signature
-        request.headers['FTX-TS'] = str(ts)
+        headers = prepared.headers
+        headers['FTX-KEY'] = self._api_key
+        headers['FTX-SIGN'] = self._sign(signature_payload)
+        headers['FTX-TS'] = ts
+
+    def _sign(self, payload: bytes) -> str:
+        signature = self._hmac.copy()
+        signature.update(payload)
+        return signature.hexdigest()
 
 
     #############################################
@@ -370,8 +721,11 @@ class FtxManager:
         return self._ready_check is not None and self._ready_check.not_ready()
 
     def get_ticker(self, contract_name: str) -> OrderBook:
-        """ To get latest orderbook """
-        return self._orderbooks.get(contract_name)
+        """ To get latest orderbook, with lazy_books only its top of book as the view reads the event loop books """
+        order_book = self._orderbooks.get(contract_name)
+        if self._lazy_books and order_book:
+            return order_book.top_of_book()
+        return order_book
 
     def get_delta(self, symbol: str) -> float:
         """ To get position from position manager """
@@ -396,19 +750,93 @@ class FtxManager:
 
     def place_order(self, nos) -> str:
         """ Place an order. Return client order id if successful """
+        return self._place_order(nos).client_id
+
+    def _place_order(self, nos: NewOrderSingle) -> OrderResult:
         client_id = self._id_generator.next()
-        instrument_static = self._instrument_static.get(nos.symbol)
-        data = get_place_order_message(nos, instrument_static, client_id)
-        logging.info('sending order: {}'.format(data))
+        data = get_place_order_message(nos, self._instrument_static.get(nos.symbol), client_id,
+                                       self._get_quantity_ticks(nos.symbol))
         response = self._private_request_post('/orders', data)
-        logging.info(response)
+
+        # logged once the order is on its way, and formatted only if enabled
+        logging.info('sent order: %s, response: %s', data, response)
 
         # {'success': False, 'error': 'Account does not have enough margin for order.'}
         # {'success': True, 'result': {'id': 78441353101, 'clientId': None, 'market': 'BTC-PERP', 'type': 'limit', 'side': 'buy', 'price': 30000.0, 'size': 0.001, 'status': 'new', 'filledSize': 0.0, 'remainingSize': 0.001, 'reduceOnly': False, 'liquidation': None, 'avgFillPrice': None, 'postOnly': False, 'ioc': False, 'createdAt': '2021-09-11T08:56:17.378995+00:00', 'future': 'BTC-PERP'}}
         if response['success']:
-            return client_id
+            order_id = None
+            if response.get('result'):
+                order = parse_order(response['result'])
+                self._add_open_order(order)
+                order_id = order.order_id
+            return OrderResult(nos.symbol, client_id, order_id, success=True)
         else:
-            return None
+            return OrderResult(nos.symbol, error=response.get('error'))
+
+    async def place_order_async(self, nos: NewOrderSingle) -> str:
+        """ Place an order without blocking the event loop. Return client order id if successful """
+        return await self._order_entry.run(self.place_order, nos)
+
+    def submit_order(self, nos: NewOrderSingle) -> Future:
+        """ Place an order from any thread without blocking. Return a Future of the client order id """
+        return self._order_entry.submit(self.place_order, nos)
+
+    def place_orders(self, orders: [NewOrderSingle]) -> [OrderResult]:
+        """
+            Place orders concurrently, up to order_workers at a time, over the pooled connections. Return a result per
+            order, in the order of the orders. The orders are in get_orders() as soon as they are accepted
+        """
+        return self._order_entry.run_batch(self._place_order, orders)
+
+    def cancel_order(self, contract_name: str, order_id: str) -> OrderResult:
+        """ Cancel an order by order id """
+        return self.cancel_orders(contract_name, [order_id])[0]
+
+    def cancel_orders(self, contract_name: str, order_ids: [str]) -> [OrderResult]:
+        """
+            Cancel orders concurrently by order id. Return a result per order, in the order of the order ids.
+            The orders are removed from get_orders() before the requests are sent, and restored if a cancel fails
+        """
+        removed = [self._pop_open_order(contract_name, order_id) for order_id in order_ids]
+        results = self._order_entry.run_batch(self._cancel_order, [(contract_name, order_id) for order_id in order_ids])
+        for order_id, order, result in zip(order_ids, removed, results):
+            result.symbol = contract_name
+            result.order_id = order_id
+            if not result.success and order:
+                self._add_open_order(order)
+        return results
+
+    def _cancel_order(self, request: (str, str)) -> OrderResult:
+        contract_name, order_id = request
+        response = self._private_request_delete('/orders/{}'.format(order_id))
+        logging.info('canceled order: %s, response: %s', order_id, response)
+        return OrderResult(contract_name, order_id=order_id, success=response['success'], error=response.get('error'))
+
+    def cancel_all_orders(self, contract_name: str) -> OrderResult:
+        """ Cancel all the orders of a symbol, they are removed from get_orders() and restored if the cancel fails """
+        with self._orders_lock:
+            removed = self._open_orders.pop(contract_name, {})
+        try:
+            response = self._private_request_delete('/orders', {'market': contract_name})
+            logging.info('canceled all orders: %s, response: %s', contract_name, response)
+            result = OrderResult(contract_name, success=response['success'], error=response.get('error'))
+        except Exception as e:
+            logging.error('cancel all orders failed: %s, %s', contract_name, e)
+            result = OrderResult(contract_name, error=e)
+        if not result.success:
+            for order in removed.values():
+                self._add_open_order(order)
+        return result
+
+    def _add_open_order(self, order: Order):
+        """ Store an order ahead of its websocket update, unless it has closed in the meantime """
+        with self._orders_lock:
+            if order.order_id not in self._closed_orders:
+                self._open_orders.setdefault(order.symbol, {})[order.order_id] = order
+
+    def _pop_open_order(self, contract_name: str, order_id: str) -> Order:
+        with self._orders_lock:
+            return self._open_orders.get(contract_name, {}).pop(order_id, None)
 
     def get_tick_size(self, contract_name: str):
         if contract_name in self._instrument_static:
@@ -417,13 +845,33 @@ class FtxManager:
         else:
             return None
 
+    def get_recovery_stats(self) -> dict:
+        """ Return the order book failures and recovery times of each symbol resubscribed """
+        return {symbol: dict(self._book_recoveries[symbol].get_stats(), failures=failures)
+                for symbol, failures in self._book_failures.items()}
+
+    def get_feed_stats(self) -> dict:
+        """ Win rate and lead time of each book feed, None with a single feed """
+        return self._arbiter.get_stats() if self._arbiter else None
+
+    def get_reconnect_stats(self) -> dict:
+        """ Return the websocket reconnect downtime and the REST snapshot durations """
+        return {'downtime': self._reconnect_downtime.get_stats(), 'snapshot': self._snapshot_duration.get_stats()}
+
     def get_quantity_size(self, contract_name: str):
         if contract_name in self._instrument_static:
             instrument_static = self._instrument_static.get(contract_name)
-            return instrument_static.qty_increment
+            return instrument_static.quantity_size
         else:
             return 0
 
+    def _get_quantity_ticks(self, contract_name: str) -> PriceTicks:
+        quantity_ticks = self._quantity_ticks.get(contract_name)
+        if quantity_ticks is None:
+            quantity_ticks = PriceTicks(self._instrument_static[contract_name].quantity_size)
+            self._quantity_ticks[contract_name] = quantity_ticks
+        return quantity_ticks
+
     def register_signal_callback(self, callback):
         """ a signal callback function takes two arguments: (contract_name:str, data:{}) """
         assert_param_counts(callback, 2)
@@ -439,6 +887,42 @@ class FtxManager:
         assert_param_counts(callback, 1)
         self._execution_callback = callback
 
+    def add_depth_subscriber(self, callback, policy: str = INLINE, symbols: {str} = None) -> Subscriber:
+        """ add a depth callback function next to the registered one: (contract_name:str, book: OrderBook)
+            policy is one of inline, threaded or conflated, symbols restricts the books delivered (all if None) """
+        assert_param_counts(callback, 2)
+        if self._lazy_books and policy != INLINE:
+            raise ValueError('lazy_books can only be delivered inline, books are read from another thread')
+        return self._subscribers.add_depth(callback, policy, symbols)
+
+    def add_execution_subscriber(self, callback, policy: str = INLINE, symbols: {str} = None) -> Subscriber:
+        """ add an execution callback function next to the registered one: (event: OrderEvent)
+            events are never conflated, a conflated subscriber receives every event in order """
+        assert_param_counts(callback, 1)
+        return self._subscribers.add_execution(callback, policy, symbols)
+
+    def remove_subscriber(self, subscriber: Subscriber):
+        self._subscribers.remove(subscriber)
+
+    def get_http_timings(self) -> list:
+        """ Return the latency breakdown (RequestTiming) of the latest REST requests, oldest first """
+        return list(self._http.timings)
+
+    def get_message_rates(self) -> dict:
+        """ Return the number of websocket messages per second of each channel since the previous call """
+        return self._router.get_rates()
+
+    def get_conflation_stats(self) -> dict:
+        """ Return the number of batches, messages, visible book updates and updates conflated into a later book """
+        return self._conflator.get_stats() if self._conflator else {}
+
+    def register_delta_callback(self, callback):
+        """ a delta callback function takes two arguments: (contract_name:str, delta: BookDelta)
+            it is called from the order book processor with the level changes of every message """
+        assert_param_counts(callback, 2)
+        for processor in self._orderbook_processors.values():
+            processor.delta_callback = callback
+
 
 def process_position(message: dict) -> dict:
     #'{"success": "True", "result": [{"future": "BTC-PERP", "size": 0.0001, "side": "buy", "netSize": 0.0001, "longOrderSize": 0.0, "shortOrderSize": 0.0, "cost": 4.7122, "entryPrice": 47122.0, "unrealizedPnl": 0.0, "realizedPnl": 0.0123, "initialMarginRequirement": 1.0, "maintenanceMarginRequirement": 0.03, "openSize": 0.0001, "collateralUsed": 4.7122, "estimatedLiquidationPrice": 0.0}]}'
@@ -487,6 +971,11 @@ def process_fills(message: dict, store: dict):
             store[symbol] = position
 
 
+def get_fill_time(message: dict) -> float:
+    # {"channel": "fills", "type": "update", "data": {..., "time": "2021-09-09T14:10:25.646508+00:00", ...}}
+    return datetime.fromisoformat(message['data']['time']).timestamp()
+
+
 def process_orders(message: dict) -> dict:
     # {'success': True, 'result': [{'id': 77934326712, 'clientId': None, 'market': 'BTC-PERP', 'type': 'limit', 'side': 'buy', 'price': 30000.0, 'size': 0.0001, 'status': 'open', 'filledSize': 0.0, 'remainingSize': 0.0001, 'reduceOnly': False, 'liquidation': False, 'avgFillPrice': None, 'postOnly': False, 'ioc': False, 'createdAt': '2021-09-09T15:48:04.320464+00:00', 'future': 'BTC-PERP'}]}
     store = {}
@@ -495,33 +984,39 @@ def process_orders(message: dict) -> dict:
         return store
 
     for data in message['result']:
-        contract_name = data.get('market')
-        order_id = str(data.get('id'))
-        qty = float(data.get('size'))
-        side = Side.Sell if data.get('side') == "sell" else Side.Buy
-        timestamp = data.get('createdAt')
-        order_type = data.get('type').upper()
-        if 'price' in data:
-            price = float(data.get('price'))
-        else:
-            price = None
-
-        order = Order(symbol=contract_name,
-                      price=price,
-                      side=side,
-                      order_id=order_id,
-                      leaves_qty=qty,
-                      timestamp=timestamp,
-                      order_type=order_type)
+        order = parse_order(data)
 
-        if contract_name not in store:
-            store[contract_name] = {}
+        if order.symbol not in store:
+            store[order.symbol] = {}
 
-        store[contract_name][order_id] = order
+        store[order.symbol][order.order_id] = order
 
     return store
 
 
+def parse_order(data: dict) -> Order:
+    contract_name = data.get('market')
+    order_id = str(data.get('id'))
+    qty = float(data.get('size'))
+    side = Side.Sell if data.get('side') == "sell" else Side.Buy
+    timestamp = data.get('createdAt')
+    order_type = data.get('type').upper()
+    if 'price' in data:
+        price = float(data.get('price'))
+    else:
+        price = None
+
+    order = Order(symbol=contract_name,
+                  price=price,
+                  side=side,
+                  order_id=order_id,
+                  leaves_qty=qty,
+                  timestamp=timestamp,
+                  order_type=order_type)
+
+    return order
+
+
 def process_orders_ws(message: dict, store: dict) -> [OrderEvent]:
     # {"channel": "orders", "type": "update", "data": {"id": 77921137820, "clientId": null, "market": "BTC-PERP", "type": "limit", "side": "buy", "price": 30000.0, "size": 0.0001, "status": "new", "filledSize": 0.0, "remainingSize": 0.0001, "reduceOnly": false, "liquidation": false, "avgFillPrice": null, "postOnly": false, "ioc": false, "createdAt": "2021-09-09T14:47:17.792437+00:00"}}
     if 'channel' in message and message['channel'] == 'orders':
@@ -563,6 +1058,7 @@ def process_orders_ws(message: dict, store: dict) -> [OrderEvent]:
                                      order_id=order_id,
                                      status=OrderStatus.OPEN,
                                      client_id=client_id)
+            order_event.filled_quantity = float(data.get('filledSize') or 0)
 
         elif status == 'closed':
             # remove from the cache
@@ -580,19 +1076,30 @@ def process_orders_ws(message: dict, store: dict) -> [OrderEvent]:
                                      status=order_status,
                                      canceled_reason="",
                                      client_id=client_id)
+            order_event.filled_quantity = float(data['filledSize'])
 
         return order_event
 
 
 class OrderBookProcessor:
-    def __init__(self, symbol: str, depth=5):
+    def __init__(self, symbol: str, depth=5, tick_size: float = None):
         self._symbol = symbol
         self._depth = depth
 
+        # price levels are keyed by integer ticks
+        self._ticks = PriceTicks(tick_size)
+
         # a map that contain bids and asks sides
-        self._orderbooks: DefaultDict[str, DefaultDict[float, float]] = defaultdict(lambda: defaultdict(float))
+        self._orderbooks: DefaultDict[str, DefaultDict[int, float]] = defaultdict(lambda: defaultdict(float))
         self._timestamp = 0
 
+        # True if the last message has changed the top depth levels
+        self.changed = False
+        self._order_book = None
+
+        # called with (symbol, BookDelta) for every message handled
+        self.delta_callback = None
+
     def handle(self, message: str):
         market = message['market']
         if market != self._symbol:
@@ -600,23 +1107,50 @@ class OrderBookProcessor:
 
         data = message['data']
 
-        if data['action'] == 'partial':
+        changed = data['action'] == 'partial'
+        if changed:
             self._reset()
 
+        to_ticks = self._ticks.to_ticks
         for side in {'bids', 'asks'}:
             book = self._orderbooks[side]
             for price, size in data[side]:
+                ticks = to_ticks(price)
+                if not changed and size != book.get(ticks, 0):
+                    changed = self._visible(side, ticks)
                 if size:
-                    book[price] = size
+                    book[ticks] = size
                 else:
-                    del book[price]
+                    del book[ticks]
 
         self._timestamp = data['time']
 
+        if self.delta_callback:
+            self.delta_callback(self._symbol, get_book_delta(data))
+
+        self.changed = changed
+        if changed:
+            self._order_book = None
+
+    def _visible(self, side: str, ticks: int) -> bool:
+        """ Check against the last built order book if an update at this price changes the top depth levels """
+        if self._order_book is None:
+            return True
+
+        tiers = self._order_book.bids if side == 'bids' else self._order_book.asks
+        if len(tiers) < self._depth:
+            return True
+
+        boundary = self._ticks.to_ticks(tiers[-1].price)
+        return ticks >= boundary if side == 'bids' else ticks <= boundary
+
     def get_orderbook(self) -> OrderBook:
         if self._timestamp == 0:
             return 0
 
+        if self._order_book is not None:
+            return self._order_book
+
         sorted_orderbooks = {side: sorted(
             [(price, quantity) for price, quantity in list(self._orderbooks[side].items())
              if quantity],
@@ -625,9 +1159,11 @@ class OrderBookProcessor:
         )
         for side in {'bids', 'asks'}}
 
-        return OrderBook(timestamp=self._timestamp,
-                         bids=[Tier(price=p, size=s) for (p, s) in sorted_orderbooks['bids'][:self._depth]],
-                         asks=[Tier(price=p, size=s) for (p, s) in sorted_orderbooks['asks'][:self._depth]])
+        to_price = self._ticks.to_price
+        self._order_book = OrderBook(timestamp=self._timestamp,
+                                     bids=[Tier(price=to_price(t), size=s) for (t, s) in sorted_orderbooks['bids'][:self._depth]],
+                                     asks=[Tier(price=to_price(t), size=s) for (t, s) in sorted_orderbooks['asks'][:self._depth]])
+        return self._order_book
 
     def _reset(self) -> None:
         if 'bids' in self._orderbooks:
@@ -637,13 +1173,246 @@ class OrderBookProcessor:
             del self._orderbooks['asks']
 
         self._timestamp = 0
+        self._order_book = None
+
+    def set_tick_size(self, tick_size: float) -> None:
+        """ Set the instrument tick size used to key the price levels, the book is cleared until next partial """
+        self._ticks = PriceTicks(tick_size)
+        self._reset()
 
     def ready(self) -> bool:
         return self._timestamp > 0
 
 
-def get_place_order_message(nos: NewOrderSingle, instrument_static: InstrumentDetails, client_id: str) -> dict:
-    """ construct place order request and return a JSON string """
+class SortedOrderBookProcessor:
+    """
+        Same interface as OrderBookProcessor, but each side is kept sorted as the updates are applied, so that
+        an update costs O(log n) to locate the price level and get_orderbook() only reads the top N levels instead
+        of sorting the whole book. OrderBookProcessor is kept as the reference implementation.
+    """
+    def __init__(self, symbol: str, depth=5, tick_size: float = None, lazy=False):
+        self._symbol = symbol
+        self._depth = depth
+
+        # price levels are keyed by integer ticks
+        self._ticks = PriceTicks(tick_size)
+
+        self._bids = SortedBookSide(descending=True)
+        self._asks = SortedBookSide(descending=False)
+        self._timestamp = 0
+
+        # True if the last message has changed the top depth levels
+        self.changed = False
+        self._order_book = None
+
+        # called with (symbol, BookDelta) for every message handled
+        self.delta_callback = None
+
+        # incremented on every change of the top depth levels, to detect stale OrderBookView
+        self.version = 0
+
+        # return OrderBookView instead of materializing all the tiers
+        self._lazy = lazy
+
+    def handle(self, message: dict):
+        market = message['market']
+        if market != self._symbol:
+            raise ValueError("Received message for market {} but this processor is for {}".format(market, self._symbol))
+
+        data = message['data']
+
+        changed = data['action'] == 'partial'
+        if changed:
+            self._reset()
+
+        depth = self._depth
+        to_ticks = self._ticks.to_ticks
+        for book, levels in ((self._bids, data['bids']), (self._asks, data['asks'])):
+            for price, size in levels:
+                ticks = to_ticks(price)
+                if not changed and size != book.get(ticks, 0):
+                    changed = book.within(ticks, depth)
+                if size:
+                    book.set(ticks, size)
+                else:
+                    book.remove(ticks)
+
+        self._timestamp = data['time']
+
+        if self.delta_callback:
+            self.delta_callback(self._symbol, get_book_delta(data))
+
+        self.changed = changed
+        if changed:
+            self._order_book = None
+            self.version += 1
+
+    def get_orderbook(self) -> OrderBook:
+        if self._timestamp == 0:
+            return 0
+
+        if self._order_book is None:
+            if self._lazy:
+                self._order_book = OrderBookView(timestamp=self._timestamp, source=self)
+            else:
+                self._order_book = OrderBook(timestamp=self._timestamp,
+                                             bids=self.get_tiers('bids'),
+                                             asks=self.get_tiers('asks'))
+        return self._order_book
+
+    def get_tiers(self, side: str, n: int = None) -> [Tier]:
+        """ Return the best n tiers of 'bids' or 'asks', up to the book depth if n is None """
+        book = self._bids if side == 'bids' else self._asks
+        to_price = self._ticks.to_price
+        return [Tier(price=to_price(t), size=s) for (t, s) in book.top(self._depth if n is None else n)]
+
+    def get_tier_count(self, side: str) -> int:
+        """ Return the number of tiers of 'bids' or 'asks' within the book depth """
+        return min(self._depth, len(self._bids if side == 'bids' else self._asks))
+
+    def _reset(self) -> None:
+        self._bids.clear()
+        self._asks.clear()
+        self._timestamp = 0
+        self._order_book = None
+
+    def set_tick_size(self, tick_size: float) -> None:
+        """ Set the instrument tick size used to key the price levels, the book is cleared until next partial """
+        self._ticks = PriceTicks(tick_size)
+        self._reset()
+        self.version += 1
+
+    def ready(self) -> bool:
+        return self._timestamp > 0
+
+
+class LadderOrderBookProcessor:
+    """
+        Same interface as OrderBookProcessor, backed by a dense price ladder centred on the mid. A level update is
+        an array write, and deep reads such as get_cumulative_depth() are vectorized, which suits liquid perpetuals
+        where the populated book is a contiguous band of ticks. Requires the tick size of the instrument to be set.
+
+        On the update path it is close to SortedOrderBookProcessor but not faster, the sorted book remains the
+        default. The ladder pays off when the strategy reads deep into the book on every update, e.g. the cumulative
+        size of the best hundreds of levels. See benchmarks/bench_ladder.py.
+    """
+    def __init__(self, symbol: str, depth=5, tick_size: float = None, capacity: int = DEFAULT_CAPACITY, lazy=False):
+        self._symbol = symbol
+        self._depth = depth
+
+        # price levels are keyed by integer ticks
+        self._ticks = PriceTicks(tick_size)
+        self._ladder = PriceLadder(capacity)
+        self._timestamp = 0
+
+        # True if the last message has changed the top depth levels
+        self.changed = False
+        self._order_book = None
+
+        # called with (symbol, BookDelta) for every message handled
+        self.delta_callback = None
+
+        # incremented on every change of the top depth levels, to detect stale OrderBookView
+        self.version = 0
+
+        # return OrderBookView instead of materializing all the tiers
+        self._lazy = lazy
+
+    def handle(self, message: dict):
+        market = message['market']
+        if market != self._symbol:
+            raise ValueError("Received message for market {} but this processor is for {}".format(market, self._symbol))
+
+        data = message['data']
+
+        changed = data['action'] == 'partial'
+        if changed:
+            self._reset()
+            # the levels of a partial are sorted best first, place the window on the mid once
+            if data['bids'] and data['asks']:
+                self._ladder.center((self._ticks.to_ticks(data['bids'][0][0]) + self._ticks.to_ticks(data['asks'][0][0])) // 2)
+
+        depth = self._depth
+        ladder = self._ladder
+        to_ticks = self._ticks.to_ticks
+        for side, levels in ((BID, data['bids']), (ASK, data['asks'])):
+            for price, size in levels:
+                ticks = to_ticks(price)
+                if not changed and size != ladder.size(side, ticks):
+                    changed = ladder.within(side, ticks, depth)
+                ladder.set(side, ticks, size)
+
+        self._timestamp = data['time']
+
+        if self.delta_callback:
+            self.delta_callback(self._symbol, get_book_delta(data))
+
+        self.changed = changed
+        if changed:
+            self._order_book = None
+            self.version += 1
+
+    def get_orderbook(self) -> OrderBook:
+        if self._timestamp == 0:
+            return 0
+
+        if self._order_book is None:
+            if self._lazy:
+                self._order_book = OrderBookView(timestamp=self._timestamp, source=self)
+            else:
+                self._order_book = OrderBook(timestamp=self._timestamp,
+                                             bids=self.get_tiers('bids'),
+                                             asks=self.get_tiers('asks'))
+        return self._order_book
+
+    def get_tiers(self, side: str, n: int = None) -> [Tier]:
+        """ Return the best n tiers of 'bids' or 'asks', up to the book depth if n is None """
+        ticks, sizes, _ = self._ladder.top(BID if side == 'bids' else ASK, self._depth if n is None else n)
+        to_price = self._ticks.to_price
+        return [Tier(price=to_price(t), size=s) for (t, s) in zip(ticks, sizes)]
+
+    def get_tier_count(self, side: str) -> int:
+        """ Return the number of tiers of 'bids' or 'asks' within the book depth """
+        return len(self._ladder.top(BID if side == 'bids' else ASK, self._depth)[0])
+
+    def get_cumulative_depth(self, side: str, levels: int = None):
+        """ Return the cumulative size of the best levels of 'bids' or 'asks' as a NumPy array """
+        return self._ladder.cumulative_depth(BID if side == 'bids' else ASK, levels or self._depth)
+
+    def _reset(self) -> None:
+        self._ladder.clear()
+        self._timestamp = 0
+        self._order_book = None
+
+    def set_tick_size(self, tick_size: float) -> None:
+        """ Set the instrument tick size used to key the price levels, the book is cleared until next partial """
+        self._ticks = PriceTicks(tick_size)
+        self._reset()
+        self.version += 1
+
+    def ready(self) -> bool:
+        return self._timestamp > 0
+
+
+# order book implementations selectable by FtxManager(book_type=...)
+BOOK_PROCESSORS = {
+    'dict': OrderBookProcessor,
+    'sorted': SortedOrderBookProcessor,
+    'ladder': LadderOrderBookProcessor,
+}
+
+
+def get_book_delta(data: dict) -> BookDelta:
+    """ Return the level changes of an orderbook message, all levels of a message are applied """
+    levels = [(Side.Buy, price, size) for price, size in data['bids']]
+    levels.extend((Side.Sell, price, size) for price, size in data['asks'])
+    return BookDelta(timestamp=data['time'], snapshot=data['action'] == 'partial', levels=levels)
+
+
+def get_place_order_message(nos: NewOrderSingle, instrument_static: InstrumentDetails, client_id: str,
+                            quantity_ticks: PriceTicks = None) -> dict:
+    """ construct place order request and return a JSON string
+        quantity_ticks is the precomputed size rounding of the instrument, otherwise the size is rounded with Decimal """
 
     order_type = None
     price = None
@@ -666,7 +1435,8 @@ def get_place_order_message(nos: NewOrderSingle, instrument_static: InstrumentDe
             "side": "buy" if nos.side == Side.Buy else "sell",
             "price": price,
             "type": order_type,
-            "size": to_nearest(nos.quantity, instrument_static.quantity_size),
+            "size": (quantity_ticks.to_price(quantity_ticks.to_ticks(nos.quantity)) if quantity_ticks
+                     else to_nearest(nos.quantity, instrument_static.quantity_size)),
             "ioc": ioc,
             "postOnly": nos.post_only,
             "clientId": client_id
@@ -0,0 +1,109 @@
+import time
+from collections import OrderedDict
+from lib.metrics import DurationStats
+
+# number of updates remembered to recognize the copies received over the other connections
+DEFAULT_WINDOW = 10000
+
+
+class FeedArbiter:
+    """
+        Arbitrates the order book updates received over several websocket connections (feeds) carrying the same
+        books, so that each update is applied once, from whichever feed delivers it first.
+
+        An update is identified per symbol by its sequence, the dYdX offset or the FTX time, and a key, by default the
+        sequence (FTX uses (time, checksum) as several updates can share a time). The first copy of an update is
+        accepted, the copies received later over the other feeds are rejected, found in a bounded window of the last
+        updates seen. An update with a sequence lower than the last accepted one is rejected as stale, which also
+        covers the copies that have left the window.
+
+        Each feed subscribes to its own snapshot, only the first one received after a reset is accepted, the updates
+        of the other feeds continue the same stream. When every feed is down, the books are reset and the next
+        snapshot received is accepted.
+
+        The feed that delivers an update first wins it, the lead time is the time until the copy of the next feed.
+    """
+    def __init__(self, feeds: int = 2, window: int = DEFAULT_WINDOW):
+        if feeds < 2:
+            raise ValueError('feeds must be at least 2')
+        self._feeds = feeds
+        self._window = window
+
+        # (symbol, key) -> [winning feed, time.time_ns() of the first copy, copies received]
+        self._seen = OrderedDict()
+
+        # symbol -> sequence of the last accepted update, for the symbols whose snapshot has been applied
+        self._last_sequence = {}
+        self._live_feeds = set()
+
+        self._wins = [0] * feeds
+        self._stale = [0] * feeds
+        self._leads = [DurationStats() for _ in range(feeds)]
+        self.update_count = 0
+        self.duplicate_count = 0
+
+    def accept(self, feed: int, symbol: str, sequence, key=None) -> bool:
+        """ Return True if the update is the first copy received, to be applied to the book """
+        if symbol not in self._last_sequence:
+            # the snapshot is not applied yet
+            return False
+
+        key = (symbol, sequence if key is None else key)
+        entry = self._seen.get(key)
+        if entry is not None:
+            self.duplicate_count += 1
+            winner, first_time, copies = entry
+            self._leads[winner].add(time.time_ns() - first_time)
+            if copies + 1 >= self._feeds:
+                del self._seen[key]
+            else:
+                entry[2] = copies + 1
+            return False
+
+        last_sequence = self._last_sequence[symbol]
+        if last_sequence is not None and sequence < last_sequence:
+            self._stale[feed] += 1
+            return False
+
+        self._last_sequence[symbol] = sequence
+        self._seen[key] = [feed, time.time_ns(), 1]
+        if len(self._seen) > self._window:
+            self._seen.popitem(last=False)
+        self._wins[feed] += 1
+        self.update_count += 1
+        return True
+
+    def accept_snapshot(self, feed: int, symbol: str, sequence=None) -> bool:
+        """ Return True if the snapshot is the first received since the book was reset, to be applied to the book """
+        if symbol in self._last_sequence:
+            return False
+        self._last_sequence[symbol] = sequence
+        return True
+
+    def reset(self, symbol: str = None) -> None:
+        """ Accept the next snapshot of a symbol, or of all symbols """
+        if symbol is None:
+            self._last_sequence.clear()
+            self._seen.clear()
+        else:
+            self._last_sequence.pop(symbol, None)
+
+    def feed_up(self, feed: int) -> None:
+        self._live_feeds.add(feed)
+
+    def feed_down(self, feed: int) -> None:
+        """ A feed has disconnected, the books are reset if it was the last one up """
+        self._live_feeds.discard(feed)
+        if not self._live_feeds:
+            self.reset()
+
+    def get_stats(self) -> dict:
+        """ Per feed, the updates won and their share, the lead time over the next copy and the stale updates """
+        total = sum(self._wins)
+        return {'updates': self.update_count,
+                'duplicates': self.duplicate_count,
+                'feeds': {feed: {'wins': self._wins[feed],
+                                 'win_rate': self._wins[feed] / total if total else 0.0,
+                                 'lead': self._leads[feed].get_stats(),
+                                 'stale': self._stale[feed]}
+                          for feed in range(self._feeds)}}
@@ -0,0 +1,42 @@
+# upper bound of messages applied before the books are published, so that a long backlog still publishes regularly
+DEFAULT_MAX_BATCH = 1000
+
+
+class BookConflator:
+    """
+        Collects the symbols whose visible book levels have changed while a batch of websocket messages is applied,
+        so that each book is rebuilt and published to the depth callback once per batch instead of once per message.
+        Every update is still applied to the order book processors, only the intermediate books are skipped.
+    """
+    def __init__(self, max_batch: int = DEFAULT_MAX_BATCH):
+        self.max_batch = max_batch
+
+        # symbol -> processor, in order of the first change within the batch
+        self._pending = {}
+
+        self.batch_count = 0
+        self.message_count = 0
+        # visible book updates applied, and the ones that have not been published on their own
+        self.update_count = 0
+        self.conflated_count = 0
+
+    def add(self, symbol: str, processor) -> None:
+        """ Record a visible change of the book of a symbol """
+        self.update_count += 1
+        if symbol in self._pending:
+            self.conflated_count += 1
+        else:
+            self._pending[symbol] = processor
+
+    def drain(self) -> [tuple]:
+        """ Return the (symbol, processor) changed since the last drain and start a new batch """
+        pending = list(self._pending.items())
+        self._pending.clear()
+        self.batch_count += 1
+        return pending
+
+    def get_stats(self) -> dict:
+        return {'batches': self.batch_count,
+                'messages': self.message_count,
+                'updates': self.update_count,
+                'conflated': self.conflated_count}
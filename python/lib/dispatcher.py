@@ -0,0 +1,144 @@
+import logging
+import time
+from collections import deque
+from threading import Thread, Condition
+
+
+class DispatchMetrics:
+    """ Counters of a CallbackDispatcher, latencies are measured from submit to the start of the callback """
+    def __init__(self):
+        self.dispatched_books = 0
+        self.dropped_books = 0
+        self.dispatched_events = 0
+        self.max_queue_depth = 0
+        self._latency_sum = 0
+        self._latency_max = 0
+
+    def add_latency(self, latency_ns: int) -> None:
+        self._latency_sum += latency_ns
+        if latency_ns > self._latency_max:
+            self._latency_max = latency_ns
+
+    def get_mean_latency(self) -> float:
+        """ get mean in milliseconds """
+        count = self.dispatched_books + self.dispatched_events
+        return self._latency_sum / count / 1000000 if count else 0
+
+    def get_max_latency(self) -> float:
+        """ get max in milliseconds """
+        return self._latency_max / 1000000
+
+
+class CallbackDispatcher:
+    """
+        Runs the depth and execution callbacks of one or more gateways on a consumer thread, so that slow strategy
+        code does not stall the websocket event loop.
+
+        Books are handed over through a "latest only" slot per (callback, symbol): a book submitted before the
+        previous one has been consumed replaces it and is counted as dropped. Execution events go through an ordered
+        queue, they are never dropped and are dispatched before the pending books. With conflate_books=False the books
+        go through the ordered queue as well and every book is delivered.
+
+        Books given to the dispatcher are read from another thread, so they must not be OrderBookView.
+    """
+    def __init__(self, name='dispatcher', conflate_books: bool = True):
+        self._condition = Condition()
+        self._conflate_books = conflate_books
+
+        # (callback, symbol) -> (book, submit time), in order of first submit
+        self._books = {}
+        # (callback, args, is_book, submit time)
+        self._events = deque()
+
+        self._running = False
+        self._thread = Thread(target=self._run, daemon=True, name=name)
+
+        self.metrics = DispatchMetrics()
+
+    def start(self) -> None:
+        """ Start the consumer thread, a started dispatcher can be shared by several gateways """
+        with self._condition:
+            if self._running:
+                return
+            self._running = True
+        self._thread.start()
+
+    def stop(self) -> None:
+        """ Stop the consumer thread once the pending callbacks have been dispatched """
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def submit_book(self, callback, symbol: str, book) -> None:
+        """ Hand over the latest book of a symbol, replacing the book not consumed yet """
+        with self._condition:
+            if not self._conflate_books:
+                self._events.append((callback, (symbol, book), True, time.time_ns()))
+                self._update_queue_depth()
+                self._condition.notify()
+                return
+
+            key = (callback, symbol)
+            if key in self._books:
+                self.metrics.dropped_books += 1
+            self._books[key] = (book, time.time_ns())
+            self._update_queue_depth()
+            self._condition.notify()
+
+    def submit_event(self, callback, event) -> None:
+        """ Queue an execution event, events are dispatched in order and never dropped """
+        with self._condition:
+            self._events.append((callback, (event,), False, time.time_ns()))
+            self._update_queue_depth()
+            self._condition.notify()
+
+    def queue_depth(self) -> int:
+        """ Number of events and books waiting to be dispatched """
+        with self._condition:
+            return len(self._events) + len(self._books)
+
+    def _update_queue_depth(self) -> None:
+        depth = len(self._events) + len(self._books)
+        if depth > self.metrics.max_queue_depth:
+            self.metrics.max_queue_depth = depth
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while self._running and not self._events and not self._books:
+                    self._condition.wait()
+
+                if not self._events and not self._books:
+                    # stopped and nothing left to dispatch
+                    return
+
+                events = self._events
+                self._events = deque()
+                books = self._books
+                self._books = {}
+
+            self._dispatch(events, books)
+
+    def _dispatch(self, events: deque, books: dict) -> None:
+        metrics = self.metrics
+
+        for callback, args, is_book, submit_time in events:
+            metrics.add_latency(time.time_ns() - submit_time)
+            if is_book:
+                metrics.dispatched_books += 1
+            else:
+                metrics.dispatched_events += 1
+            try:
+                callback(*args)
+            except Exception as e:
+                logging.error('callback failed: %s' % e)
+
+        for (callback, symbol), (book, submit_time) in books.items():
+            metrics.add_latency(time.time_ns() - submit_time)
+            metrics.dispatched_books += 1
+            try:
+                callback(symbol, book)
+            except Exception as e:
+                logging.error('depth callback failed: %s' % e)
@@ -9,6 +9,9 @@ class OrderStatus(Enum):
 
 
 class OrderEvent:
+    __slots__ = ('contract_name', 'order_id', 'client_id', 'status', 'canceled_reason',
+                 'fill_time', 'fill_price', 'fill_quantity', 'side', 'fill_id', 'fill_type', 'filled_quantity')
+
     def __init__(self, contract_name: str, order_id: str, status: OrderStatus, canceled_reason=None, client_id=None):
         self.contract_name = contract_name
         self.order_id = order_id
@@ -24,6 +27,9 @@ class OrderEvent:
         self.fill_id = None
         self.fill_type = None
 
+        # cumulative filled quantity of the order, set by the order channels when reported
+        self.filled_quantity = None
+
     def __str__(self):
         return "Order events [contract={}, order_id={}, status={}, canceled_reason={}]".format(self.contract_name, self.order_id, self.status, self.canceled_reason)
 
@@ -0,0 +1,208 @@
+import logging
+import socket
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests import Response, PreparedRequest
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+# keep-alive connections kept open to the host
+DEFAULT_POOL_SIZE = 4
+
+# seconds
+DEFAULT_CONNECT_TIMEOUT = 3.0
+DEFAULT_READ_TIMEOUT = 10.0
+
+# number of request timings kept
+TIMINGS_KEPT = 1000
+
+# timing of the request being sent by the current thread, filled in by the connection when a new one is opened
+_current = threading.local()
+
+
+class RequestTiming:
+    """
+        Latency breakdown of a request in milliseconds. dns, connect and tls are 0 when a pooled connection is
+        reused. first_byte is the time from the request being sent on the connection to the response headers, and
+        total the time from the call to the response headers.
+    """
+    __slots__ = ('method', 'url', 'status', 'new_connection', 'dns', 'connect', 'tls', 'first_byte', 'total')
+
+    def __init__(self, method: str, url: str):
+        self.method = method
+        self.url = url
+        self.status = None
+        self.new_connection = False
+        self.dns = 0
+        self.connect = 0
+        self.tls = 0
+        self.first_byte = 0
+        self.total = 0
+
+    def __str__(self):
+        return '{} {} status={} new_connection={} dns={:.2f} connect={:.2f} tls={:.2f} first_byte={:.2f} total={:.2f}'\
+            .format(self.method, self.url, self.status, self.new_connection, self.dns, self.connect, self.tls,
+                    self.first_byte, self.total)
+
+
+class _TimedConnection:
+    """ Times the name resolution and the TCP connect of a new connection """
+    def _new_conn(self):
+        timing = getattr(_current, 'timing', None)
+        if timing is None:
+            return super()._new_conn()
+
+        start = time.perf_counter()
+        dns_host = self._dns_host
+        try:
+            address = socket.getaddrinfo(dns_host, self.port, 0, socket.SOCK_STREAM)[0][4][0]
+        except OSError:
+            # let the connection report the resolution error
+            address = dns_host
+        resolved = time.perf_counter()
+
+        # connect to the resolved address, the host name is still used for TLS
+        self._dns_host = address
+        try:
+            sock = super()._new_conn()
+        finally:
+            self._dns_host = dns_host
+
+        timing.new_connection = True
+        timing.dns = (resolved - start) * 1000
+        timing.connect = (time.perf_counter() - resolved) * 1000
+        return sock
+
+
+class TimedHTTPConnection(_TimedConnection, HTTPConnection):
+    pass
+
+
+class TimedHTTPSConnection(_TimedConnection, HTTPSConnection):
+    def connect(self):
+        start = time.perf_counter()
+        super().connect()
+
+        timing = getattr(_current, 'timing', None)
+        if timing is not None:
+            timing.tls = (time.perf_counter() - start) * 1000 - timing.dns - timing.connect
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """
+        An HTTPAdapter that times every request it sends and applies default timeouts. It can be mounted on any
+        requests.Session, e.g. the session of a third-party client, to pool and time its requests.
+    """
+    def __init__(self, pool_size: int = DEFAULT_POOL_SIZE, timeout: tuple = (DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT)):
+        self._default_timeout = timeout
+
+        # latest request timings, oldest first
+        self.timings = deque(maxlen=TIMINGS_KEPT)
+
+        super().__init__(pool_connections=1, pool_maxsize=pool_size)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {'http': TimedHTTPConnectionPool, 'https': TimedHTTPSConnectionPool}
+
+    def send(self, request: PreparedRequest, timeout=None, **kwargs) -> Response:
+        timing = RequestTiming(request.method, request.url)
+        _current.timing = timing
+        start = time.perf_counter()
+        try:
+            # returns once the response headers are read, the body is read by the session
+            response = super().send(request, timeout=timeout or self._default_timeout, **kwargs)
+        finally:
+            _current.timing = None
+
+        timing.total = (time.perf_counter() - start) * 1000
+        timing.status = response.status_code
+        timing.first_byte = timing.total - timing.dns - timing.connect - timing.tls
+        self.timings.append(timing)
+        logging.debug('REST - %s', timing)
+        return response
+
+
+class HttpClient:
+    """
+        A gateway-owned pool of keep-alive HTTP connections to one REST host, shared by all the REST calls of the
+        gateway so that only the first request on a connection pays the TCP and TLS handshakes. Connections can be
+        opened ahead of the first order with prewarm(). Every request is timed, see RequestTiming.
+
+        Requests can be sent from several threads: each thread has its own requests.Session, and all the sessions
+        share the thread-safe connection pool of one adapter.
+    """
+    def __init__(self, base_url: str, pool_size: int = DEFAULT_POOL_SIZE,
+                 connect_timeout: float = DEFAULT_CONNECT_TIMEOUT, read_timeout: float = DEFAULT_READ_TIMEOUT,
+                 headers: dict = None):
+        self.base_url = base_url
+        self.pool_size = pool_size
+        # default headers of every request
+        self.headers = headers or {}
+        self._adapter = TimedHTTPAdapter(pool_size, timeout=(connect_timeout, read_timeout))
+        self._sessions = threading.local()
+
+    @property
+    def timings(self) -> deque:
+        """ Latest request timings, oldest first """
+        return self._adapter.timings
+
+    def mount(self, session: requests.Session) -> None:
+        """ Send the requests of another session to the base url through this pool, e.g. a third-party client """
+        session.mount(self.base_url, self._adapter)
+
+    def get(self, path: str, **kwargs) -> Response:
+        return self._session().get(self.base_url + path, **kwargs)
+
+    def send(self, prepared: PreparedRequest) -> Response:
+        return self._session().send(prepared)
+
+    def request(self, method: str, url: str, **kwargs) -> Response:
+        """ Send a request to a full url, e.g. on behalf of a third-party client """
+        return self._session().request(method, url, **kwargs)
+
+    def prewarm(self, connections: int = None) -> None:
+        """ Open keep-alive connections to the host, up to the pool size """
+        connections = connections or self.pool_size
+        with ThreadPoolExecutor(max_workers=connections) as executor:
+            # concurrent requests, so that each one opens its own connection
+            list(executor.map(lambda _: self._warm(), range(connections)))
+
+    def close(self) -> None:
+        self._adapter.close()
+
+    def _warm(self) -> None:
+        try:
+            self._session().head(self.base_url)
+        except requests.RequestException as e:
+            logging.warning('REST - unable to pre-warm connection: %s' % e)
+
+    def _session(self) -> requests.Session:
+        session = getattr(self._sessions, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.mount('https://', self._adapter)
+            session.mount('http://', self._adapter)
+            session.headers.update(self.headers)
+
+            # the proxies and CA bundle of the environment are resolved once, instead of scanning os.environ on every
+            # request. Requests sent with send() and get() then also share the same connection pool
+            settings = session.merge_environment_settings(self.base_url, {}, None, None, None)
+            session.proxies = settings['proxies']
+            session.verify = settings['verify']
+            session.cert = settings['cert']
+            session.trust_env = False
+            self._sessions.session = session
+        return session
@@ -1,4 +1,5 @@
 from datetime import datetime
+import itertools
 import uuid
 
 
@@ -7,14 +8,14 @@ class OrderIdGenerator:
         random_id = uuid.uuid4()
         date_str = datetime.now().strftime("%Y%m%d")
         self._prefix = prefix + "-" + date_str + "-" + str(random_id)[0:8] + "-"
-        self._counter = 0
+        # next() on a count is atomic, so ids can be generated from several order entry threads
+        self._counter = itertools.count(1)
 
     def get_prefix(self) -> str:
         return self._prefix
 
     def next(self) -> str:
-        self._counter += 1
-        return self._prefix + str(self._counter)
+        return self._prefix + str(next(self._counter))
 
     def match(self, client_id: str) -> bool:
         return client_id.startswith(self._prefix)
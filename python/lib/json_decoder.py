@@ -0,0 +1,36 @@
+import json
+
+# faster decoders are used only if installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+# decoders by name, in order of preference for 'auto'. All of them take str or bytes
+JSON_DECODERS = {}
+if orjson is not None:
+    JSON_DECODERS['orjson'] = orjson.loads
+if ujson is not None:
+    JSON_DECODERS['ujson'] = ujson.loads
+JSON_DECODERS['json'] = json.loads
+
+
+def get_json_decoder(decoder='json'):
+    """ Return the function decoding websocket messages: a decoder name, 'auto' for the fastest installed decoder,
+        or a callable taking a str or bytes JSON document """
+    if callable(decoder):
+        return decoder
+
+    if decoder == 'auto':
+        return next(iter(JSON_DECODERS.values()))
+
+    if decoder not in JSON_DECODERS:
+        raise ValueError('json decoder must be one of {} or auto, installed: {}'.format(
+            ['json', 'orjson', 'ujson'], list(JSON_DECODERS)))
+    return JSON_DECODERS[decoder]
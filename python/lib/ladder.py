@@ -0,0 +1,381 @@
+import numpy as np
+from array import array
+from lib.orderbook import SortedBookSide
+
+# side index in the ladder arrays
+BID = 0
+ASK = 1
+
+# number of ticks covered by the dense window
+DEFAULT_CAPACITY = 4096
+
+# number of ticks scanned one by one from the best level before switching to a vectorized scan of the rest
+SCAN_LIMIT = 64
+
+# no level on the side
+_NO_OFFSET = -1
+
+
+class PriceLadder:
+    """
+        A dense price ladder for both sides of an order book, stored in preallocated arrays indexed by
+        (ticks - base). The window is centred on the mid and recentred when a best price gets close to an edge. A
+        spread wider than the window keeps the window on one side, the other side is then read from the overflow.
+
+        A level update is a plain write to a Python array, the best level and the visibility boundary are maintained
+        by scanning the few ticks next to the best level, so the update path makes no NumPy call. The arrays are
+        shared with NumPy views, used where a scan goes deep into the book (sparse books, all levels, recentring).
+
+        Levels outside of the window (e.g. far away orders) are kept in an overflow map so the book stays exact.
+        With offsets enabled (dYdX), an offset is stored per level. When the size goes to zero only the offset is
+        kept, as a tombstone, until it is evicted by evict_tombstones().
+    """
+    def __init__(self, capacity: int = DEFAULT_CAPACITY, with_offsets: bool = False):
+        self._capacity = capacity
+        self._margin = max(1, capacity // 8)
+        self._with_offsets = with_offsets
+
+        # sizes and offsets per side, and NumPy views on the same memory
+        self._sizes = (array('d', bytes(8 * capacity)), array('d', bytes(8 * capacity)))
+        self._size_views = tuple(np.frombuffer(sizes, dtype=np.float64) for sizes in self._sizes)
+        self._offsets = None
+        self._offset_views = None
+        if with_offsets:
+            self._offsets = (array('q', [_NO_OFFSET]) * capacity, array('q', [_NO_OFFSET]) * capacity)
+            self._offset_views = tuple(np.frombuffer(offsets, dtype=np.int64) for offsets in self._offsets)
+
+        # non-empty levels outside of the window: ticks -> (size, offset), plus a sorted index
+        self._overflow = ({}, {})
+        self._overflow_index = (SortedBookSide(descending=True), SortedBookSide(descending=False))
+
+        # offset of the empty levels, inside or outside of the window: ticks -> offset in order of insertion (i.e. of
+        # offset). The offsets array only holds the offset of the non-empty levels
+        self._tombstones = ({}, {})
+        self.evicted_count = 0
+
+        # ticks at index 0, set by the first update
+        self._base = None
+
+        # array index of the best bid and best ask, -1 and capacity when the side is empty
+        self._best = [-1, capacity]
+
+        # cached (n, ticks of the n-th best level or None if fewer than n levels) per side
+        self._boundary = [None, None]
+
+        self.recenter_count = 0
+
+    def set(self, side: int, ticks: int, size: float, offset: int = _NO_OFFSET) -> None:
+        """ Set the size (0 to remove) and optionally the offset of a level """
+        base = self._base
+        if base is None:
+            base = self._base = ticks - self._capacity // 2
+
+        # an update at or better than the cached boundary changes the boundary
+        cached = self._boundary[side]
+        if cached is not None:
+            boundary = cached[1]
+            if boundary is None or (ticks >= boundary if side == BID else ticks <= boundary):
+                self._boundary[side] = None
+
+        idx = ticks - base
+        if not 0 <= idx < self._capacity:
+            if size and self._is_better(side, ticks) and self._follows(side, ticks):
+                # the market has moved out of the window
+                self._recenter(ticks)
+                idx = ticks - self._base
+            else:
+                self._set_overflow(side, ticks, size, offset)
+                return
+
+        self._sizes[side][idx] = size
+        if self._with_offsets and offset != _NO_OFFSET:
+            self._offsets[side][idx] = offset
+            self._set_tombstone(side, ticks, size, offset)
+
+        # maintain the best level index, recentre if it gets close to an edge
+        best = self._best[side]
+        if size:
+            if (idx > best) if side == BID else (idx < best):
+                self._best[side] = idx
+                self._check_edges()
+        elif idx == best:
+            found = self._scan(side, 1)
+            self._best[side] = found[0] if found else (-1 if side == BID else self._capacity)
+            self._check_edges()
+
+    def center(self, ticks: int) -> None:
+        """ Centre the window of an empty ladder on the given ticks, e.g. the mid of a snapshot before it is loaded """
+        if ticks is not None:
+            self._base = ticks - self._capacity // 2
+
+    def size(self, side: int, ticks: int) -> float:
+        """ Return the size of a level, 0 if the level is empty """
+        if self._base is None:
+            return 0.0
+
+        idx = ticks - self._base
+        if 0 <= idx < self._capacity:
+            return self._sizes[side][idx]
+        level = self._overflow[side].get(ticks)
+        return level[0] if level is not None else 0.0
+
+    def get_offset(self, side: int, ticks: int):
+        """ Return the offset of a level or None if the level has never been set """
+        if self._base is None:
+            return None
+
+        idx = ticks - self._base
+        if 0 <= idx < self._capacity:
+            if self._sizes[side][idx]:
+                return self._offsets[side][idx]
+        else:
+            level = self._overflow[side].get(ticks)
+            if level is not None:
+                return level[1]
+        return self._tombstones[side].get(ticks)
+
+    def evict_tombstones(self, min_offset: int) -> int:
+        """ Drop the offset of the empty levels lower than min_offset, oldest first. Return the number evicted """
+        evicted = 0
+        for tombstones in self._tombstones:
+            while tombstones:
+                ticks = next(iter(tombstones))
+                if tombstones[ticks] >= min_offset:
+                    break
+                del tombstones[ticks]
+                evicted += 1
+        self.evicted_count += evicted
+        return evicted
+
+    def best(self, side: int):
+        """ Return the ticks of the best level, or None if the side is empty """
+        best = self._best[side]
+        in_window = best >= 0 if side == BID else best < self._capacity
+        array_best = self._base + best if in_window else None
+        overflow_best = self._overflow_index[side].best()
+
+        if overflow_best is None:
+            return array_best
+        if array_best is None:
+            return overflow_best
+        return max(array_best, overflow_best) if side == BID else min(array_best, overflow_best)
+
+    def top(self, side: int, n: int = None) -> ([int], [float], [int]):
+        """ Return the best n levels (all levels if n is None) as lists of (ticks, sizes, offsets), best first.
+            Offsets is None if the ladder has no offsets """
+        if self._base is None:
+            return [], [], [] if self._with_offsets else None
+
+        idx = self._scan(side, n)
+        base = self._base
+        sizes = self._sizes[side]
+        level_ticks = [i + base for i in idx]
+        level_sizes = [sizes[i] for i in idx]
+        level_offsets = None
+        if self._with_offsets:
+            offsets = self._offsets[side]
+            level_offsets = [offsets[i] for i in idx]
+
+        overflow_index = self._overflow_index[side]
+        if not len(overflow_index):
+            return level_ticks, level_sizes, level_offsets
+
+        # merge with the overflow levels, which are few
+        overflow = self._overflow[side]
+        levels = list(zip(level_ticks, level_sizes, level_offsets or [_NO_OFFSET] * len(idx)))
+        levels.extend((t, overflow[t][0], overflow[t][1]) for t in overflow_index.prices(n))
+        levels.sort(reverse=(side == BID))
+        levels = levels[:n]
+        level_offsets = [o for (_, _, o) in levels] if self._with_offsets else None
+        return [t for (t, _, _) in levels], [s for (_, s, _) in levels], level_offsets
+
+    def cumulative_depth(self, side: int, n: int = None) -> np.ndarray:
+        """ Return the cumulative size of the best n levels, best first """
+        if len(self._overflow_index[side]):
+            return np.cumsum(self.top(side, n)[1])
+
+        # vectorized over the window, from the best level outwards
+        best = self._best[side]
+        view = self._size_views[side]
+        if side == BID:
+            sizes = view[best::-1] if best >= 0 else view[:0]
+        else:
+            sizes = view[best:]
+        return np.cumsum(sizes[sizes != 0][:n])
+
+    def within(self, side: int, ticks: int, n: int) -> bool:
+        """ Return True if the price is at or better than the n-th best price, i.e. a change at this price would be
+            visible in the top n levels """
+        cached = self._boundary[side]
+        if cached is None or cached[0] != n:
+            top_ticks = self.top(side, n)[0]
+            cached = (n, top_ticks[-1] if len(top_ticks) >= n else None)
+            self._boundary[side] = cached
+
+        boundary = cached[1]
+        if boundary is None:
+            return True
+        return ticks >= boundary if side == BID else ticks <= boundary
+
+    def level_counts(self) -> (int, int):
+        """ Return the number of non-empty levels and the number of empty levels that only hold an offset """
+        levels = sum(int(np.count_nonzero(view)) for view in self._size_views)
+        levels += sum(len(index) for index in self._overflow_index)
+        return levels, sum(len(tombstones) for tombstones in self._tombstones)
+
+    def clear(self) -> None:
+        for side in (BID, ASK):
+            self._size_views[side].fill(0)
+            if self._with_offsets:
+                self._offset_views[side].fill(_NO_OFFSET)
+            self._overflow[side].clear()
+            self._overflow_index[side].clear()
+            self._tombstones[side].clear()
+        self._base = None
+        self._best = [-1, self._capacity]
+        self._boundary = [None, None]
+
+    def _scan(self, side: int, n: int = None) -> [int]:
+        """ Array indexes of the best n non-empty levels in the window (all if n is None), best first. The first
+            SCAN_LIMIT ticks from the best level are checked one by one, the rest of the side is scanned by NumPy """
+        sizes = self._sizes[side]
+        found = []
+        if side == BID:
+            i = self._best[BID]
+            stop = max(-1, i - SCAN_LIMIT)
+            while i > stop:
+                if sizes[i]:
+                    found.append(i)
+                    if len(found) == n:
+                        return found
+                i -= 1
+            if i >= 0:
+                rest = np.flatnonzero(self._size_views[BID][:i + 1])[::-1]
+                found.extend(rest[:None if n is None else n - len(found)].tolist())
+        else:
+            capacity = self._capacity
+            i = self._best[ASK]
+            stop = min(capacity, i + SCAN_LIMIT)
+            while i < stop:
+                if sizes[i]:
+                    found.append(i)
+                    if len(found) == n:
+                        return found
+                i += 1
+            if i < capacity:
+                rest = np.flatnonzero(self._size_views[ASK][i:]) + i
+                found.extend(rest[:None if n is None else n - len(found)].tolist())
+        return found
+
+    def _set_overflow(self, side: int, ticks: int, size: float, offset: int) -> None:
+        overflow = self._overflow[side]
+        if size:
+            overflow[ticks] = (size, offset)
+            self._overflow_index[side].set(ticks, size)
+        else:
+            overflow.pop(ticks, None)
+            self._overflow_index[side].remove(ticks)
+
+        if self._with_offsets and offset != _NO_OFFSET:
+            self._set_tombstone(side, ticks, size, offset)
+
+    def _set_tombstone(self, side: int, ticks: int, size: float, offset: int) -> None:
+        """ Keep the offset of an empty level, re-inserted to keep the tombstones in order of offset """
+        tombstones = self._tombstones[side]
+        tombstones.pop(ticks, None)
+        if not size:
+            tombstones[ticks] = offset
+
+    def _is_better(self, side: int, ticks: int) -> bool:
+        best = self.best(side)
+        if best is None:
+            return True
+        return ticks > best if side == BID else ticks < best
+
+    def _fits(self, bid: int, ask: int) -> bool:
+        """ Return True if both best prices are within the margins of a window centred on their mid """
+        base = (bid + ask) // 2 - self._capacity // 2
+        return self._margin <= bid - base and ask - base < self._capacity - self._margin
+
+    def _follows(self, side: int, ticks: int) -> bool:
+        """ Return True if the window is to be moved to a new best price out of it. With a spread too wide for the
+            window, the window stays on the best price of the other side and this side is served from the overflow """
+        other = ASK if side == BID else BID
+        other_best = self._best[other]
+        if not (0 <= other_best < self._capacity):
+            return True
+        other_ticks = self._base + other_best
+        return self._fits(ticks, other_ticks) if side == BID else self._fits(other_ticks, ticks)
+
+    def _check_edges(self) -> None:
+        """ Recentre on the mid if a best price is getting close to an edge of the window. A spread too wide for
+            both best prices to be within the margins is left as is, the levels beyond the edges are kept in the
+            overflow, see _follows(), rather than recentring on every move of the mid """
+        bid, ask = self._best
+        capacity = self._capacity
+        margin = self._margin
+        has_bid = bid >= 0
+        has_ask = ask < capacity
+
+        if (has_bid and not margin <= bid < capacity - margin) or (has_ask and not margin <= ask < capacity - margin):
+            if has_bid and has_ask:
+                if not self._fits(self._base + bid, self._base + ask):
+                    return
+                center = self._base + (bid + ask) // 2
+            else:
+                center = self._base + (bid if has_bid else ask)
+            self._recenter(center)
+
+    def _recenter(self, center: int) -> None:
+        """ Move the window to be centred on the given ticks. Only the non-empty levels that leave the window or
+            enter it are moved between the window and the overflow, the tombstones are not tied to the window """
+        capacity = self._capacity
+        old_base = self._base
+        new_base = center - capacity // 2
+        if new_base == old_base:
+            return
+
+        shift = new_base - old_base
+        start, end = max(0, shift), min(capacity, capacity + shift)
+        for side in (BID, ASK):
+            size_view = self._size_views[side]
+            offset_view = self._offset_views[side] if self._with_offsets else None
+            overflow = self._overflow[side]
+            overflow_index = self._overflow_index[side]
+
+            # levels leaving the window
+            idx = np.flatnonzero(size_view)
+            for i in idx[(idx < shift) | (idx >= capacity + shift)].tolist():
+                offset = int(offset_view[i]) if self._with_offsets else _NO_OFFSET
+                overflow[old_base + i] = (float(size_view[i]), offset)
+                overflow_index.set(old_base + i, float(size_view[i]))
+
+            # levels staying in the window, at their new index
+            sizes = np.zeros(capacity)
+            offsets = np.full(capacity, _NO_OFFSET, dtype=np.int64) if self._with_offsets else None
+            if start < end:
+                sizes[start - shift:end - shift] = size_view[start:end]
+                if self._with_offsets:
+                    offsets[start - shift:end - shift] = offset_view[start:end]
+
+            # overflow levels entering the window
+            for ticks in [t for t in overflow if 0 <= t - new_base < capacity]:
+                size, offset = overflow.pop(ticks)
+                overflow_index.remove(ticks)
+                sizes[ticks - new_base] = size
+                if self._with_offsets:
+                    offsets[ticks - new_base] = offset
+
+            size_view[:] = sizes
+            if self._with_offsets:
+                offset_view[:] = offsets
+
+            in_window = np.flatnonzero(sizes)
+            if len(in_window):
+                self._best[side] = int(in_window[-1]) if side == BID else int(in_window[0])
+            else:
+                self._best[side] = -1 if side == BID else capacity
+
+        self._base = new_base
+        self._boundary = [None, None]
+        self.recenter_count += 1
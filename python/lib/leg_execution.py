@@ -0,0 +1,287 @@
+import logging
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from enum import Enum
+from threading import Lock
+from lib.events import OrderEvent, OrderStatus
+from lib.interface import NewOrderSingle, OrderType, Side
+from lib.math_utils import to_nearest
+from lib.metrics import DurationStats
+
+# upper bound of execution events kept for client ids not known yet, the order entry response can come after the
+# websocket events of the order
+DEFAULT_MAX_EARLY_EVENTS = 1000
+
+# price concession of the orders unwinding a filled leg, as a fraction of the leg price
+DEFAULT_UNWIND_SLIPPAGE = 0.002
+
+
+class LegState(Enum):
+    SENDING = 0
+    SENT = 1
+    ACKED = 2
+    FILLED = 3
+    CANCELED = 4
+    REJECTED = 5
+    PARTIALLY_FILLED = 6    # done with only part of the quantity filled
+
+
+# states after which no event is expected for the leg
+TERMINAL_STATES = (LegState.FILLED, LegState.CANCELED, LegState.REJECTED, LegState.PARTIALLY_FILLED)
+
+# states of the legs that have failed to fill their whole quantity
+FAILED_STATES = (LegState.CANCELED, LegState.REJECTED, LegState.PARTIALLY_FILLED)
+
+
+class HedgeAction(Enum):
+    NONE = 0        # log the failed leg only
+    UNWIND = 1      # send IOC orders offsetting the filled legs
+
+
+class Leg:
+    """ One order of a multi-leg execution, on the gateway it is sent to """
+    __slots__ = ('gateway', 'order', 'client_id', 'state', 'filled_quantity', 'sent_time', 'ack_time', 'done_time',
+                 'error')
+
+    def __init__(self, gateway, order: NewOrderSingle):
+        self.gateway = gateway
+        self.order = order
+        self.client_id = None
+        self.state = LegState.SENDING
+
+        # cumulative filled quantity, from the execution events
+        self.filled_quantity = 0.0
+
+        # time.time_ns() of the order entry response, of the first execution event and of the terminal event
+        self.sent_time = None
+        self.ack_time = None
+        self.done_time = None
+        self.error = None
+
+    def is_done(self) -> bool:
+        return self.state in TERMINAL_STATES
+
+    def __str__(self):
+        return 'Leg [{}, client_id={}, state={}, filled={}]'.format(self.order, self.client_id, self.state,
+                                                                   self.filled_quantity)
+
+
+class LegGroup:
+    """ The legs of one execution, fired together """
+    def __init__(self, legs: [Leg]):
+        self.legs = legs
+        self.start_time = time.time_ns()
+        self.hedged = False
+
+        # orders sent by the hedge action, (gateway, NewOrderSingle, Future of the client id)
+        self.hedge_orders = []
+
+        # set once the group is done and its hedge action, if any, has been taken
+        self.settled = False
+
+    def is_done(self) -> bool:
+        return all(leg.is_done() for leg in self.legs)
+
+    def is_filled(self) -> bool:
+        return all(leg.state is LegState.FILLED for leg in self.legs)
+
+    def failed_legs(self) -> [Leg]:
+        return [leg for leg in self.legs if leg.state in FAILED_STATES]
+
+    def is_settled(self) -> bool:
+        """ Return True once the group is done and the order entry of its hedge orders has completed """
+        return self.settled and all(future.done() for _, _, future in self.hedge_orders)
+
+
+class LegExecutor:
+    """
+        Fires the legs of an execution, e.g. the two sides of an arbitrage on different venues, at the same time: each
+        leg is submitted to the order entry pool of its gateway (see submit_order()), so that no leg waits for the
+        round trip of another.
+
+        The state of the legs is then tracked from the execution callbacks of the gateways, which must be forwarded to
+        on_execution(). Events are matched to the legs by client id.
+
+        Leg skew is the time between the first and the last leg acknowledgements, i.e. the first execution event of
+        each leg, and between the first and the last leg fills.
+
+        The filled quantity of a leg is taken from the execution events. A leg done with only part of its quantity
+        filled, e.g. an IOC closed as matched by FTX or canceled by dYdX after a partial fill, is PARTIALLY_FILLED.
+
+        Once every leg of a group is done and some failed to fill their whole quantity while others filled, the group
+        is hedged by the hedge action: HedgeAction.UNWIND sends IOC orders offsetting the filled quantity of every
+        leg, a callable is called with the LegGroup instead. The legs are expected to be IOC, a resting leg keeps its
+        group open.
+    """
+    def __init__(self, hedge_action=HedgeAction.UNWIND, unwind_slippage: float = DEFAULT_UNWIND_SLIPPAGE,
+                 max_early_events: int = DEFAULT_MAX_EARLY_EVENTS):
+        self.hedge_action = hedge_action
+        self.unwind_slippage = unwind_slippage
+
+        # execution callbacks and order entry responses come from several gateway threads
+        self._lock = Lock()
+        self._legs = {}
+        self._groups = []
+
+        self._max_early_events = max_early_events
+        self._early_events = OrderedDict()
+
+        self.ack_skew = DurationStats()
+        self.fill_skew = DurationStats()
+        self.group_count = 0
+        self.filled_count = 0
+        self.failed_count = 0
+        self.hedge_count = 0
+
+    def execute(self, legs: [tuple]) -> LegGroup:
+        """ Fire (gateway, NewOrderSingle) legs concurrently, return the LegGroup tracking them """
+        group = LegGroup([Leg(gateway, order) for gateway, order in legs])
+        with self._lock:
+            self._groups.append(group)
+            self.group_count += 1
+
+        for leg in group.legs:
+            future = leg.gateway.submit_order(leg.order)
+            future.add_done_callback(lambda f, leg=leg: self._on_sent(group, leg, f))
+        return group
+
+    def active_groups(self) -> [LegGroup]:
+        with self._lock:
+            return list(self._groups)
+
+    def on_execution(self, order_event: OrderEvent) -> None:
+        """ To be called from the execution callbacks of the gateways of the legs """
+        now = time.time_ns()
+        with self._lock:
+            entry = self._legs.get(order_event.client_id)
+            if entry is None:
+                if order_event.client_id:
+                    self._early_events.setdefault(order_event.client_id, []).append((now, order_event))
+                    while len(self._early_events) > self._max_early_events:
+                        self._early_events.popitem(last=False)
+                return
+            group, leg = entry
+            done = self._apply(group, leg, order_event, now)
+        if done:
+            self._on_group_done(done)
+
+    def _on_sent(self, group: LegGroup, leg: Leg, future: Future) -> None:
+        """ Order entry response of a leg, on the order worker thread of its gateway """
+        error = future.exception()
+        client_id = None if error else future.result()
+        with self._lock:
+            leg.sent_time = time.time_ns()
+            done = None
+            if client_id:
+                leg.client_id = client_id
+                leg.state = LegState.SENT
+                self._legs[client_id] = (group, leg)
+                for event_time, order_event in self._early_events.pop(client_id, []):
+                    done = self._apply(group, leg, order_event, event_time) or done
+            else:
+                leg.error = error or 'order rejected'
+                logging.error('leg rejected: %s, %s', leg, leg.error)
+                leg.state = LegState.REJECTED
+                leg.done_time = leg.sent_time
+                done = self._check_done(group)
+        if done:
+            self._on_group_done(done)
+
+    def _apply(self, group: LegGroup, leg: Leg, order_event: OrderEvent, now: int):
+        """ Update the state of a leg from an event received at now, return its group if the event completes it """
+        if leg.is_done():
+            return None
+
+        acked = leg.ack_time is None
+        if acked:
+            leg.ack_time = now
+
+        if order_event.filled_quantity is not None:
+            leg.filled_quantity = max(leg.filled_quantity, order_event.filled_quantity)
+        elif order_event.status is OrderStatus.MATCHED:
+            # no quantity reported, the order is matched in full
+            leg.filled_quantity = leg.order.quantity
+
+        if order_event.status is OrderStatus.OPEN:
+            leg.state = LegState.ACKED
+        elif order_event.status in (OrderStatus.MATCHED, OrderStatus.CANCELED):
+            if leg.filled_quantity >= leg.order.quantity:
+                leg.state = LegState.FILLED
+            elif leg.filled_quantity > 0:
+                leg.state = LegState.PARTIALLY_FILLED
+            else:
+                leg.state = LegState.CANCELED
+            leg.done_time = now
+
+        if acked and all(other.ack_time for other in group.legs):
+            ack_times = [other.ack_time for other in group.legs]
+            self.ack_skew.add(max(ack_times) - min(ack_times))
+        return self._check_done(group)
+
+    def _check_done(self, group: LegGroup):
+        """ Retire a completed group, return it if it is done """
+        if not group.is_done() or group not in self._groups:
+            return None
+        self._groups.remove(group)
+        for leg in group.legs:
+            self._legs.pop(leg.client_id, None)
+
+        if group.is_filled():
+            self.filled_count += 1
+            fill_times = [leg.done_time for leg in group.legs]
+            self.fill_skew.add(max(fill_times) - min(fill_times))
+        elif group.failed_legs():
+            self.failed_count += 1
+        return group
+
+    def _on_group_done(self, group: LegGroup) -> None:
+        """ Hedge a group with failed legs, outside of the lock as the hedge action sends orders """
+        try:
+            self._hedge(group)
+        finally:
+            group.settled = True
+
+    def _hedge(self, group: LegGroup) -> None:
+        failed = group.failed_legs()
+        if not failed:
+            return
+
+        logging.warning('legs failed: %s', ', '.join(str(leg) for leg in failed))
+        filled = [leg for leg in group.legs if leg.filled_quantity > 0]
+        if not filled or self.hedge_action is HedgeAction.NONE:
+            return
+
+        group.hedged = True
+        with self._lock:
+            self.hedge_count += 1
+        if callable(self.hedge_action):
+            self.hedge_action(group)
+            return
+
+        for leg in filled:
+            order = self.unwind_order(leg)
+            logging.info('unwinding leg: %s', order)
+            group.hedge_orders.append((leg.gateway, order, leg.gateway.submit_order(order)))
+
+    def unwind_order(self, leg: Leg) -> NewOrderSingle:
+        """ An IOC order offsetting the filled quantity of a leg, priced through the leg price by unwind_slippage """
+        order = leg.order
+        if order.side is Side.Buy:
+            side, price = Side.Sell, order.price * (1 - self.unwind_slippage)
+        else:
+            side, price = Side.Buy, order.price * (1 + self.unwind_slippage)
+        tick_size = leg.gateway.get_tick_size(order.symbol)
+        if tick_size:
+            price = to_nearest(price, tick_size)
+        return NewOrderSingle(order.symbol, side, leg.filled_quantity, OrderType.IOC, price=price)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {'groups': self.group_count,
+                    'active': len(self._groups),
+                    'filled': self.filled_count,
+                    'failed': self.failed_count,
+                    'hedged': self.hedge_count,
+                    'ack_skew': self.ack_skew.get_stats(),
+                    'fill_skew': self.fill_skew.get_stats()}
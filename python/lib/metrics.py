@@ -50,4 +50,34 @@ class Timer:
 
     def get_mean(self) -> int:
         """ get mean in milliseconds """
-        return self._sum / self._count / 1000000
\ No newline at end of file
+        return self._sum / self._count / 1000000
+
+
+class DurationStats:
+    """ Count, mean and max of durations recorded in nanoseconds, reported in milliseconds """
+    def __init__(self):
+        self._sum = 0
+        self._count = 0
+        self._max = 0
+        self._last = 0
+
+    def add(self, duration: int):
+        self._sum += duration
+        self._count += 1
+        self._last = duration
+        if duration > self._max:
+            self._max = duration
+
+    def get_count(self) -> int:
+        return self._count
+
+    def get_mean(self) -> float:
+        """ get mean in milliseconds """
+        return self._sum / self._count / 1000000 if self._count else 0.0
+
+    def get_max(self) -> float:
+        """ get max in milliseconds """
+        return self._max / 1000000
+
+    def get_stats(self) -> dict:
+        return {'count': self._count, 'mean_ms': self.get_mean(), 'max_ms': self.get_max(), 'last_ms': self._last / 1000000}
@@ -0,0 +1,88 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
+
+# number of orders of a gateway that can be in flight at the same time
+DEFAULT_ORDER_WORKERS = 4
+
+# number of closed order ids remembered, so that a late order entry response does not store a closed order again
+DEFAULT_CLOSED_ORDERS = 1000
+
+
+class OrderResult:
+    """ The outcome of one request of a batch of order requests """
+    __slots__ = ('symbol', 'client_id', 'order_id', 'success', 'error')
+
+    def __init__(self, symbol: str = None, client_id: str = None, order_id: str = None, success: bool = False,
+                 error=None):
+        self.symbol = symbol
+        self.client_id = client_id
+        self.order_id = order_id
+        self.success = success
+        self.error = error
+
+    def __str__(self):
+        return "OrderResult [symbol={}, client_id={}, order_id={}, success={}, error={}]".format(
+            self.symbol, self.client_id, self.order_id, self.success, self.error)
+
+    def __repr__(self):
+        return str(self)
+
+
+class ClosedOrders:
+    """ The ids of the last closed orders, oldest first """
+    def __init__(self, max_size: int = DEFAULT_CLOSED_ORDERS):
+        self.max_size = max_size
+        self._ids = OrderedDict()
+
+    def add(self, order_id: str) -> None:
+        self._ids[order_id] = None
+        if len(self._ids) > self.max_size:
+            self._ids.popitem(last=False)
+
+    def __contains__(self, order_id: str) -> bool:
+        return order_id in self._ids
+
+
+class OrderEntryExecutor:
+    """
+        Runs the blocking order entry calls of a gateway (signing and HTTP round trip) on a small thread pool, so that
+        several orders across symbols and venues can be in flight at the same time, and the caller, e.g. the gateway
+        event loop, is not blocked.
+
+        The calls run concurrently, so what they share must be thread-safe: client ids come from OrderIdGenerator,
+        and the HTTP requests go through the thread-safe connection pool of an HttpClient, with a requests.Session per
+        thread. The dydx3 client uses one module-level session from all the workers instead, which is safe as its
+        requests only pass per-call headers and the dYdX API sets no cookies.
+    """
+    def __init__(self, max_workers: int = DEFAULT_ORDER_WORKERS, name: str = 'orders'):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+
+    def submit(self, fn, *args) -> Future:
+        """ Run fn(*args) on the pool, can be called from any thread """
+        return self._executor.submit(fn, *args)
+
+    def run(self, fn, *args) -> asyncio.Future:
+        """ Run fn(*args) on the pool, return a future to be awaited on the running event loop """
+        return asyncio.wrap_future(self._executor.submit(fn, *args))
+
+    def run_batch(self, fn, items: list) -> [OrderResult]:
+        """
+            Run fn(item) -> OrderResult for every item concurrently on the pool and wait for all of them, the results
+            are in the order of the items. An exception raised for an item is returned as a failed OrderResult.
+            At most max_workers requests are in flight, and this must not be called from a worker of the pool
+        """
+        futures = [self._executor.submit(fn, item) for item in items]
+        results = []
+        for item, future in zip(items, futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                logging.error('order request failed: %s, %s', item, e)
+                results.append(OrderResult(error=e))
+        return results
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._executor.shutdown(wait=wait)
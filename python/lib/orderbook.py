@@ -0,0 +1,194 @@
+from bisect import bisect_left, insort
+from decimal import Decimal
+from lib.interface import OrderBook, Tier, Side
+
+
+# used when the instrument tick size is not known yet, fine enough to represent any exchange price
+DEFAULT_TICK_SIZE = 1e-8
+
+# side of the book levels reported in BookDelta
+BOOK_SIDES = {'bids': Side.Buy, 'asks': Side.Sell}
+
+
+class PriceTicks:
+    """
+        Convert prices to an integer number of ticks and back. Order books are keyed by ticks so that the hot path
+        hashes and compares integers, and prices are only converted back to float when the tiers are materialized.
+    """
+    def __init__(self, tick_size: float = None):
+        self.tick_size = tick_size or DEFAULT_TICK_SIZE
+
+        # number of decimals of the tick size, to remove float error when converting back to a price
+        self._decimals = max(0, -Decimal(str(self.tick_size)).normalize().as_tuple().exponent)
+
+    def to_ticks(self, price: float) -> int:
+        return int(round(price / self.tick_size))
+
+    def to_price(self, ticks: int) -> float:
+        return round(ticks * self.tick_size, self._decimals)
+
+    def to_str(self, ticks: int) -> str:
+        """ The price as a decimal string with the number of decimals of the tick size, as sent to the venues """
+        return '{:.{}f}'.format(ticks * self.tick_size, self._decimals)
+
+
+
+class SortedBookSide:
+    """
+        One side of an order book. Prices are kept in an array sorted in ascending order (maintained by bisect) next
+        to a map of price -> value, so that a price level insert/delete does not require a full sort and reading
+        the top N levels only touches N entries.
+
+        Prices can be any ordered key, the processors use integer ticks (see PriceTicks). The value stored against
+        a price is up to the caller (a size for FTX, a PriceLevel for dYdX).
+    """
+    def __init__(self, descending: bool):
+        # bids are read from the highest price, asks from the lowest price
+        self._descending = descending
+        self._prices = []
+        self._levels = {}
+
+    def set(self, price: float, value) -> None:
+        """ Insert or update a price level """
+        if price not in self._levels:
+            insort(self._prices, price)
+        self._levels[price] = value
+
+    def remove(self, price: float) -> bool:
+        """ Remove a price level, return False if the price level does not exist """
+        if price not in self._levels:
+            return False
+
+        del self._levels[price]
+        del self._prices[bisect_left(self._prices, price)]
+        return True
+
+    def get(self, price: float, default=None):
+        return self._levels.get(price, default)
+
+    def best(self):
+        """ Return the best price, or None if this side is empty """
+        if not self._prices:
+            return None
+        return self._prices[-1] if self._descending else self._prices[0]
+
+    def within(self, price: float, n: int) -> bool:
+        """ Return True if the price is at or better than the n-th best price, i.e. a change at this price would be
+            visible in the top n levels """
+        prices = self._prices
+        if len(prices) < n:
+            return True
+
+        if self._descending:
+            return price >= prices[-n]
+        else:
+            return price <= prices[n - 1]
+
+    def prices(self, n: int = None) -> list:
+        """ Return the best n prices (all prices if n is None), best first """
+        if n is None:
+            n = len(self._prices)
+
+        if self._descending:
+            return self._prices[:-n - 1:-1]
+        else:
+            return self._prices[:n]
+
+    def top(self, n: int = None) -> list:
+        """ Return the best n levels as a list of (price, value), best first """
+        levels = self._levels
+        return [(price, levels[price]) for price in self.prices(n)]
+
+    def clear(self) -> None:
+        self._prices = []
+        self._levels = {}
+
+    def __contains__(self, price: float) -> bool:
+        return price in self._levels
+
+    def __len__(self) -> int:
+        return len(self._prices)
+
+
+class StaleOrderBookError(RuntimeError):
+    """ Raised when the deep levels of an OrderBookView are read after the processor has moved on """
+
+
+class BookChannelError(RuntimeError):
+    """ Raised when the order book messages of a symbol cannot be processed, so that only that book is recovered """
+    def __init__(self, symbol: str):
+        super().__init__('order book of {} failed'.format(symbol))
+        self.symbol = symbol
+
+
+class LazyTiers:
+    """
+        The tiers of one side of an OrderBookView. The top tier and the number of tiers are taken with the view, the
+        other tiers only when indexed beyond the top, sliced or iterated.
+    """
+    __slots__ = ('_view', '_side', '_top', '_count', '_tiers')
+
+    def __init__(self, view, side: str, top: Tier, count: int):
+        self._view = view
+        self._side = side
+        self._top = top
+        self._count = count
+        self._tiers = None
+
+    def __getitem__(self, index):
+        if index == 0 and self._top is not None:
+            return self._top
+        return self._materialize()[index]
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __iter__(self):
+        return iter(self._materialize())
+
+    def _materialize(self) -> [Tier]:
+        if self._tiers is None:
+            self._tiers = self._view._load(self._side)
+        return self._tiers
+
+
+class OrderBookView(OrderBook):
+    """
+        An OrderBook that references the order book processor storage instead of holding a list of tiers.
+        bids[0] and asks[0] and the number of tiers of each side are taken when the view is created, so a BBO-only
+        consumer pays for two tiers per update. The other levels are read from the processor on first access and then kept, which is only
+        allowed while the processor has not applied a visible change since the view was created; after that a
+        StaleOrderBookError is raised. Call snapshot() to keep a frozen copy of the whole book.
+
+        The source is a processor that implements get_tiers(side, n), get_tier_count(side) and a version counter
+        incremented on every change of the visible levels.
+    """
+    __slots__ = ('_source', '_version')
+
+    def __init__(self, timestamp: float, source):
+        self._source = source
+        self._version = source.version
+
+        bids = source.get_tiers('bids', 1)
+        asks = source.get_tiers('asks', 1)
+        super().__init__(timestamp=timestamp,
+                         bids=LazyTiers(self, 'bids', bids[0] if bids else None, source.get_tier_count('bids')),
+                         asks=LazyTiers(self, 'asks', asks[0] if asks else None, source.get_tier_count('asks')))
+
+    def is_current(self) -> bool:
+        """ Return True if the processor has not changed the visible levels since this view was created """
+        return self._source.version == self._version
+
+    def snapshot(self) -> OrderBook:
+        """ Return a frozen copy of the whole book """
+        return OrderBook(timestamp=self.timestamp, bids=list(self.bids), asks=list(self.asks))
+
+    def top_of_book(self) -> OrderBook:
+        """ Return a frozen book of the top tier of each side, without reading the processor, from any thread """
+        bid, ask = self.bids._top, self.asks._top
+        return OrderBook(timestamp=self.timestamp, bids=[bid] if bid else [], asks=[ask] if ask else [])
+
+    def _load(self, side: str) -> [Tier]:
+        if not self.is_current():
+            raise StaleOrderBookError('order book has changed since this view was created, use snapshot() to keep a copy')
+        return self._source.get_tiers(side)
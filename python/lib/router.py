@@ -0,0 +1,72 @@
+import time
+from collections import defaultdict
+
+# the channel of the frames that match no route
+DEFAULT_CHANNEL = 'other'
+
+# number of leading characters scanned for the markers, enough to cover the header of a message before its payload
+DEFAULT_SCAN_LENGTH = 256
+
+
+class MessageRouter:
+    """
+        Dispatches websocket frames to channel handlers, classifying a frame by a substring scan of its first
+        characters instead of decoding it. Routes are checked in the order they were added, and a handler is given
+        the decoded message only if it needs it, otherwise the raw frame. Frames can be str or bytes.
+
+        The number of frames of each channel is counted as a side effect, see get_counts() and get_rates().
+    """
+    def __init__(self, loads, scan_length: int = DEFAULT_SCAN_LENGTH):
+        self._loads = loads
+        self._scan_length = scan_length
+
+        # (str marker, bytes marker, channel)
+        self._markers = []
+        # channel -> (handler, decode)
+        self._handlers = {DEFAULT_CHANNEL: (None, False)}
+
+        self._counts = defaultdict(int)
+        self._rate_counts = {}
+        self._rate_time = time.time()
+
+    def add_route(self, channel: str, marker: str, handler, decode: bool = True) -> None:
+        """ Send the frames containing the marker to the handler, decoded if decode is True """
+        self._markers.append((marker, marker.encode(), channel))
+        self._handlers[channel] = (handler, decode)
+
+    def set_default(self, handler, decode: bool = False) -> None:
+        """ Handler of the frames that match no route """
+        self._handlers[DEFAULT_CHANNEL] = (handler, decode)
+
+    def classify(self, message) -> str:
+        is_bytes = isinstance(message, bytes)
+        end = self._scan_length
+        for marker, bytes_marker, channel in self._markers:
+            if message.find(bytes_marker if is_bytes else marker, 0, end) >= 0:
+                return channel
+        return DEFAULT_CHANNEL
+
+    def route(self, message) -> None:
+        channel = self.classify(message)
+        self._counts[channel] += 1
+
+        handler, decode = self._handlers[channel]
+        if handler:
+            handler(self._loads(message) if decode else message)
+
+    def get_counts(self) -> dict:
+        """ Return the number of frames received per channel """
+        return dict(self._counts)
+
+    def get_rates(self) -> dict:
+        """ Return the number of frames per second of each channel since the previous call """
+        now = time.time()
+        elapsed = now - self._rate_time
+        counts = self._counts
+        previous = self._rate_counts
+        rates = {channel: (count - previous.get(channel, 0)) / elapsed if elapsed > 0 else 0
+                 for channel, count in counts.items()}
+
+        self._rate_counts = dict(counts)
+        self._rate_time = now
+        return rates
@@ -0,0 +1,182 @@
+import asyncio
+import logging
+import time
+from collections.abc import Coroutine
+from concurrent.futures import Future
+from threading import Thread, Lock, get_ident
+
+
+class GatewayTasks:
+    """ Counters of the tasks of one gateway on a GatewayRuntime, busy time is the time spent in the task steps """
+    def __init__(self):
+        self.tasks = set()
+        self.started = 0
+        self.finished = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.steps = 0
+        self.busy_ns = 0
+        self.max_step_ns = 0
+
+    def get_stats(self) -> dict:
+        return {'running': len(self.tasks),
+                'started': self.started,
+                'finished': self.finished,
+                'failed': self.failed,
+                'cancelled': self.cancelled,
+                'steps': self.steps,
+                'busy_ms': self.busy_ns / 1000000,
+                'max_step_ms': self.max_step_ns / 1000000}
+
+
+class _TimedCoroutine(Coroutine):
+    """ Runs a coroutine and adds the time of each of its steps to the counters of its gateway """
+    __slots__ = ('_coro', '_counters')
+
+    def __init__(self, coro, counters: GatewayTasks):
+        self._coro = coro
+        self._counters = counters
+
+    def send(self, value):
+        return self._step(self._coro.send, value)
+
+    def throw(self, *args):
+        return self._step(self._coro.throw, *args)
+
+    def close(self):
+        return self._coro.close()
+
+    def _step(self, method, *args):
+        start = time.perf_counter_ns()
+        try:
+            return method(*args)
+        finally:
+            duration = time.perf_counter_ns() - start
+            counters = self._counters
+            counters.steps += 1
+            counters.busy_ns += duration
+            if duration > counters.max_step_ns:
+                counters.max_step_ns = duration
+
+    def __await__(self):
+        return self._coro.__await__()
+
+
+class GatewayRuntime:
+    """
+        Hosts the event loop tasks of several gateways, e.g. an FtxManager and a DydxManager created with
+        runtime=, on one event loop and one thread instead of a loop thread per gateway. The depth and execution
+        callbacks of all the gateways are then called from the runtime thread, one after the other, so that a
+        strategy reading the books of several venues needs no locking. Work can also be posted to that thread with
+        call_soon().
+
+        Each gateway registers its name, see register(), and its tasks are accounted under it, see get_task_stats().
+        As every gateway shares the thread, a long step of one gateway, e.g. a slow callback, delays the messages of
+        the others: max_step_ms shows it.
+    """
+    def __init__(self, name='runtime'):
+        self.loop = asyncio.new_event_loop()
+        self._thread = Thread(target=self._run, daemon=True, name=name)
+        self._started = False
+        self._lock = Lock()
+
+        # gateway name -> GatewayTasks
+        self._gateways = {}
+
+        # names of the gateways hosted, the tasks are accounted by name so that two gateways cannot share one
+        self._registered = set()
+
+    def register(self, gateway: str) -> None:
+        """ Reserve the name of a gateway hosted on the runtime, raise ValueError if it is already in use """
+        with self._lock:
+            if gateway in self._registered:
+                raise ValueError('gateway {} is already registered on the runtime'.format(gateway))
+            self._registered.add(gateway)
+
+    def unregister(self, gateway: str) -> None:
+        """ Cancel the tasks of a gateway and release its name, its task counters are kept """
+        self.cancel(gateway)
+        with self._lock:
+            self._registered.discard(gateway)
+
+    def start(self) -> None:
+        """ Start the runtime thread, a started runtime can be shared by several gateways """
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        self._thread.start()
+
+    def stop(self) -> None:
+        """ Cancel the tasks of every gateway and stop the runtime thread once they are done """
+        if not self._thread.is_alive():
+            return
+        self.loop.call_soon_threadsafe(lambda: self.loop.create_task(self._shutdown()))
+        if not self.in_runtime_thread():
+            self._thread.join()
+
+    async def _shutdown(self) -> None:
+        tasks = [task for counters in self._gateways.values() for task in counters.tasks]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.loop.stop()
+
+    def _run(self) -> None:
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def in_runtime_thread(self) -> bool:
+        return self._thread.ident == get_ident()
+
+    def spawn(self, gateway: str, coro) -> Future:
+        """ Run a coroutine as a task of a gateway, from any thread, return a Future of its result """
+        future = Future()
+        self.loop.call_soon_threadsafe(self._create_task, gateway, coro, future)
+        return future
+
+    def run(self, gateway: str, coro, timeout: float = None):
+        """ Run a coroutine as a task of a gateway and wait for its result, from another thread than the runtime """
+        if self.in_runtime_thread():
+            coro.close()
+            raise RuntimeError('cannot wait for a task on the runtime thread')
+        self.start()
+        return self.spawn(gateway, coro).result(timeout)
+
+    def call_soon(self, callback, *args) -> None:
+        """ Call a function on the runtime thread, from any thread """
+        self.loop.call_soon_threadsafe(callback, *args)
+
+    def cancel(self, gateway: str) -> None:
+        """ Cancel the tasks of a gateway, from any thread """
+        self.loop.call_soon_threadsafe(self._cancel, gateway)
+
+    def _create_task(self, gateway: str, coro, future: Future) -> None:
+        counters = self._gateways.setdefault(gateway, GatewayTasks())
+        task = self.loop.create_task(_TimedCoroutine(coro, counters), name=gateway)
+        counters.tasks.add(task)
+        counters.started += 1
+        task.add_done_callback(lambda t: self._on_task_done(counters, t, future))
+
+    def _cancel(self, gateway: str) -> None:
+        counters = self._gateways.get(gateway)
+        if counters:
+            for task in list(counters.tasks):
+                task.cancel()
+
+    def _on_task_done(self, counters: GatewayTasks, task: asyncio.Task, future: Future) -> None:
+        counters.tasks.discard(task)
+        if task.cancelled():
+            counters.cancelled += 1
+            future.cancel()
+        elif task.exception():
+            counters.failed += 1
+            logging.error('task of %s failed: %s', task.get_name(), task.exception())
+            future.set_exception(task.exception())
+        else:
+            counters.finished += 1
+            future.set_result(task.result())
+
+    def get_task_stats(self) -> dict:
+        """ Task counters and busy time of each gateway """
+        return {gateway: counters.get_stats() for gateway, counters in list(self._gateways.items())}
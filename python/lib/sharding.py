@@ -0,0 +1,205 @@
+import inspect
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from lib.interface import OrderBook, NewOrderSingle
+from lib.order_entry import OrderResult
+from lib.subscribers import Subscriber, INLINE
+
+
+def shard_of(symbol: str, shards: int) -> int:
+    """ The shard of a symbol, stable across processes and runs unlike hash() """
+    return zlib.crc32(symbol.encode()) % shards
+
+
+def assign_shards(symbols: {str}, shards: int) -> [set]:
+    """ Split the symbols into the given number of shards, some shards can be empty """
+    assignment = [set() for _ in range(shards)]
+    for symbol in symbols:
+        assignment[shard_of(symbol, shards)].add(symbol)
+    return assignment
+
+
+class ShardedManager:
+    """
+        Spreads the symbols of a gateway over several managers, e.g. FtxManager or DydxManager, each with its own
+        websocket connection and event loop thread, so that the messages of one symbol only queue behind the
+        messages of the symbols of the same shard. A symbol is always assigned to the same shard, see shard_of().
+
+        The market data and order entry API of a single manager is kept: get_ticker() and the order calls are routed
+        to the manager of the symbol, and the callbacks are registered with every manager. Each manager only reports
+        the executions of the orders it has placed, so an execution is reported once. A subscriber is added to the
+        managers of its symbols, one Subscriber per shard, and the stats are reported per shard name.
+
+        The callbacks are called from the loop threads of all the shards, pass a CallbackDispatcher in the manager
+        options to receive them on one thread. With account keys, every shard subscribes to the account channels.
+    """
+    def __init__(self, manager_class, symbols: {str}, shards: int, name: str = None, **manager_options):
+        if isinstance(symbols, str):
+            symbols = {symbols}
+        if shards < 1:
+            raise ValueError('shards must be at least 1')
+
+        # the shards are named after the index, so that their threads and runtime tasks are told apart
+        name = name or inspect.signature(manager_class).parameters['name'].default
+        self._shard_count = shards
+        self._managers = {}
+        self._symbol_managers = {}
+        for index, shard_symbols in enumerate(assign_shards(symbols, shards)):
+            if not shard_symbols:
+                continue
+            manager = manager_class(shard_symbols, name='{}-{}'.format(name, index), **manager_options)
+            self._managers[index] = manager
+            for symbol in shard_symbols:
+                self._symbol_managers[symbol] = manager
+
+        # the batches of the shards are placed concurrently
+        self._batch_executor = ThreadPoolExecutor(max_workers=max(1, len(self._managers)),
+                                                  thread_name_prefix='{}-batches'.format(name))
+
+    @property
+    def managers(self) -> list:
+        """ The manager of each non-empty shard """
+        return list(self._managers.values())
+
+    def get_manager(self, contract_name: str):
+        """ The manager of the shard of a symbol """
+        return self._symbol_managers[contract_name]
+
+    def get_shard(self, contract_name: str) -> int:
+        return shard_of(contract_name, self._shard_count)
+
+    def connect(self):
+        for manager in self._managers.values():
+            manager.connect()
+
+    def reconnect(self):
+        for manager in self._managers.values():
+            manager.reconnect()
+
+    def stop(self):
+        for manager in self._managers.values():
+            manager.stop()
+        self._batch_executor.shutdown(wait=False)
+
+    def not_ready(self) -> bool:
+        return any(manager.not_ready() for manager in self._managers.values())
+
+    def get_ticker(self, contract_name: str) -> OrderBook:
+        """ To get latest orderbook """
+        return self._symbol_managers[contract_name].get_ticker(contract_name)
+
+    def get_delta(self, contract_name: str) -> float:
+        return self._symbol_managers[contract_name].get_delta(contract_name)
+
+    def get_orders(self, contract_name: str) -> []:
+        return self._symbol_managers[contract_name].get_orders(contract_name)
+
+    def get_tick_size(self, contract_name: str):
+        return self._symbol_managers[contract_name].get_tick_size(contract_name)
+
+    def get_quantity_size(self, contract_name: str):
+        return self._symbol_managers[contract_name].get_quantity_size(contract_name)
+
+    def register_depth_callback(self, callback):
+        """ a depth callback function takes two arguments: (contract_name:str, book: OrderBook) """
+        for manager in self._managers.values():
+            manager.register_depth_callback(callback)
+
+    def register_execution_callback(self, callback):
+        """ an execution callback function takes one argument, an order event: (event: OrderEvent) """
+        for manager in self._managers.values():
+            manager.register_execution_callback(callback)
+
+    def register_delta_callback(self, callback):
+        """ a delta callback function takes two arguments: (contract_name:str, delta: BookDelta) """
+        for manager in self._managers.values():
+            manager.register_delta_callback(callback)
+
+    def register_signal_callback(self, callback):
+        """ a signal callback function takes two arguments: (contract_name:str, data:{}) """
+        for manager in self._managers.values():
+            manager.register_signal_callback(callback)
+
+    def add_depth_subscriber(self, callback, policy: str = INLINE, symbols: {str} = None) -> {int: Subscriber}:
+        """ add a depth callback function to the managers of the symbols (all if None), return the Subscriber of
+            each shard. A threaded or conflated subscriber has a thread per shard """
+        return {index: manager.add_depth_subscriber(callback, policy, shard_symbols)
+                for index, manager, shard_symbols in self._subscribed_shards(symbols)}
+
+    def add_execution_subscriber(self, callback, policy: str = INLINE, symbols: {str} = None) -> {int: Subscriber}:
+        """ add an execution callback function to the managers of the symbols (all if None), return the Subscriber
+            of each shard """
+        return {index: manager.add_execution_subscriber(callback, policy, shard_symbols)
+                for index, manager, shard_symbols in self._subscribed_shards(symbols)}
+
+    def remove_subscriber(self, subscribers: {int: Subscriber}):
+        for index, subscriber in subscribers.items():
+            self._managers[index].remove_subscriber(subscriber)
+
+    def _subscribed_shards(self, symbols: {str}) -> [tuple]:
+        """ (index, manager, symbols) of the shards with some of the symbols, symbols None for all """
+        if symbols is None:
+            return [(index, manager, None) for index, manager in self._managers.items()]
+        if isinstance(symbols, str):
+            symbols = {symbols}
+        shards = {}
+        for symbol in symbols:
+            shards.setdefault(self.get_shard(symbol), set()).add(symbol)
+        return [(index, self._managers[index], shard_symbols) for index, shard_symbols in shards.items()
+                if index in self._managers]
+
+    def _shard_stats(self, getter: str) -> dict:
+        return {manager._name: getattr(manager, getter)() for manager in self._managers.values()}
+
+    def get_recovery_stats(self) -> dict:
+        """ Return the order book failures and recovery times of each shard """
+        return self._shard_stats('get_recovery_stats')
+
+    def get_feed_stats(self) -> dict:
+        """ Return the win rate and lead time of the book feeds of each shard """
+        return self._shard_stats('get_feed_stats')
+
+    def get_reconnect_stats(self) -> dict:
+        """ Return the websocket reconnect downtime and the REST snapshot durations of each shard """
+        return self._shard_stats('get_reconnect_stats')
+
+    def get_conflation_stats(self) -> dict:
+        """ Return the conflation counters of each shard """
+        return self._shard_stats('get_conflation_stats')
+
+    def get_message_rates(self) -> dict:
+        """ Return the websocket messages per second of each channel of each shard since the previous call """
+        return self._shard_stats('get_message_rates')
+
+    def get_http_timings(self) -> dict:
+        """ Return the latest REST request timings of each shard """
+        return self._shard_stats('get_http_timings')
+
+    def place_order(self, nos: NewOrderSingle) -> str:
+        return self._symbol_managers[nos.symbol].place_order(nos)
+
+    def submit_order(self, nos: NewOrderSingle) -> Future:
+        return self._symbol_managers[nos.symbol].submit_order(nos)
+
+    def place_orders(self, orders: [NewOrderSingle]) -> [OrderResult]:
+        """ Place orders concurrently on the managers of their symbols, return a result per order in order """
+        batches = {}
+        for index, nos in enumerate(orders):
+            batches.setdefault(self._symbol_managers[nos.symbol], []).append((index, nos))
+
+        futures = [(batch, self._batch_executor.submit(manager.place_orders, [nos for _, nos in batch]))
+                   for manager, batch in batches.items()]
+        results = [None] * len(orders)
+        for batch, future in futures:
+            for (index, _), result in zip(batch, future.result()):
+                results[index] = result
+        return results
+
+    def cancel_order(self, contract_name: str, order_id: str) -> OrderResult:
+        return self._symbol_managers[contract_name].cancel_order(contract_name, order_id)
+
+    def cancel_orders(self, contract_name: str, order_ids: [str]) -> [OrderResult]:
+        return self._symbol_managers[contract_name].cancel_orders(contract_name, order_ids)
+
+    def cancel_all_orders(self, contract_name: str) -> OrderResult:
+        return self._symbol_managers[contract_name].cancel_all_orders(contract_name)
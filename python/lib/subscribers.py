@@ -0,0 +1,125 @@
+from lib.dispatcher import CallbackDispatcher
+
+# delivery policies of a subscriber
+INLINE = 'inline'           # called on the gateway event loop thread
+THREADED = 'threaded'       # called on a thread of its own, every book and event in order
+CONFLATED = 'conflated'     # called on a thread of its own, only the latest book of each symbol, every event in order
+POLICIES = (INLINE, THREADED, CONFLATED)
+
+
+class Subscriber:
+    """ A depth or execution callback with its delivery policy and the symbols it is interested in """
+    def __init__(self, callback, policy: str = INLINE, symbols: {str} = None, name: str = 'subscriber'):
+        if policy not in POLICIES:
+            raise ValueError('policy must be one of {}'.format(list(POLICIES)))
+
+        self.callback = callback
+        self.policy = policy
+
+        # None to receive every symbol
+        self.symbols = None if symbols is None else frozenset([symbols] if isinstance(symbols, str) else symbols)
+
+        self.dispatcher = None
+        if policy != INLINE:
+            self.dispatcher = CallbackDispatcher(name=name, conflate_books=(policy == CONFLATED))
+            self.dispatcher.start()
+
+    def accepts(self, symbol: str) -> bool:
+        return self.symbols is None or symbol in self.symbols
+
+    def deliver_book(self, symbol: str, book) -> None:
+        if self.dispatcher:
+            self.dispatcher.submit_book(self.callback, symbol, book)
+        else:
+            self.callback(symbol, book)
+
+    def deliver_event(self, event) -> None:
+        if self.dispatcher:
+            self.dispatcher.submit_event(self.callback, event)
+        else:
+            self.callback(event)
+
+    def close(self) -> None:
+        if self.dispatcher:
+            self.dispatcher.stop()
+
+
+class SubscriberIndex:
+    """
+        The subscribers of one kind of callback, indexed by symbol so that publishing only goes through the
+        subscribers of that symbol. The index is rebuilt when a subscriber is added or removed.
+    """
+    def __init__(self):
+        self._subscribers = []
+
+        # symbol -> subscribers, and the subscribers of the symbols not in the index (the ones without filter)
+        self._by_symbol = {}
+        self._any_symbol = []
+
+    def add(self, subscriber: Subscriber) -> None:
+        self._subscribers.append(subscriber)
+        self._rebuild()
+
+    def remove(self, subscriber: Subscriber) -> bool:
+        if subscriber not in self._subscribers:
+            return False
+        self._subscribers.remove(subscriber)
+        self._rebuild()
+        return True
+
+    def get(self, symbol: str) -> [Subscriber]:
+        return self._by_symbol.get(symbol, self._any_symbol)
+
+    def __iter__(self):
+        return iter(self._subscribers)
+
+    def __len__(self) -> int:
+        return len(self._subscribers)
+
+    def _rebuild(self) -> None:
+        symbols = set()
+        for subscriber in self._subscribers:
+            if subscriber.symbols is not None:
+                symbols.update(subscriber.symbols)
+
+        # keep the order of registration
+        self._by_symbol = {symbol: [s for s in self._subscribers if s.accepts(symbol)] for symbol in symbols}
+        self._any_symbol = [s for s in self._subscribers if s.symbols is None]
+
+
+class SubscriberRegistry:
+    """
+        Fan-out of the depth and execution callbacks of a gateway to several subscribers. Each subscriber has its own
+        policy, so a slow threaded or conflated subscriber does not delay the inline ones or the other threads.
+    """
+    def __init__(self, name: str = 'gateway'):
+        self._name = name
+        self._depth = SubscriberIndex()
+        self._execution = SubscriberIndex()
+
+    def add_depth(self, callback, policy: str = INLINE, symbols: {str} = None) -> Subscriber:
+        subscriber = Subscriber(callback, policy, symbols, name='{}-depth-{}'.format(self._name, len(self._depth)))
+        self._depth.add(subscriber)
+        return subscriber
+
+    def add_execution(self, callback, policy: str = INLINE, symbols: {str} = None) -> Subscriber:
+        subscriber = Subscriber(callback, policy, symbols, name='{}-exec-{}'.format(self._name, len(self._execution)))
+        self._execution.add(subscriber)
+        return subscriber
+
+    def remove(self, subscriber: Subscriber) -> None:
+        """ Remove a subscriber, its pending callbacks are dispatched before its thread stops """
+        if self._depth.remove(subscriber) or self._execution.remove(subscriber):
+            subscriber.close()
+
+    def publish_book(self, symbol: str, book) -> None:
+        for subscriber in self._depth.get(symbol):
+            subscriber.deliver_book(symbol, book)
+
+    def publish_event(self, event) -> None:
+        for subscriber in self._execution.get(event.contract_name):
+            subscriber.deliver_event(event)
+
+    def close(self) -> None:
+        for subscriber in list(self._depth) + list(self._execution):
+            subscriber.close()
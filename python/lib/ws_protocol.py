@@ -0,0 +1,40 @@
+from websockets.client import WebSocketClientProtocol
+from websockets.exceptions import ProtocolError
+from websockets.frames import OP_TEXT, OP_BINARY, OP_CONT
+
+
+class BytesClientProtocol(WebSocketClientProtocol):
+    """
+        A websocket client protocol that returns text messages as the raw UTF-8 bytes of the frame instead of a str,
+        so that the JSON decoder works on the frame directly and the message is not decoded twice. The decoder is
+        responsible for rejecting invalid UTF-8.
+
+        Use with websockets.connect(url, create_protocol=BytesClientProtocol).
+    """
+    async def read_message(self):
+        frame = await self.read_data_frame(max_size=self.max_size)
+
+        # a close frame was received
+        if frame is None:
+            return None
+
+        if frame.opcode not in (OP_TEXT, OP_BINARY):
+            raise ProtocolError("unexpected opcode")
+
+        # no fragmentation, the common case
+        if frame.fin:
+            return frame.data
+
+        chunks = [frame.data]
+        max_size = self.max_size
+        while not frame.fin:
+            if max_size is not None:
+                max_size -= len(frame.data)
+            frame = await self.read_data_frame(max_size=max_size)
+            if frame is None:
+                raise ProtocolError("incomplete fragmented message")
+            if frame.opcode != OP_CONT:
+                raise ProtocolError("unexpected opcode")
+            chunks.append(frame.data)
+
+        return b"".join(chunks)
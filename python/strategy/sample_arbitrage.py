@@ -1,6 +1,8 @@
 import asyncio
 
-from lib.interface import OrderBook
+from lib.interface import OrderBook, NewOrderSingle, Side, OrderType
+from lib.leg_execution import LegExecutor, LegGroup
+from lib.runtime import GatewayRuntime
 from gateways.ftx.ftx import FtxManager
 from gateways.dydx.dydx import DydxManager
 from lib.events import OrderEvent
@@ -11,6 +13,12 @@ import time
 import os
 from dotenv import load_dotenv
 
+# seconds without sending legs after a failed execution
+DEFAULT_RETRY_COOLDOWN = 5.0
+
+# failed executions in a row after which the strategy stops trading
+DEFAULT_MAX_FAILURES = 3
+
 
 class ArbitrageStrategy:
     def __init__(self,
@@ -18,7 +26,13 @@ class ArbitrageStrategy:
                  target_symbol: str,
                  signal_distance: float,
                  reversal_distance: float,
-                 spread_graph: SpreadSignalGraph = None):
+                 spread_graph: SpreadSignalGraph = None,
+                 reference_gateway=None,
+                 target_gateway=None,
+                 quantity: float = 0,
+                 leg_executor: LegExecutor = None,
+                 retry_cooldown: float = DEFAULT_RETRY_COOLDOWN,
+                 max_failures: int = DEFAULT_MAX_FAILURES):
 
         self._reference_symbol = reference_symbol
         self._reference_book = None
@@ -37,6 +51,24 @@ class ArbitrageStrategy:
         # graph
         self._graph = spread_graph
 
+        # with both gateways and a quantity, the legs are traded on signal change, one leg on each gateway
+        self._reference_gateway = reference_gateway
+        self._target_gateway = target_gateway
+        self._quantity = quantity
+        self._leg_executor = leg_executor or LegExecutor()
+
+        # signal traded so far, updated once the legs of a signal change are filled
+        self._position = 0
+        self._pending_group: LegGroup = None
+        self._pending_position = 0
+
+        # after a failed execution, legs are sent again once its hedge is sent and the cooldown has elapsed, and not
+        # at all after max_failures failures in a row
+        self._retry_cooldown = retry_cooldown
+        self._max_failures = max_failures
+        self._failures = 0
+        self._retry_time = 0
+
     def on_reference_book(self, contract_name: str, book: OrderBook):
         if not tob_crossed(book):
             self._reference_book = book
@@ -49,9 +81,11 @@ class ArbitrageStrategy:
 
     def on_reference_execution(self, order_event: OrderEvent):
         logging.info('Reference execution callback: {}'.format(order_event))
+        self._leg_executor.on_execution(order_event)
 
     def on_target_execution(self, order_event: OrderEvent):
-        logging.info('Reference execution callback: {}'.format(order_event))
+        logging.info('Target execution callback: {}'.format(order_event))
+        self._leg_executor.on_execution(order_event)
 
     def _on_book_event(self):
         """ assume no crossing for each book, then only only side will cross """
@@ -82,6 +116,55 @@ class ArbitrageStrategy:
 
         self._last_signal = signal
 
+        if self._reference_gateway and self._target_gateway and self._quantity:
+            self._trade(signal)
+
+    def _trade(self, signal: int):
+        """ Fire the reference and target legs concurrently to move the position to the signal """
+        if self._pending_group:
+            if not self._pending_group.is_settled():
+                return
+            if self._pending_group.is_filled():
+                self._position = self._pending_position
+                self._failures = 0
+            else:
+                # a failed signal change has been hedged back, it is traded again after the cooldown
+                self._failures += 1
+                self._retry_time = time.time() + self._retry_cooldown
+                if self._failures >= self._max_failures:
+                    logging.error('%s failed executions in a row, trading stopped', self._failures)
+            self._pending_group = None
+
+        if signal == self._position or self._failures >= self._max_failures or time.time() < self._retry_time:
+            return
+
+        quantity = abs(signal - self._position) * self._quantity
+        if signal > self._position:
+            # buy the reference at its ask, sell the target at its bid
+            legs = [(self._reference_gateway, NewOrderSingle(self._reference_symbol, Side.Buy, quantity, OrderType.IOC,
+                                                             price=self._reference_book.asks[0].price)),
+                    (self._target_gateway, NewOrderSingle(self._target_symbol, Side.Sell, quantity, OrderType.IOC,
+                                                          price=self._target_book.bids[0].price))]
+        else:
+            # sell the reference at its bid, buy the target at its ask
+            legs = [(self._reference_gateway, NewOrderSingle(self._reference_symbol, Side.Sell, quantity, OrderType.IOC,
+                                                             price=self._reference_book.bids[0].price)),
+                    (self._target_gateway, NewOrderSingle(self._target_symbol, Side.Buy, quantity, OrderType.IOC,
+                                                          price=self._target_book.asks[0].price))]
+
+        logging.info('signal changed from %s to %s, sending legs', self._position, signal)
+        self._pending_group = self._leg_executor.execute(legs)
+        self._pending_position = signal
+
+    def resume_trading(self):
+        """ Trade again after max_failures failed executions in a row """
+        self._failures = 0
+        self._retry_time = 0
+
+    def get_execution_stats(self) -> dict:
+        """ Leg counts and leg skew of the executions """
+        return self._leg_executor.get_stats()
+
 
 def calculate_mid(book: OrderBook) -> float:
     return 0.5 * (book.asks[0].price + book.bids[0].price)
@@ -91,13 +174,14 @@ def tob_crossed(book: OrderBook) -> bool:
     return book.asks[0].price <= book.bids[0].price
 
 
-def start_ftx(contract: str, read_only=True) -> FtxManager:
+def start_ftx(contract: str, read_only=True, runtime: GatewayRuntime = None) -> FtxManager:
     if read_only:
-        _ftx = FtxManager(symbol={contract})
+        _ftx = FtxManager(symbol={contract}, book_type='sorted', lazy_books=True, runtime=runtime)
     else:
         dotenv_path = 'c:/vault/.ftx_keys'
         load_dotenv(dotenv_path=dotenv_path)
-        _ftx = FtxManager(symbol={contract}, api_key=os.getenv('API_KEY'), api_secret=os.getenv('API_SECRET'))
+        _ftx = FtxManager(symbol={contract}, api_key=os.getenv('API_KEY'), api_secret=os.getenv('API_SECRET'),
+                          book_type='sorted', lazy_books=True, runtime=runtime)
 
     # connect
     _ftx.connect()
@@ -105,9 +189,10 @@ def start_ftx(contract: str, read_only=True) -> FtxManager:
     return _ftx
 
 
-def start_dydx(contract: str, read_only=True) -> DydxManager:
+def start_dydx(contract: str, read_only=True, runtime: GatewayRuntime = None) -> DydxManager:
     if read_only:
-        _dydx = DydxManager({contract}, web3_http_provider_url='https://mainnet.infura.io/v3/9a7bac104fd14b5e936862563224f8be')
+        _dydx = DydxManager({contract}, web3_http_provider_url='https://mainnet.infura.io/v3/9a7bac104fd14b5e936862563224f8be',
+                            lazy_books=True, runtime=runtime)
     else:
         dotenv_path = 'c:/vault/.dydx_keys'
         load_dotenv(dotenv_path=dotenv_path)
@@ -117,7 +202,8 @@ def start_dydx(contract: str, read_only=True) -> DydxManager:
                             os.getenv('S'),
                             os.getenv('K'),
                             os.getenv('P'),
-                            web3_http_provider_url='https://mainnet.infura.io/v3/9a7bac104fd14b5e936862563224f8be')
+                            web3_http_provider_url='https://mainnet.infura.io/v3/9a7bac104fd14b5e936862563224f8be',
+                            lazy_books=True, runtime=runtime)
 
     # connect
     _dydx.connect()
@@ -153,11 +239,15 @@ if __name__ == '__main__':
                                  reversal_distance=0.1,
                                  spread_graph=graph)
 
-    dydx = start_dydx(dydx_symbol, read_only=True)
+    # both gateways run on one event loop thread, so the book and execution callbacks of the strategy never run
+    # concurrently
+    runtime = GatewayRuntime(name='gateways')
+
+    dydx = start_dydx(dydx_symbol, read_only=True, runtime=runtime)
     dydx.register_depth_callback(strategy.on_target_book)
     dydx.register_execution_callback(strategy.on_target_execution)
 
-    ftx = start_ftx(ftx_symbol, read_only=True)
+    ftx = start_ftx(ftx_symbol, read_only=True, runtime=runtime)
     ftx.register_depth_callback(strategy.on_reference_book)
     ftx.register_execution_callback(strategy.on_reference_execution)
 
@@ -1,7 +1,57 @@
 import unittest
 import json
+import os
 import gateways.dydx.dydx as dydx
-from lib.interface import Side
+from concurrent.futures import ThreadPoolExecutor, Future, wait
+from gateways.dydx.stark_signing import StarkOrderSigner, sign_order
+from lib.identifier import OrderIdGenerator
+from lib.order_entry import ClosedOrders
+from lib.metrics import DurationStats
+from lib.arbitration import FeedArbiter
+from lib.subscribers import SubscriberRegistry
+from threading import Lock, Thread
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from dydx3 import Client
+import dydx3.helpers.requests as dydx_requests
+from lib.http_client import HttpClient
+from lib.interface import Side, InstrumentDetails, NewOrderSingle, OrderType
+from lib.orderbook import OrderBookView, StaleOrderBookError, PriceTicks
+
+
+def load_orderbook_samples() -> [dict]:
+    """ Load the recorded v3_orderbook websocket messages from samples.txt """
+    messages = []
+    with open(os.path.join(os.path.dirname(__file__), 'samples.txt')) as f:
+        for line in f:
+            if not line.startswith('< '):
+                continue
+            data = json.loads(line[2:])
+            if data.get('channel') == 'v3_orderbook':
+                messages.append(data)
+    return messages
+
+
+def sorted_levels(processor: dydx.OrderBookProcessor, side: str) -> [tuple]:
+    """ Reference: sort every non-empty level of one side """
+    to_price = processor._ticks.to_price
+    levels = [(to_price(ticks), level.get_size(), level.get_offset()) for ticks, level in processor._orderbooks[side].items() if level.get_size()]
+    return sorted(levels, reverse=(side == 'bids'))
+
+
+# a test key, the signatures are only checked locally
+STARK_PRIVATE_KEY = '0x' + '1' * 63
+
+
+class MarketsHandler(BaseHTTPRequestHandler):
+    """ Serves an empty dict of markets over keep-alive connections, echoing the content type received """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = json.dumps({'markets': {}, 'contentType': self.headers['Content-Type']}).encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
 
 
 class TestFtx(unittest.TestCase):
@@ -106,6 +156,7 @@ class TestFtx(unittest.TestCase):
         orders = message_dict['contents']['orders']
         events = dydx.process_orders_ws(orders, store)
         self.assertEqual('10382923421994539', events[0].client_id)
+        self.assertEqual(0.0, events[0].filled_quantity)
         self.assertEqual(1, len(store))
         orders = store.get('BTC-USD')
         self.assertEqual(1, len(orders))
@@ -154,4 +205,480 @@ class TestFtx(unittest.TestCase):
         store = {}
         dydx.process_positions_ws(positions, store)
         self.assertEqual(1, len(store))
-        self.assertEqual(0., store.get('BTC-USD'))
\ No newline at end of file
+        self.assertEqual(0., store.get('BTC-USD'))
+
+    def test_OrderBookProcessor_sorted_index(self):
+        messages = load_orderbook_samples()
+        self.assertTrue(len(messages) > 10)
+
+        processor = dydx.OrderBookProcessor('BTC-USD', depth=5)
+        for message in messages:
+            processor.handle(message)
+
+            bids = sorted_levels(processor, 'bids')
+            asks = sorted_levels(processor, 'asks')
+            self.assertEqual(bids[0][0], processor.get_best_bid())
+            self.assertEqual(asks[0][0], processor.get_best_ask())
+            self.assertEqual([p for (p, s, o) in bids], processor.get_sorted_bids())
+            self.assertEqual([p for (p, s, o) in asks], processor.get_sorted_asks())
+
+            order_book = processor.get_orderbook()
+            self.assertEqual(bids[:5], [(t.price, t.size, t.quote_id) for t in order_book.bids])
+            self.assertEqual(asks[:5], [(t.price, t.size, t.quote_id) for t in order_book.asks])
+
+    def test_OrderBookProcessor_best_price(self):
+        processor = dydx.OrderBookProcessor('ETH-USD')
+        self.assertIsNone(processor.get_best_bid())
+        self.assertIsNone(processor.get_best_ask())
+
+        message = '{"type":"channel_data","id":"ETH-USD","channel":"v3_orderbook","contents":{"offset":"10","bids":[["3100.1","1"],["3100.3","2"]],"asks":[["3109.2","3"]]}}'
+        processor.handle(json.loads(message))
+        self.assertEqual(3100.3, processor.get_best_bid())
+        self.assertEqual(3109.2, processor.get_best_ask())
+
+        # best bid removed, next level becomes best
+        message = '{"type":"channel_data","id":"ETH-USD","channel":"v3_orderbook","contents":{"offset":"11","bids":[["3100.3","0"]],"asks":[["3109.2","0"]]}}'
+        processor.handle(json.loads(message))
+        self.assertEqual(3100.1, processor.get_best_bid())
+        self.assertIsNone(processor.get_best_ask())
+
+        # stale update (lower offset) must not restore the level
+        message = '{"type":"channel_data","id":"ETH-USD","channel":"v3_orderbook","contents":{"offset":"9","bids":[["3100.3","5"]],"asks":[]}}'
+        processor.handle(json.loads(message))
+        self.assertEqual(3100.1, processor.get_best_bid())
+        self.assertEqual([3100.1], processor.get_sorted_bids())
+
+    def test_OrderBookProcessor_changed(self):
+        messages = load_orderbook_samples()
+
+        processor = dydx.OrderBookProcessor('BTC-USD', depth=5)
+        previous = None
+        unchanged_count = 0
+        for message in messages:
+            processor.handle(message)
+
+            order_book = processor.get_orderbook()
+            self.assertEqual(sorted_levels(processor, 'bids')[:5], [(t.price, t.size, t.quote_id) for t in order_book.bids])
+            self.assertEqual(sorted_levels(processor, 'asks')[:5], [(t.price, t.size, t.quote_id) for t in order_book.asks])
+
+            if not processor.changed:
+                self.assertIs(previous, order_book)
+                unchanged_count += 1
+            previous = order_book
+
+        self.assertTrue(unchanged_count > 0)
+
+    def test_OrderBookProcessor_unchanged_levels(self):
+        """ Removing a missing level or setting a level to its size inside the top levels leaves the book as is """
+        for processor in (dydx.OrderBookProcessor('ETH-USD', depth=5, tick_size=0.1),
+                          dydx.LadderOrderBookProcessor('ETH-USD', depth=5, tick_size=0.1)):
+            message = '{"type":"channel_data","id":"ETH-USD","channel":"v3_orderbook","contents":{"offset":"10","bids":[["3100.1","1"],["3100.3","2"]],"asks":[["3109.2","3"]]}}'
+            processor.handle(json.loads(message))
+            self.assertTrue(processor.changed)
+            order_book = processor.get_orderbook()
+
+            message = '{"type":"channel_data","id":"ETH-USD","channel":"v3_orderbook","contents":{"offset":"11","bids":[["3100.2","0"],["3100.3","2"]],"asks":[["3109.1","0"]]}}'
+            processor.handle(json.loads(message))
+            self.assertFalse(processor.changed)
+            self.assertIs(order_book, processor.get_orderbook())
+
+            message = '{"type":"channel_data","id":"ETH-USD","channel":"v3_orderbook","contents":{"offset":"12","bids":[["3100.2","0"],["3100.1","0"]],"asks":[]}}'
+            processor.handle(json.loads(message))
+            self.assertTrue(processor.changed)
+            self.assertEqual([3100.3], [t.price for t in processor.get_orderbook().bids])
+
+    def test_OrderBookProcessor_tick_size(self):
+        processor = dydx.OrderBookProcessor('ETH-USD', tick_size=0.1)
+
+        message = '{"type":"channel_data","id":"ETH-USD","channel":"v3_orderbook","contents":{"offset":"10","bids":[["3100.1","1"],["3100.3","2"]],"asks":[["3109.2","3"]]}}'
+        processor.handle(json.loads(message))
+
+        # stored as integer ticks, converted back to prices without float error
+        self.assertEqual({31001, 31003}, set(processor._orderbooks['bids'].keys()))
+        self.assertEqual(3100.3, processor.get_best_bid())
+        self.assertEqual([3100.3, 3100.1], processor.get_sorted_bids())
+        self.assertEqual(3109.2, processor.get_orderbook().asks[0].price)
+
+        # a different string representation of the same price updates the same level
+        message = '{"type":"channel_data","id":"ETH-USD","channel":"v3_orderbook","contents":{"offset":"11","bids":[["3100.30","0"]],"asks":[]}}'
+        processor.handle(json.loads(message))
+        self.assertEqual([3100.1], processor.get_sorted_bids())
+
+        # setting the tick size clears the book until the next snapshot
+        processor.set_tick_size(1)
+        self.assertFalse(processor.ready())
+        self.assertIsNone(processor.get_best_bid())
+
+    def test_LadderOrderBookProcessor_equivalence(self):
+        messages = load_orderbook_samples()
+
+        for capacity in (16, 256, 4096):
+            reference = dydx.OrderBookProcessor('BTC-USD', depth=5, tick_size=1)
+            processor = dydx.LadderOrderBookProcessor('BTC-USD', depth=5, tick_size=1, capacity=capacity)
+            for message in messages:
+                reference.handle(message)
+                processor.handle(message)
+
+                self.assertEqual(reference.get_best_bid(), processor.get_best_bid())
+                self.assertEqual(reference.get_best_ask(), processor.get_best_ask())
+                self.assertEqual(reference.get_sorted_bids(), processor.get_sorted_bids())
+                self.assertEqual(reference.get_sorted_asks(), processor.get_sorted_asks())
+
+                expected = reference.get_orderbook()
+                order_book = processor.get_orderbook()
+                self.assertEqual([(t.price, t.size, t.quote_id) for t in expected.bids], [(t.price, t.size, t.quote_id) for t in order_book.bids])
+                self.assertEqual([(t.price, t.size, t.quote_id) for t in expected.asks], [(t.price, t.size, t.quote_id) for t in order_book.asks])
+
+    def test_LadderOrderBookProcessor_offsets(self):
+        processor = dydx.LadderOrderBookProcessor('ETH-USD', tick_size=0.1)
+
+        message = '{"type":"channel_data","id":"ETH-USD","channel":"v3_orderbook","contents":{"offset":"10","bids":[["3100.1","1"],["3100.3","2"]],"asks":[["3109.2","3"]]}}'
+        processor.handle(json.loads(message))
+        self.assertEqual(3100.3, processor.get_best_bid())
+        self.assertEqual([2.0, 3.0], processor.get_cumulative_depth('bids').tolist())
+        self.assertEqual([3.0], processor.get_cumulative_depth('asks').tolist())
+
+        message = '{"type":"channel_data","id":"ETH-USD","channel":"v3_orderbook","contents":{"offset":"11","bids":[["3100.3","0"]],"asks":[]}}'
+        processor.handle(json.loads(message))
+        self.assertEqual(3100.1, processor.get_best_bid())
+
+        # lower offset than the removed level, should not update
+        message = '{"type":"channel_data","id":"ETH-USD","channel":"v3_orderbook","contents":{"offset":"9","bids":[["3100.3","5"]],"asks":[]}}'
+        processor.handle(json.loads(message))
+        self.assertFalse(processor.changed)
+        self.assertEqual(3100.1, processor.get_best_bid())
+
+    def test_OrderBookView(self):
+        messages = load_orderbook_samples()
+
+        for processor_class in (dydx.OrderBookProcessor, dydx.LadderOrderBookProcessor):
+            reference = dydx.OrderBookProcessor('BTC-USD', depth=5, tick_size=1)
+            processor = processor_class('BTC-USD', depth=5, tick_size=1, lazy=True)
+            for message in messages:
+                reference.handle(message)
+                processor.handle(message)
+
+                expected = reference.get_orderbook()
+                view = processor.get_orderbook()
+                self.assertIsInstance(view, OrderBookView)
+                self.assertEqual(expected.bids[0].price, view.bids[0].price)
+                self.assertEqual(expected.asks[0].quote_id, view.asks[0].quote_id)
+                self.assertEqual([(t.price, t.size, t.quote_id) for t in expected.bids], [(t.price, t.size, t.quote_id) for t in view.bids])
+                self.assertEqual([(t.price, t.size, t.quote_id) for t in expected.asks], [(t.price, t.size, t.quote_id) for t in view.snapshot().asks])
+
+        # a view is stale once the visible levels have changed
+        message = '{"type":"channel_data","id":"BTC-USD","channel":"v3_orderbook","contents":{"offset":"9408380193","bids":[["99999","1"]],"asks":[]}}'
+        processor.handle(json.loads(message))
+        view = processor.get_orderbook()
+        message = '{"type":"channel_data","id":"BTC-USD","channel":"v3_orderbook","contents":{"offset":"9408380194","bids":[["99999","2"]],"asks":[]}}'
+        processor.handle(json.loads(message))
+        self.assertFalse(view.is_current())
+        self.assertEqual(1, view.bids[0].size)
+        # the number of tiers is taken with the view, the deeper tiers can no longer be read
+        self.assertEqual(5, len(view.bids))
+        with self.assertRaises(StaleOrderBookError):
+            list(view.bids)
+
+    def test_delta_callback(self):
+        messages = load_orderbook_samples()
+
+        for processor_class in (dydx.OrderBookProcessor, dydx.LadderOrderBookProcessor):
+            deltas = []
+            processor = processor_class('BTC-USD', depth=5, tick_size=1)
+            processor.delta_callback = lambda symbol, delta: deltas.append(delta)
+
+            # replaying the deltas on a plain book gives the same book as the processor
+            book = {}
+            for message in messages:
+                processor.handle(message)
+                delta = deltas[-1]
+                self.assertEqual(message['type'] == 'subscribed', delta.snapshot)
+
+                if delta.snapshot:
+                    book = {Side.Buy: {}, Side.Sell: {}}
+                for side, price, size, offset in delta.levels:
+                    if size:
+                        book[side][price] = (size, offset)
+                    else:
+                        book[side].pop(price, None)
+
+                order_book = processor.get_orderbook()
+                self.assertEqual([(p, s, o) for p, (s, o) in sorted(book[Side.Buy].items(), reverse=True)[:5]],
+                                 [(t.price, t.size, t.quote_id) for t in order_book.bids])
+                self.assertEqual([(p, s, o) for p, (s, o) in sorted(book[Side.Sell].items())[:5]],
+                                 [(t.price, t.size, t.quote_id) for t in order_book.asks])
+
+            # stale updates are not reported
+            message = '{"type":"channel_data","id":"BTC-USD","channel":"v3_orderbook","contents":{"offset":"9408380193","bids":[["99999","1"]],"asks":[]}}'
+            processor.handle(json.loads(message))
+            self.assertEqual([(Side.Buy, 99999, 1, 9408380193)], deltas[-1].levels)
+            message = '{"type":"channel_data","id":"BTC-USD","channel":"v3_orderbook","contents":{"offset":"9408380192","bids":[["99999","2"]],"asks":[["100000","1"]]}}'
+            processor.handle(json.loads(message))
+            self.assertEqual([(Side.Sell, 100000, 1, 9408380192)], deltas[-1].levels)
+
+    def test_OrderBookProcessor_tombstones(self):
+        processor = dydx.OrderBookProcessor('ETH-USD', tick_size=0.1, tombstone_window=100)
+
+        message = '{"type":"channel_data","id":"ETH-USD","channel":"v3_orderbook","contents":{"offset":"10","bids":[["3100.1","1"],["3100.3","2"]],"asks":[["3109.2","3"]]}}'
+        processor.handle(json.loads(message))
+        message = '{"type":"channel_data","id":"ETH-USD","channel":"v3_orderbook","contents":{"offset":"11","bids":[["3100.3","0"]],"asks":[]}}'
+        processor.handle(json.loads(message))
+
+        # the empty level is removed from the book, only its offset is kept
+        self.assertEqual({31001}, set(processor._orderbooks['bids'].keys()))
+        self.assertEqual({'levels': 2, 'tombstones': 1, 'evicted': 0}, processor.get_book_stats())
+
+        # an older update is still rejected
+        message = '{"type":"channel_data","id":"ETH-USD","channel":"v3_orderbook","contents":{"offset":"9","bids":[["3100.3","5"]],"asks":[]}}'
+        processor.handle(json.loads(message))
+        self.assertEqual(3100.1, processor.get_best_bid())
+
+        # a newer update recreates the level
+        message = '{"type":"channel_data","id":"ETH-USD","channel":"v3_orderbook","contents":{"offset":"12","bids":[["3100.3","5"]],"asks":[["3109.2","0"]]}}'
+        processor.handle(json.loads(message))
+        self.assertEqual(3100.3, processor.get_best_bid())
+        self.assertEqual({'levels': 2, 'tombstones': 1, 'evicted': 0}, processor.get_book_stats())
+
+        # tombstones are evicted once they are out of the offset window
+        message = '{"type":"channel_data","id":"ETH-USD","channel":"v3_orderbook","contents":{"offset":"113","bids":[["3099","0"]],"asks":[]}}'
+        processor.handle(json.loads(message))
+        self.assertEqual({'levels': 2, 'tombstones': 1, 'evicted': 1}, processor.get_book_stats())
+        self.assertEqual({31001, 31003}, set(processor._orderbooks['bids'].keys()))
+
+    def test_OrderBookProcessor_book_stats(self):
+        messages = load_orderbook_samples()
+
+        for capacity in (16, 4096):
+            reference = dydx.OrderBookProcessor('BTC-USD', depth=5, tick_size=1, tombstone_window=20)
+            processor = dydx.LadderOrderBookProcessor('BTC-USD', depth=5, tick_size=1, capacity=capacity,
+                                                      tombstone_window=20)
+            for message in messages:
+                reference.handle(message)
+                processor.handle(message)
+
+                # the book only holds the non-empty levels, the empty ones inside and outside of the ladder window
+                # are evicted alike
+                self.assertEqual(reference.get_book_stats()['levels'], len(reference.get_sorted_bids()) + len(reference.get_sorted_asks()))
+                self.assertEqual(reference.get_book_stats(), processor.get_book_stats())
+            self.assertTrue(processor.get_book_stats()['evicted'] > 0)
+
+    def test_LadderOrderBookProcessor_drifting_tombstones(self):
+        # the market drifts away from the ladder window, emptying levels as it goes
+        processor = dydx.LadderOrderBookProcessor('BTC-USD', depth=5, tick_size=1, capacity=64, tombstone_window=100)
+        processor.handle({'type': 'subscribed', 'id': 'BTC-USD', 'contents': {'bids': [], 'asks': []}})
+        for offset in range(1, 2000):
+            bid = 40000 + offset
+            update = {'offset': str(offset), 'bids': [[str(bid), '1'], [str(bid - 1), '0']], 'asks': [[str(bid + 1), '0'], [str(bid + 2), '1']]}
+            processor.handle({'type': 'channel_data', 'id': 'BTC-USD', 'contents': update})
+
+        self.assertEqual(41999, processor.get_best_bid())
+        self.assertEqual(42001, processor.get_best_ask())
+        self.assertTrue(processor._ladder.recenter_count > 0)
+        stats = processor.get_book_stats()
+        self.assertEqual(2, stats['levels'])
+        self.assertTrue(stats['tombstones'] <= 2 * 101)
+        self.assertEqual(2 * 1999 - stats['tombstones'], stats['evicted'])
+
+    def test_DydxManager_message_router(self):
+        # the manager needs a connection to build, only the router is used
+        manager = dydx.DydxManager.__new__(dydx.DydxManager)
+        manager._json_loads = json.loads
+        router = manager._init_router()
+
+        with open(os.path.join(os.path.dirname(__file__), 'samples.txt')) as f:
+            frames = [line[2:].strip() for line in f if line.startswith('< ')]
+        self.assertTrue(len(frames) > 20)
+
+        for frame in frames:
+            data = json.loads(frame)
+            expected = data['type'] if data['type'] in ('connected', 'error') else data['channel']
+            self.assertEqual(expected, router.classify(frame))
+            self.assertEqual(expected, router.classify(frame.encode()))
+
+    def test_StarkOrderSigner(self):
+        # a thread pool signs the same as the process pool, without spawning processes in the tests
+        signer = StarkOrderSigner(1, STARK_PRIVATE_KEY, OrderIdGenerator('test'), cache_size=4,
+                                  executor=ThreadPoolExecutor(2))
+        signer.position_id = 12345
+        expiration = signer.expiration(60, now=1000.5)
+        self.assertEqual(1080, expiration)
+
+        # buys at the ask, the bid and one level below, sells at the bid, the ask and one level above, the orders
+        # being signed count toward the cache size
+        self.assertEqual(4, signer.presign_grid('BTC-USD', 40000, 40001, ['0.01'], 2, PriceTicks(1.0), '0.001',
+                                                expiration))
+        wait(list(signer._pending.values()))
+        self.assertEqual(4, signer.get_stats()['cached'])
+        self.assertEqual(2, signer.get_stats()['skipped'])
+
+        # already signed
+        key = next(iter(signer._cache))
+        self.assertEqual(0, signer.presign([key]))
+
+        client_id, signature = signer.sign(*key)
+        self.assertEqual(sign_order(1, STARK_PRIVATE_KEY, 12345, client_id, *key), signature)
+
+        # a pre-signed order is used once, the client id is part of the signature
+        other_id, other_signature = signer.sign(*key)
+        self.assertNotEqual(client_id, other_id)
+        self.assertEqual(sign_order(1, STARK_PRIVATE_KEY, 12345, other_id, *key), other_signature)
+
+        self.assertEqual(3, signer.discard_expired(expiration + 60))
+        stats = signer.get_stats()
+        self.assertEqual((1, 1, 0, 3), (stats['hits'], stats['misses'], stats['cached'], stats['expired']))
+
+        # a failed pre-sign falls back to signing the order now, with a new client id
+        failed = Future()
+        failed.set_exception(ValueError('worker died'))
+        signer._pending[key] = failed
+        client_id, signature = signer.sign(*key)
+        self.assertEqual(sign_order(1, STARK_PRIVATE_KEY, 12345, client_id, *key), signature)
+        self.assertEqual((1, 1), (signer.pending_hit_count, signer.miss_count))
+        signer.shutdown()
+
+    def test_use_http_client(self):
+        server = ThreadingHTTPServer(('localhost', 0), MarketsHandler)
+        Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            host = 'http://localhost:{}'.format(server.server_port)
+            http = HttpClient(host, headers=dict(dydx_requests.session.headers))
+            adapters = dict(dydx_requests.session.adapters)
+
+            # the requests of this client go through the pool, the dydx3 session and the other clients are untouched
+            client = Client(host=host)
+            other = Client(host=host)
+            dydx._use_http_client(client.public, dydx._request_function(http))
+            response = client.public.get_markets()
+            self.assertEqual({'markets': {}, 'contentType': 'application/json'}, response.data)
+            self.assertEqual(1, len(http.timings))
+            self.assertEqual(adapters, dydx_requests.session.adapters)
+            self.assertNotIn('_get', vars(other.public))
+            http.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_DydxManager_place_order_signature(self):
+        # the manager needs a connection to build, only the order entry is used
+        manager = dydx.DydxManager.__new__(dydx.DydxManager)
+        manager._instrument_static = {'BTC-USD': InstrumentDetails('BTC-USD', tick_size=1.0, quantity_size=0.001)}
+        manager._price_ticks = {}
+        manager._quantity_ticks = {}
+        manager._position_id = 12345
+        manager._open_orders = {}
+        manager._orders_lock = Lock()
+        manager._closed_orders = ClosedOrders()
+        manager._id_generator = OrderIdGenerator('test')
+        manager._signer = StarkOrderSigner(1, STARK_PRIVATE_KEY, manager._id_generator, executor=ThreadPoolExecutor(1))
+        manager._signer.position_id = 12345
+
+        sent = []
+
+        class Response:
+            def __init__(self, data):
+                self.data = data
+
+        class Private:
+            def create_order(self, **kwargs):
+                sent.append(kwargs)
+                return Response({'order': {'id': 'abc', 'market': kwargs['market'], 'side': kwargs['side'],
+                                           'remainingSize': kwargs['size'], 'price': kwargs['price'], 'type': 'LIMIT',
+                                           'createdAt': '2021-09-18T14:06:25.111Z'}})
+
+        manager._client_private = Private()
+        self.assertEqual(0.001, manager.get_quantity_size('BTC-USD'))
+
+        client_id = manager.place_order(NewOrderSingle('BTC-USD', Side.Sell, 0.01234, OrderType.Limit, price=40001.2))
+        order = sent[0]
+        self.assertEqual(client_id, order['client_id'])
+        self.assertEqual(('0.012', '40001'), (order['size'], order['price']))
+        self.assertEqual(0, order['expiration_epoch_seconds'] % 60)
+        self.assertEqual(sign_order(1, STARK_PRIVATE_KEY, 12345, client_id, 'BTC-USD', 'SELL', '0.012', '40001',
+                                    '0.001', order['expiration_epoch_seconds']), order['signature'])
+        self.assertEqual(1, manager.get_signing_stats()['misses'])
+        self.assertEqual(['abc'], list(manager._open_orders['BTC-USD']))
+        manager._signer.shutdown()
+
+    def test_DydxManager_snapshot_stitching(self):
+        # the manager needs a connection to build, only the account stream is used
+        manager = dydx.DydxManager.__new__(dydx.DydxManager)
+        manager._open_orders = {}
+        manager._positions = {}
+        manager._orders_lock = Lock()
+        manager._closed_orders = ClosedOrders()
+        manager._id_generator = OrderIdGenerator('test')
+        manager._execution_callback = None
+        manager._ready_check = dydx.ReadyCheck()
+        manager._snapshot_generation = 1
+        manager._snapshot_duration = DurationStats()
+        manager._account_buffer = []
+
+        order = {'id': 'abc', 'clientId': 'other-1', 'market': 'BTC-USD', 'side': 'BUY', 'size': '0.001',
+                 'remainingSize': '0.001', 'price': '30000', 'type': 'LIMIT', 'status': 'OPEN',
+                 'createdAt': '2021-09-18T14:06:25.111Z'}
+        manager._on_accounts({'type': 'channel_data', 'channel': 'v3_accounts',
+                              'contents': {'orders': [order], 'positions': [{'market': 'BTC-USD', 'size': '0.5'}]}})
+        manager._on_accounts({'type': 'channel_data', 'channel': 'v3_accounts',
+                              'contents': {'orders': [dict(order, status='CANCELED')]}})
+        self.assertEqual({}, manager._positions)
+
+        # the REST snapshot, older than the buffered events
+        manager._positions = {'BTC-USD': 0.1}
+        manager._open_orders = {'BTC-USD': {'abc': dydx.parse_order(order)}}
+        snapshot = Future()
+        snapshot.set_result(None)
+
+        # a superseded snapshot is ignored
+        manager._on_snapshot(0, 0, snapshot)
+        self.assertFalse(manager._ready_check.snapshot_ready)
+
+        manager._on_snapshot(1, 0, snapshot)
+        self.assertTrue(manager._ready_check.snapshot_ready)
+        self.assertIsNone(manager._account_buffer)
+        self.assertEqual({'BTC-USD': 0.5}, manager._positions)
+        self.assertEqual({}, manager._open_orders['BTC-USD'])
+        self.assertEqual(1, manager._snapshot_duration.get_count())
+
+    def test_DydxManager_book_feeds(self):
+        # the manager needs a connection to build, only the order books are used
+        manager = dydx.DydxManager.__new__(dydx.DydxManager)
+        manager._json_loads = json.loads
+        manager._orderbook_processors = {'BTC-USD': dydx.OrderBookProcessor('BTC-USD', depth=3, tick_size=1.0)}
+        manager._orderbooks = {}
+        manager._recovering = {}
+        manager._conflator = None
+        manager._dispatcher = None
+        manager._subscribers = SubscriberRegistry('test')
+        manager._ready_check = dydx.ReadyCheck()
+        manager._arbiter = FeedArbiter(2)
+        manager._lazy_books = False
+        books = []
+        manager._depth_callback = lambda symbol, book: books.append(book)
+        main = manager._init_router()
+        feed = manager._init_book_feed_router(1)
+
+        def snapshot(offset: int, price: int) -> str:
+            return json.dumps({'type': 'subscribed', 'id': 'BTC-USD', 'channel': 'v3_orderbook',
+                               'contents': {'bids': [{'price': str(price), 'size': '1', 'offset': str(offset)}],
+                                            'asks': [{'price': '50000', 'size': '1', 'offset': str(offset)}]}})
+
+        def update(offset: int, price: int) -> str:
+            return json.dumps({'type': 'channel_data', 'id': 'BTC-USD', 'channel': 'v3_orderbook',
+                               'contents': {'offset': str(offset), 'bids': [[str(price), '1']], 'asks': []}})
+
+        feed.route(snapshot(100, 40000))
+        main.route(snapshot(90, 39000))
+        self.assertTrue(manager._ready_check.depth_stream_ready)
+        self.assertEqual(40000, manager.get_ticker('BTC-USD').bids[0].price)
+
+        # each offset is applied once, from the first connection delivering it
+        main.route(update(101, 40001))
+        feed.route(update(101, 40001))
+        feed.route(update(102, 40002))
+        main.route(update(102, 40002))
+        self.assertEqual(3, len(books))
+        self.assertEqual([40002, 40001, 40000], [tier.price for tier in manager.get_ticker('BTC-USD').bids])
+
+        stats = manager._arbiter.get_stats()
+        self.assertEqual((2, 2), (stats['updates'], stats['duplicates']))
+        self.assertEqual((0.5, 0.5), (stats['feeds'][0]['win_rate'], stats['feeds'][1]['win_rate']))
@@ -1,7 +1,95 @@
 import unittest
+import asyncio
+import hmac
 import json
+import os
+import random
+import time
+import zlib
+from collections import deque
+from datetime import datetime, timezone
+import numpy as np
 import gateways.ftx.ftx as ftx
 from lib.interface import OrderBook, Tier, Order, Side, InstrumentDetails, NewOrderSingle, OrderType
+from lib.orderbook import OrderBookView, StaleOrderBookError, PriceTicks
+from lib.dispatcher import CallbackDispatcher
+from lib.subscribers import INLINE, THREADED, CONFLATED
+from lib.events import OrderEvent, OrderStatus
+from lib.json_decoder import JSON_DECODERS
+from lib.ws_protocol import BytesClientProtocol
+from lib.http_client import HttpClient
+from lib.identifier import OrderIdGenerator
+from lib.arbitration import FeedArbiter
+from lib.runtime import GatewayRuntime
+from lib.sharding import ShardedManager, shard_of, assign_shards
+from lib.order_entry import OrderResult
+from lib.leg_execution import LegExecutor, LegState, HedgeAction
+from concurrent.futures import Future
+import requests
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Thread, get_ident
+from websockets.frames import Frame, OP_TEXT, OP_CONT
+
+
+def load_orderbook_samples() -> [dict]:
+    """ Load the recorded order book messages from samples/orderbooks.txt """
+    messages = []
+    with open(os.path.join(os.path.dirname(__file__), 'samples', 'orderbooks.txt')) as f:
+        for line in f:
+            if 'Received: ' not in line:
+                continue
+            data = json.loads(line.split('Received: ', 1)[1])
+            if data.get('channel') == 'orderbook':
+                messages.append(data)
+    return messages
+
+
+def book_levels(order_book: OrderBook) -> ([tuple], [tuple]):
+    return [(t.price, t.size) for t in order_book.bids], [(t.price, t.size) for t in order_book.asks]
+
+
+def apply_to_dict(message: dict, book: dict, depth: int) -> ([tuple], [tuple]):
+    """ Apply a message to a plain {side: {price: size}} book and return the sorted top levels """
+    data = message['data']
+    if data['action'] == 'partial':
+        book.clear()
+    for side in ('bids', 'asks'):
+        levels = book.setdefault(side, {})
+        for price, size in data[side]:
+            if size:
+                levels[price] = size
+            else:
+                levels.pop(price, None)
+    return sorted(book['bids'].items(), reverse=True)[:depth], sorted(book['asks'].items())[:depth]
+
+
+class BufferedWebSocket:
+    """ Stands in for a websocket connection that has already received the given messages """
+    def __init__(self, messages: [str]):
+        self.messages = deque(messages)
+
+    async def recv(self) -> str:
+        return self.messages.popleft()
+
+
+class MarketsHandler(BaseHTTPRequestHandler):
+    """ Serves an empty list of markets over keep-alive connections """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = b'{"success": true, "result": []}'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
 
 
 class TestFtx(unittest.TestCase):
@@ -174,6 +262,7 @@ class TestFtx(unittest.TestCase):
         order_event = ftx.process_orders_ws(json.loads(message), store)
         self.assertFalse('BTC-PERP' in store)
         self.assertEqual(ftx.OrderStatus.MATCHED, order_event.status)
+        self.assertEqual(0.0001, order_event.filled_quantity)
 
 
     def test_process_orders_closed_unfilled(self):
@@ -335,3 +424,1037 @@ class TestFtx(unittest.TestCase):
 
         self.assertFalse(ftx.is_spot('BTC-PERP'))
 
+    def test_SortedOrderBookProcessor_equivalence(self):
+        messages = load_orderbook_samples()
+        self.assertTrue(len(messages) > 100)
+
+        for depth in (1, 5, 50, 1000):
+            reference = ftx.OrderBookProcessor('BTC-PERP', depth=depth)
+            processor = ftx.SortedOrderBookProcessor('BTC-PERP', depth=depth)
+            for message in messages:
+                reference.handle(message)
+                processor.handle(message)
+
+                expected = reference.get_orderbook()
+                order_book = processor.get_orderbook()
+                self.assertEqual(expected.timestamp, order_book.timestamp)
+                self.assertEqual(book_levels(expected), book_levels(order_book))
+
+    def test_SortedOrderBookProcessor_delete(self):
+        processor = ftx.SortedOrderBookProcessor('BTC-PERP')
+        self.assertFalse(processor.ready())
+        self.assertEqual(0, processor.get_orderbook())
+
+        message = '{"channel": "orderbook", "market": "BTC-PERP", "type": "partial", "data": {"time": 1.0, "checksum": 0, "bids": [[100, 0.01], [100.2, 0.03], [100.1, 0.02]], "asks": [[200.3, 0.08], [200.1, 0.06], [200.2, 0.07]], "action": "partial"}}'
+        processor.handle(json.loads(message))
+        self.assertTrue(processor.ready())
+        self.assertEqual(([(100.2, 0.03), (100.1, 0.02), (100, 0.01)], [(200.1, 0.06), (200.2, 0.07), (200.3, 0.08)]),
+                         book_levels(processor.get_orderbook()))
+
+        message = '{"channel": "orderbook", "market": "BTC-PERP", "type": "update", "data": {"time": 2.0, "checksum": 0, "bids": [[100.2, 0], [100.1, 0.5]], "asks": [[200.1, 0], [200.15, 0.1]], "action": "update"}}'
+        processor.handle(json.loads(message))
+        self.assertEqual(([(100.1, 0.5), (100, 0.01)], [(200.15, 0.1), (200.2, 0.07), (200.3, 0.08)]),
+                         book_levels(processor.get_orderbook()))
+
+        # a new partial replaces the book
+        message = '{"channel": "orderbook", "market": "BTC-PERP", "type": "partial", "data": {"time": 3.0, "checksum": 0, "bids": [[99, 1]], "asks": [], "action": "partial"}}'
+        processor.handle(json.loads(message))
+        self.assertEqual(([(99, 1)], []), book_levels(processor.get_orderbook()))
+
+    def test_FtxManager_book_type(self):
+        manager = ftx.FtxManager('BTC-PERP', book_type='sorted')
+        self.assertIsInstance(manager._orderbook_processors['BTC-PERP'], ftx.SortedOrderBookProcessor)
+
+        manager = ftx.FtxManager('BTC-PERP')
+        self.assertIsInstance(manager._orderbook_processors['BTC-PERP'], ftx.OrderBookProcessor)
+
+        with self.assertRaises(ValueError):
+            ftx.FtxManager('BTC-PERP', book_type='unknown')
+
+    def test_OrderBookProcessor_changed(self):
+        messages = load_orderbook_samples()
+
+        for processor_class in (ftx.OrderBookProcessor, ftx.SortedOrderBookProcessor):
+            processor = processor_class('BTC-PERP', depth=5)
+            book = {}
+            previous = None
+            unchanged_count = 0
+            for message in messages:
+                processor.handle(message)
+                expected = apply_to_dict(message, book, 5)
+
+                order_book = processor.get_orderbook()
+                self.assertEqual(expected, book_levels(order_book))
+
+                if not processor.changed:
+                    # the previous order book object is reused
+                    self.assertIs(previous, order_book)
+                    unchanged_count += 1
+                previous = order_book
+
+            # the samples have updates that only touched levels beyond the top 5
+            self.assertTrue(unchanged_count > 0)
+
+    def test_FtxManager_skip_invisible_update(self):
+        messages = load_orderbook_samples()
+
+        manager = ftx.FtxManager('BTC-PERP', book_type='sorted')
+        books = []
+        manager.register_depth_callback(lambda contract_name, book: books.append(book))
+
+        changed_count = 0
+        for message in messages:
+            manager._process_websocket_message(json.dumps(message))
+            if manager._orderbook_processors['BTC-PERP'].changed:
+                changed_count += 1
+            self.assertIs(books[-1], manager.get_ticker('BTC-PERP'))
+
+        self.assertEqual(changed_count, len(books))
+        self.assertTrue(len(books) < len(messages))
+
+    def test_OrderBookProcessor_tick_size(self):
+        messages = load_orderbook_samples()
+
+        for processor_class in (ftx.OrderBookProcessor, ftx.SortedOrderBookProcessor):
+            processor = processor_class('BTC-PERP', depth=5, tick_size=1.0)
+            book = {}
+            for message in messages:
+                processor.handle(message)
+                self.assertEqual(apply_to_dict(message, book, 5), book_levels(processor.get_orderbook()))
+
+        # fractional tick size, prices are converted back without float error
+        processor = ftx.SortedOrderBookProcessor('ETH-PERP', tick_size=0.1)
+        message = '{"channel": "orderbook", "market": "ETH-PERP", "type": "partial", "data": {"time": 1.0, "checksum": 0, "bids": [[3109.1, 1.0], [3108.7, 2.0]], "asks": [[3109.2, 3.0]], "action": "partial"}}'
+        processor.handle(json.loads(message))
+        self.assertEqual(31091, processor._bids.best())
+        self.assertEqual(([(3109.1, 1.0), (3108.7, 2.0)], [(3109.2, 3.0)]), book_levels(processor.get_orderbook()))
+
+    def test_FtxManager_set_book_tick_sizes(self):
+        manager = ftx.FtxManager('BTC-PERP', book_type='sorted')
+        manager._instrument_static['BTC-PERP'] = InstrumentDetails('BTC-PERP', tick_size=1.0, quantity_size=0.0001)
+        manager._set_book_tick_sizes()
+        self.assertEqual(1.0, manager._orderbook_processors['BTC-PERP']._ticks.tick_size)
+
+    def test_LadderOrderBookProcessor_equivalence(self):
+        messages = load_orderbook_samples()
+
+        # small capacities force recentering and levels in the overflow
+        for capacity in (16, 64, 4096):
+            processor = ftx.LadderOrderBookProcessor('BTC-PERP', depth=5, tick_size=1.0, capacity=capacity)
+            book = {}
+            for message in messages:
+                processor.handle(message)
+                self.assertEqual(apply_to_dict(message, book, 5), book_levels(processor.get_orderbook()))
+
+    def test_LadderOrderBookProcessor_drifting_book(self):
+        """ A book that walks away from the initial window is recentred and stays equal to the reference """
+        rng = random.Random(7)
+        reference = ftx.OrderBookProcessor('ETH-PERP', depth=10, tick_size=0.1)
+        processor = ftx.LadderOrderBookProcessor('ETH-PERP', depth=10, tick_size=0.1, capacity=128)
+
+        mid = 3000.0
+        bids = {}
+        asks = {}
+        for i in range(2000):
+            mid = round(mid + rng.choice((-0.3, -0.1, 0, 0.1, 0.3)), 1)
+            update_bids = []
+            update_asks = []
+            for _ in range(rng.randint(1, 4)):
+                price = round(mid - 0.1 * rng.randint(1, 40), 1)
+                size = 0 if price in bids and rng.random() < 0.5 else round(rng.random(), 4) or 0.1
+                if size or price in bids:
+                    update_bids.append([price, size])
+                    bids[price] = size
+                    if not size:
+                        del bids[price]
+                price = round(mid + 0.1 * rng.randint(1, 40), 1)
+                size = 0 if price in asks and rng.random() < 0.5 else round(rng.random(), 4) or 0.1
+                if size or price in asks:
+                    update_asks.append([price, size])
+                    asks[price] = size
+                    if not size:
+                        del asks[price]
+
+            # remove levels crossed by the new mid
+            for price in [p for p in bids if p >= mid]:
+                update_bids.append([price, 0])
+                del bids[price]
+            for price in [p for p in asks if p <= mid]:
+                update_asks.append([price, 0])
+                del asks[price]
+
+            message = {'market': 'ETH-PERP', 'data': {'time': i + 1.0, 'bids': update_bids, 'asks': update_asks,
+                                                      'action': 'partial' if i == 0 else 'update'}}
+            reference.handle(message)
+            processor.handle(message)
+            self.assertEqual(book_levels(reference.get_orderbook()), book_levels(processor.get_orderbook()))
+
+            # deep reads cover the overflow levels as well
+            expected = np.cumsum([size for _, size in sorted(bids.items(), reverse=True)[:50]])
+            self.assertEqual(expected.tolist(), processor.get_cumulative_depth('bids', 50).tolist())
+
+        self.assertTrue(processor._ladder.recenter_count > 0)
+
+    def test_LadderOrderBookProcessor_wide_spread(self):
+        """ A spread wider than the window between its margins does not recentre the ladder on every update """
+        reference = ftx.OrderBookProcessor('BTC-PERP', depth=5, tick_size=1.0)
+        processor = ftx.LadderOrderBookProcessor('BTC-PERP', depth=5, tick_size=1.0, capacity=64)
+        message = {'market': 'BTC-PERP', 'data': {'time': 1.0, 'action': 'partial',
+                                                  'bids': [[100, 1.0], [99, 1.0], [60, 1.0]],
+                                                  'asks': [[155, 1.0], [156, 1.0], [200, 1.0]]}}
+        reference.handle(message)
+        processor.handle(message)
+        recenter_count = processor._ladder.recenter_count
+
+        # the best bid and ask move back and forth by a tick, the mid with them
+        for i in range(200):
+            bid, ask = (100, 155) if i % 2 else (101, 154)
+            message = {'market': 'BTC-PERP', 'data': {'time': i + 2.0, 'action': 'update',
+                                                      'bids': [[101, 0 if i % 2 else 1.0]],
+                                                      'asks': [[154, 0 if i % 2 else 1.0]]}}
+            reference.handle(message)
+            processor.handle(message)
+            self.assertEqual(book_levels(reference.get_orderbook()), book_levels(processor.get_orderbook()))
+            order_book = processor.get_orderbook()
+            self.assertEqual((bid, ask), (order_book.bids[0].price, order_book.asks[0].price))
+        self.assertTrue(processor._ladder.recenter_count - recenter_count <= 1)
+
+    def test_LadderOrderBookProcessor_cumulative_depth(self):
+        processor = ftx.LadderOrderBookProcessor('BTC-PERP', depth=5, tick_size=1.0)
+        message = '{"channel": "orderbook", "market": "BTC-PERP", "type": "partial", "data": {"time": 1.0, "checksum": 0, "bids": [[100, 1.0], [99, 2.0], [97, 3.0]], "asks": [[101, 0.5], [103, 1.5]], "action": "partial"}}'
+        processor.handle(json.loads(message))
+
+        self.assertEqual([1.0, 3.0, 6.0], processor.get_cumulative_depth('bids').tolist())
+        self.assertEqual([0.5], processor.get_cumulative_depth('asks', 1).tolist())
+
+        manager = ftx.FtxManager('BTC-PERP', book_type='ladder')
+        self.assertIsInstance(manager._orderbook_processors['BTC-PERP'], ftx.LadderOrderBookProcessor)
+
+    def test_OrderBookView(self):
+        messages = load_orderbook_samples()
+
+        for processor_class in (ftx.SortedOrderBookProcessor, ftx.LadderOrderBookProcessor):
+            processor = processor_class('BTC-PERP', depth=5, tick_size=1.0, lazy=True)
+            book = {}
+            for message in messages:
+                processor.handle(message)
+                expected = apply_to_dict(message, book, 5)
+
+                view = processor.get_orderbook()
+                self.assertIsInstance(view, OrderBookView)
+                self.assertEqual(expected[0][0], (view.bids[0].price, view.bids[0].size))
+                self.assertEqual(expected[1][0], (view.asks[0].price, view.asks[0].size))
+                self.assertEqual(5, len(view.bids))
+                self.assertEqual(expected, book_levels(view))
+
+    def test_OrderBookView_stale(self):
+        processor = ftx.SortedOrderBookProcessor('BTC-PERP', depth=5, lazy=True)
+        message = '{"channel": "orderbook", "market": "BTC-PERP", "type": "partial", "data": {"time": 1.0, "checksum": 0, "bids": [[100, 1.0], [99, 2.0]], "asks": [[101, 0.5], [102, 1.5]], "action": "partial"}}'
+        processor.handle(json.loads(message))
+        view = processor.get_orderbook()
+
+        # a change in the visible levels
+        message = '{"channel": "orderbook", "market": "BTC-PERP", "type": "update", "data": {"time": 2.0, "checksum": 0, "bids": [[100, 0]], "asks": [], "action": "update"}}'
+        processor.handle(json.loads(message))
+        self.assertFalse(view.is_current())
+
+        # top of book is kept, deeper levels can no longer be read
+        self.assertEqual(100, view.bids[0].price)
+        self.assertEqual(101, view.asks[0].price)
+        with self.assertRaises(StaleOrderBookError):
+            view.bids[1]
+
+        # a snapshot is a frozen copy
+        snapshot = processor.get_orderbook().snapshot()
+        self.assertNotIsInstance(snapshot, OrderBookView)
+        message = '{"channel": "orderbook", "market": "BTC-PERP", "type": "update", "data": {"time": 3.0, "checksum": 0, "bids": [], "asks": [[101, 0]], "action": "update"}}'
+        processor.handle(json.loads(message))
+        self.assertEqual(([(99, 2.0)], [(101, 0.5), (102, 1.5)]), book_levels(snapshot))
+        self.assertEqual(([(99, 2.0)], [(102, 1.5)]), book_levels(processor.get_orderbook()))
+
+    def test_FtxManager_lazy_books(self):
+        manager = ftx.FtxManager('BTC-PERP', book_type='sorted', lazy_books=True)
+        for message in load_orderbook_samples():
+            manager._process_websocket_message(json.dumps(message))
+        view = manager._orderbooks['BTC-PERP']
+        self.assertIsInstance(view, OrderBookView)
+
+        # the ticker is a frozen top of book, safe to read from any thread
+        book = manager.get_ticker('BTC-PERP')
+        self.assertNotIsInstance(book, OrderBookView)
+        self.assertEqual(([view.bids[0]], [view.asks[0]]), (book.bids, book.asks))
+
+        with self.assertRaises(ValueError):
+            ftx.FtxManager('BTC-PERP', book_type='dict', lazy_books=True)
+
+    def test_delta_callback(self):
+        messages = load_orderbook_samples()
+
+        for processor_class in (ftx.OrderBookProcessor, ftx.SortedOrderBookProcessor, ftx.LadderOrderBookProcessor):
+            deltas = []
+            processor = processor_class('BTC-PERP', depth=5)
+            processor.delta_callback = lambda symbol, delta: deltas.append((symbol, delta))
+
+            # replaying the deltas on a plain book gives the same book as the processor
+            book = {}
+            for message in messages:
+                processor.handle(message)
+                symbol, delta = deltas[-1]
+                self.assertEqual('BTC-PERP', symbol)
+                self.assertEqual(message['data']['time'], delta.timestamp)
+                self.assertEqual(message['data']['action'] == 'partial', delta.snapshot)
+
+                if delta.snapshot:
+                    book = {Side.Buy: {}, Side.Sell: {}}
+                for side, price, size in delta.levels:
+                    if size:
+                        book[side][price] = size
+                    else:
+                        book[side].pop(price, None)
+
+                expected = sorted(book[Side.Buy].items(), reverse=True)[:5], sorted(book[Side.Sell].items())[:5]
+                self.assertEqual(expected, book_levels(processor.get_orderbook()))
+            self.assertEqual(len(messages), len(deltas))
+
+    def test_FtxManager_register_delta_callback(self):
+        deltas = []
+        manager = ftx.FtxManager('BTC-PERP', book_type='sorted')
+        manager.register_delta_callback(lambda symbol, delta: deltas.append(delta))
+
+        message = '{"channel": "orderbook", "market": "BTC-PERP", "type": "partial", "data": {"time": 1.0, "checksum": 0, "bids": [[100, 0.01]], "asks": [[200.3, 0.08]], "action": "partial"}}'
+        manager._process_websocket_message(message)
+        message = '{"channel": "orderbook", "market": "BTC-PERP", "type": "update", "data": {"time": 2.0, "checksum": 0, "bids": [[100, 0]], "asks": [], "action": "update"}}'
+        manager._process_websocket_message(message)
+
+        self.assertEqual(2, len(deltas))
+        self.assertTrue(deltas[0].snapshot)
+        self.assertEqual([(Side.Buy, 100, 0.01), (Side.Sell, 200.3, 0.08)], deltas[0].levels)
+        self.assertFalse(deltas[1].snapshot)
+        self.assertEqual([(Side.Buy, 100, 0)], deltas[1].levels)
+
+        with self.assertRaises(AssertionError):
+            manager.register_delta_callback(lambda delta: None)
+
+    def test_FtxManager_conflate(self):
+        messages = [json.dumps(message) for message in load_orderbook_samples()]
+
+        books = []
+        manager = ftx.FtxManager('BTC-PERP', book_type='sorted', conflate=True)
+        manager.register_depth_callback(lambda contract_name, book: books.append(book))
+        reference = ftx.SortedOrderBookProcessor('BTC-PERP')
+
+        # the first message is received, the others are already buffered
+        manager._ws = BufferedWebSocket(messages[1:])
+        manager._process_websocket_message(messages[0])
+        manager._loop.run_until_complete(manager._drain_buffered_messages())
+        for message in messages:
+            reference.handle(json.loads(message))
+
+        # every update is applied but the book is published once
+        self.assertEqual(1, len(books))
+        self.assertEqual(book_levels(reference.get_orderbook()), book_levels(books[0]))
+        self.assertIs(books[0], manager.get_ticker('BTC-PERP'))
+
+        stats = manager.get_conflation_stats()
+        self.assertEqual(1, stats['batches'])
+        self.assertEqual(len(messages), stats['messages'])
+        self.assertEqual(stats['updates'] - 1, stats['conflated'])
+
+        # a batch is bounded, the remaining messages are left for the next batch
+        manager._conflator.max_batch = 10
+        manager._ws = BufferedWebSocket(messages)
+        manager._process_websocket_message(manager._ws.messages.popleft())
+        manager._loop.run_until_complete(manager._drain_buffered_messages())
+        self.assertEqual(len(messages) - 10, len(manager._ws.messages))
+        self.assertEqual(2, len(books))
+
+        self.assertEqual({}, ftx.FtxManager('BTC-PERP').get_conflation_stats())
+
+    def test_FtxManager_dispatcher(self):
+        messages = [json.dumps(message) for message in load_orderbook_samples()]
+
+        dispatched = []
+        dispatcher = CallbackDispatcher()
+        manager = ftx.FtxManager('BTC-PERP', book_type='sorted', dispatcher=dispatcher)
+        manager.register_depth_callback(lambda contract_name, book: dispatched.append(book))
+        manager.register_execution_callback(lambda event: dispatched.append(event))
+
+        # nothing is dispatched until the consumer thread runs, the latest book replaces the previous ones
+        changed = 0
+        for message in messages:
+            manager._process_websocket_message(message)
+            changed += manager._orderbook_processors['BTC-PERP'].changed
+        dispatcher.submit_event(manager._execution_callback, 'event 1')
+        dispatcher.submit_event(manager._execution_callback, 'event 2')
+        self.assertEqual([], dispatched)
+        self.assertEqual(3, dispatcher.queue_depth())
+        self.assertEqual(changed - 1, dispatcher.metrics.dropped_books)
+
+        # execution events are never dropped and are dispatched in order, before the books
+        dispatcher.start()
+        dispatcher.stop()
+        self.assertEqual(['event 1', 'event 2', manager.get_ticker('BTC-PERP')], dispatched)
+        self.assertEqual(1, dispatcher.metrics.dispatched_books)
+        self.assertEqual(2, dispatcher.metrics.dispatched_events)
+        self.assertEqual(0, dispatcher.queue_depth())
+
+        with self.assertRaises(ValueError):
+            ftx.FtxManager('BTC-PERP', book_type='sorted', lazy_books=True, dispatcher=dispatcher)
+
+    def test_FtxManager_subscribers(self):
+        messages = [json.dumps(message) for message in load_orderbook_samples()]
+
+        inline, filtered, threaded, conflated = [], [], [], []
+        manager = ftx.FtxManager('BTC-PERP', book_type='sorted')
+        manager.add_depth_subscriber(lambda contract_name, book: inline.append(book))
+        manager.add_depth_subscriber(lambda contract_name, book: filtered.append(book), symbols={'ETH-PERP'})
+        threaded_subscriber = manager.add_depth_subscriber(lambda contract_name, book: threaded.append(book), policy=THREADED)
+        conflated_subscriber = manager.add_depth_subscriber(lambda contract_name, book: conflated.append(book), policy=CONFLATED, symbols='BTC-PERP')
+
+        for message in messages:
+            manager._process_websocket_message(message)
+
+        # pending callbacks are dispatched before the subscriber threads stop
+        manager.remove_subscriber(threaded_subscriber)
+        manager.remove_subscriber(conflated_subscriber)
+
+        self.assertTrue(len(inline) > 1)
+        self.assertEqual([], filtered)
+        self.assertEqual(inline, threaded)
+        self.assertTrue(1 <= len(conflated) <= len(inline))
+        self.assertIs(manager.get_ticker('BTC-PERP'), conflated[-1])
+
+        # execution events are never conflated
+        events = []
+        subscriber = manager.add_execution_subscriber(lambda event: events.append(event), policy=CONFLATED)
+        for order_id in range(3):
+            manager._subscribers.publish_event(OrderEvent('BTC-PERP', str(order_id), OrderStatus.OPEN))
+        manager.remove_subscriber(subscriber)
+        self.assertEqual(['0', '1', '2'], [event.order_id for event in events])
+
+        with self.assertRaises(ValueError):
+            manager.add_depth_subscriber(lambda contract_name, book: None, policy='unknown')
+
+        manager = ftx.FtxManager('BTC-PERP', book_type='sorted', lazy_books=True)
+        manager.add_depth_subscriber(lambda contract_name, book: None, policy=INLINE)
+        with self.assertRaises(ValueError):
+            manager.add_depth_subscriber(lambda contract_name, book: None, policy=THREADED)
+
+    def test_FtxManager_json_decoder(self):
+        messages = [json.dumps(message) for message in load_orderbook_samples()]
+
+        reference = ftx.FtxManager('BTC-PERP', book_type='sorted')
+        for message in messages:
+            reference._process_websocket_message(message)
+
+        # every installed decoder gives the same book, from str or from the frame bytes
+        for name in list(JSON_DECODERS) + ['auto']:
+            manager = ftx.FtxManager('BTC-PERP', book_type='sorted', json_decoder=name, bytes_frames=True)
+            for message in messages:
+                manager._process_websocket_message(message.encode())
+            self.assertEqual(book_levels(reference.get_ticker('BTC-PERP')), book_levels(manager.get_ticker('BTC-PERP')))
+
+        manager = ftx.FtxManager('BTC-PERP', json_decoder=json.loads)
+        manager._process_websocket_message(messages[0])
+        self.assertTrue(manager._orderbook_processors['BTC-PERP'].ready())
+
+        with self.assertRaises(ValueError):
+            ftx.FtxManager('BTC-PERP', json_decoder='unknown')
+
+    def test_BytesClientProtocol(self):
+        frames = deque([Frame(fin=True, opcode=OP_TEXT, data=b'{"channel": "orderbook"}'),
+                        Frame(fin=False, opcode=OP_TEXT, data=b'{"channel": '),
+                        Frame(fin=True, opcode=OP_CONT, data=b'"fragmented"}')])
+
+        async def read_data_frame(max_size):
+            return frames.popleft()
+
+        # read the frames without a connection
+        protocol = BytesClientProtocol.__new__(BytesClientProtocol)
+        protocol.max_size = 2 ** 20
+        protocol.read_data_frame = read_data_frame
+
+        loop = asyncio.new_event_loop()
+        try:
+            self.assertEqual(b'{"channel": "orderbook"}', loop.run_until_complete(protocol.read_message()))
+            self.assertEqual(b'{"channel": "fragmented"}', loop.run_until_complete(protocol.read_message()))
+        finally:
+            loop.close()
+
+    def test_FtxManager_message_router(self):
+        decoded = []
+
+        def loads(message):
+            decoded.append(message)
+            return json.loads(message)
+
+        manager = ftx.FtxManager('BTC-PERP', book_type='sorted', json_decoder=loads)
+        messages = [json.dumps(message) for message in load_orderbook_samples()]
+        for message in messages:
+            manager._process_websocket_message(message)
+        manager._process_websocket_message('{"type": "pong"}')
+        manager._process_websocket_message(b'{"type": "pong"}')
+        manager._process_websocket_message('{"type": "subscribed", "channel": "orders"}')
+        manager._process_websocket_message('{"type": "info", "code": 20001, "msg": "Server restarting"}')
+
+        # only the messages that are used are decoded
+        self.assertEqual(len(messages) + 1, len(decoded))
+        self.assertTrue(manager._ready_check.orders_stream_ready)
+        self.assertEqual({'orderbook': len(messages), 'pong': 2, 'subscribed': 1, 'other': 1}, manager._router.get_counts())
+        self.assertEqual({'orderbook', 'pong', 'subscribed', 'other'}, set(manager.get_message_rates()))
+
+    def test_FtxManager_place_order_async(self):
+        manager = ftx.FtxManager('BTC-PERP', order_workers=4)
+        manager._instrument_static['BTC-PERP'] = InstrumentDetails('BTC-PERP', tick_size=1.0, quantity_size=0.0001)
+
+        def post(method, data):
+            # stands in for the HTTP round trip
+            time.sleep(0.2)
+            return {'success': data['side'] == 'buy'}
+
+        manager._private_request_post = post
+        buy = NewOrderSingle('BTC-PERP', Side.Buy, 0.001, OrderType.Limit, price=30000)
+        sell = NewOrderSingle('BTC-PERP', Side.Sell, 0.001, OrderType.Limit, price=40000)
+
+        # orders submitted from this thread are in flight concurrently
+        start = time.time()
+        futures = [manager.submit_order(buy), manager.submit_order(buy), manager.submit_order(buy), manager.submit_order(sell)]
+        results = [future.result() for future in futures]
+        self.assertTrue(time.time() - start < 0.6)
+        self.assertTrue(all(results[:3]))
+        self.assertEqual(3, len(set(results[:3])))
+        self.assertIsNone(results[3])
+
+        # awaited from a coroutine
+        async def place_both():
+            return await asyncio.gather(manager.place_order_async(buy), manager.place_order_async(buy))
+
+        loop = asyncio.new_event_loop()
+        try:
+            start = time.time()
+            results = loop.run_until_complete(place_both())
+            self.assertTrue(time.time() - start < 0.4)
+            self.assertTrue(all(results))
+        finally:
+            loop.close()
+
+    def test_FtxManager_place_order_signed(self):
+        manager = ftx.FtxManager('BTC-PERP', api_key='key', api_secret='secret')
+        manager._instrument_static['BTC-PERP'] = InstrumentDetails('BTC-PERP', tick_size=1.0, quantity_size=0.0001)
+
+        class Response:
+            def json(self):
+                return {'success': True}
+
+        sent = []
+
+        class Http:
+            def send(self, prepared):
+                sent.append(prepared)
+                return Response()
+
+        manager._http = Http()
+        client_id = manager.place_order(NewOrderSingle('BTC-PERP', Side.Buy, 0.00123, OrderType.Limit, price=30000))
+        self.assertIsNotNone(client_id)
+
+        # the body is serialized once and signed as sent
+        prepared, = sent
+        self.assertEqual('/api/orders', prepared.path_url)
+        self.assertEqual(0.0012, json.loads(prepared.body)['size'])
+        self.assertEqual(client_id, json.loads(prepared.body)['clientId'])
+        payload = (prepared.headers['FTX-TS'] + 'POST/api/orders').encode() + prepared.body
+        self.assertEqual(hmac.new(b'secret', payload, 'sha256').hexdigest(), prepared.headers['FTX-SIGN'])
+        self.assertEqual('key', prepared.headers['FTX-KEY'])
+        self.assertEqual('application/json', prepared.headers['Content-Type'])
+        self.assertEqual(0.0001, manager.get_quantity_size('BTC-PERP'))
+
+    def test_FtxManager_batch_orders(self):
+        manager = ftx.FtxManager('BTC-PERP', order_workers=10)
+        manager._instrument_static['BTC-PERP'] = InstrumentDetails('BTC-PERP', tick_size=1.0, quantity_size=0.0001)
+        order_ids = iter(range(1, 100))
+
+        def post(method, data):
+            # stands in for the HTTP round trip
+            time.sleep(0.1)
+            if data['price'] == 30009:
+                return {'success': False, 'error': 'Not enough balances'}
+            return {'success': True, 'result': {'id': next(order_ids), 'market': data['market'], 'side': data['side'],
+                                                'price': data['price'], 'size': data['size'], 'type': 'limit',
+                                                'createdAt': '2021-09-09T15:48:04.320464+00:00'}}
+
+        deleted = []
+
+        def delete(method, data=None):
+            time.sleep(0.1)
+            deleted.append((method, data))
+            return {'success': method != '/orders/3', 'result': 'Order queued for cancellation'}
+
+        manager._private_request_post = post
+        manager._private_request_delete = delete
+
+        # a ladder of 10 quotes in one round trip
+        start = time.time()
+        orders = [NewOrderSingle('BTC-PERP', Side.Buy, 0.001, OrderType.Limit, price=30000 + i) for i in range(10)]
+        results = manager.place_orders(orders)
+        self.assertTrue(time.time() - start < 0.3)
+        self.assertEqual([True] * 9 + [False], [result.success for result in results])
+        self.assertEqual('Not enough balances', results[9].error)
+        self.assertIsNone(results[9].client_id)
+        self.assertEqual(9, len(set(result.client_id for result in results[:9])))
+        placed = sorted(result.order_id for result in results[:9])
+        self.assertEqual(placed, sorted(order.order_id for order in manager.get_orders('BTC-PERP')))
+
+        # the failed cancel is restored
+        results = manager.cancel_orders('BTC-PERP', placed[:5])
+        self.assertEqual([True, True, False, True, True], [result.success for result in results])
+        self.assertEqual(placed[2:3] + placed[5:], sorted(order.order_id for order in manager.get_orders('BTC-PERP')))
+
+        # an order closed on the websocket before its order entry response is not stored
+        manager._on_orders({'channel': 'orders', 'type': 'update',
+                            'data': {'id': 10, 'clientId': 'other-1', 'market': 'BTC-PERP', 'type': 'limit', 'side': 'buy',
+                                     'price': 30000.0, 'size': 0.001, 'status': 'closed', 'filledSize': 0.0,
+                                     'createdAt': '2021-09-09T14:47:17.792437+00:00'}})
+        self.assertTrue(manager.place_orders(orders[:1])[0].success)
+        self.assertEqual(5, len(manager.get_orders('BTC-PERP')))
+
+        self.assertTrue(manager.cancel_all_orders('BTC-PERP').success)
+        self.assertEqual(('/orders', {'market': 'BTC-PERP'}), deleted[-1])
+        self.assertEqual([], manager.get_orders('BTC-PERP'))
+
+    def test_FtxManager_reconnect_snapshot(self):
+        manager = ftx.FtxManager('BTC-PERP', api_key='key', api_secret='secret')
+
+        async def connect():
+            manager._ws = object()
+
+        async def subscribe():
+            pass
+
+        requests = []
+
+        def get_positions():
+            # stands in for the REST round trips
+            requests.append(time.time())
+            time.sleep(0.2)
+            manager._positions = {'BTC-PERP': 1.0}
+
+        manager._connect_authenticate_ws = connect
+        manager._subscribe_all = subscribe
+        manager._get_positions = get_positions
+        manager._get_wallet_balances = lambda: None
+        manager._get_orders = lambda: None
+
+        def fill(size: float, fill_time: float) -> dict:
+            timestamp = datetime.fromtimestamp(fill_time, timezone.utc).isoformat()
+            return {'channel': 'fills', 'type': 'update',
+                    'data': {'market': 'BTC-PERP', 'side': 'buy', 'size': size, 'time': timestamp}}
+
+        async def reconnect():
+            # the loop is not blocked by the snapshots
+            start = time.time()
+            await manager._reconnect_ws()
+            self.assertTrue(time.time() - start < 0.1)
+
+            # already in the snapshot, during the request so the positions are requested again, and after it
+            manager._on_fills(fill(0.5, time.time() - 10))
+            manager._on_fills(fill(0.125, time.time()))
+            manager._on_fills(fill(0.25, time.time() + 10))
+            manager._on_orders({'channel': 'orders', 'type': 'update',
+                                'data': {'id': 1, 'clientId': 'other-1', 'market': 'BTC-PERP', 'type': 'limit',
+                                         'side': 'buy', 'price': 30000.0, 'size': 0.001, 'status': 'new',
+                                         'createdAt': '2021-09-09T14:47:17.792437+00:00'}})
+            self.assertFalse(manager._ready_check.snapshot_ready)
+            self.assertEqual({}, manager._positions)
+
+            while not manager._ready_check.snapshot_ready:
+                await asyncio.sleep(0.01)
+
+        loop = asyncio.new_event_loop()
+        manager._loop = loop
+        try:
+            loop.run_until_complete(reconnect())
+        finally:
+            loop.close()
+
+        # the fill during the first request is in the second snapshot
+        self.assertEqual(2, len(requests))
+        self.assertEqual({'BTC-PERP': 1.25}, manager._positions)
+        self.assertEqual(['1'], [order.order_id for order in manager.get_orders('BTC-PERP')])
+        self.assertEqual(1, manager.get_reconnect_stats()['snapshot']['count'])
+        self.assertTrue(manager.get_reconnect_stats()['snapshot']['max_ms'] >= 400)
+
+    def test_FtxManager_book_recovery(self):
+        manager = ftx.FtxManager({'BTC-PERP', 'ETH-PERP'})
+
+        def book(market: str, action: str, bids: list) -> str:
+            return json.dumps({'channel': 'orderbook', 'market': market, 'type': action,
+                               'data': {'action': action, 'time': 1.0, 'checksum': 0, 'bids': bids,
+                                        'asks': [[50000.0, 1.0]]}})
+
+        class WebSocket:
+            """ Replays the frames, then stops the listener """
+            def __init__(self, frames):
+                self.frames = deque(frames)
+                self.sent = []
+
+            async def recv(self):
+                if not self.frames:
+                    raise asyncio.CancelledError()
+                return self.frames.popleft()
+
+            async def send(self, message):
+                self.sent.append(json.loads(message))
+
+        ws = WebSocket([book('BTC-PERP', 'partial', [[40000.0, 1.0]]),
+                        book('ETH-PERP', 'partial', [[3000.0, 1.0]]),
+                        # a bad level fails the BTC-PERP book only
+                        book('BTC-PERP', 'update', [[40001.0]]),
+                        book('BTC-PERP', 'update', [[40002.0, 1.0]]),
+                        json.dumps({'type': 'unsubscribed', 'channel': 'orderbook', 'market': 'BTC-PERP'}),
+                        book('ETH-PERP', 'update', [[3001.0, 2.0]]),
+                        book('BTC-PERP', 'partial', [[39999.0, 3.0]])])
+        manager._ws = ws
+
+        loop = asyncio.new_event_loop()
+        try:
+            with self.assertRaises(asyncio.CancelledError):
+                loop.run_until_complete(manager._listen_forever())
+        finally:
+            loop.close()
+
+        # the connection is kept, only the failed book is resubscribed
+        self.assertIs(ws, manager._ws)
+        self.assertEqual([{'op': 'unsubscribe', 'channel': 'orderbook', 'market': 'BTC-PERP'},
+                          {'op': 'subscribe', 'channel': 'orderbook', 'market': 'BTC-PERP'}], ws.sent)
+        self.assertEqual(3001.0, manager.get_ticker('ETH-PERP').bids[0].price)
+        self.assertEqual(39999.0, manager.get_ticker('BTC-PERP').bids[0].price)
+
+        stats = manager.get_recovery_stats()
+        self.assertEqual(['BTC-PERP'], list(stats))
+        self.assertEqual((1, 1), (stats['BTC-PERP']['failures'], stats['BTC-PERP']['count']))
+
+    def test_FeedArbiter(self):
+        arbiter = FeedArbiter(2, window=3)
+        arbiter.feed_up(0)
+        arbiter.feed_up(1)
+
+        # updates are dropped until the first snapshot, the snapshot of the other feed is dropped
+        self.assertFalse(arbiter.accept(0, 'BTC-PERP', 1))
+        self.assertTrue(arbiter.accept_snapshot(1, 'BTC-PERP', 1))
+        self.assertFalse(arbiter.accept_snapshot(0, 'BTC-PERP', 1))
+
+        # each update is accepted once, from the first feed
+        self.assertTrue(arbiter.accept(1, 'BTC-PERP', 2, (2, 'a')))
+        self.assertFalse(arbiter.accept(0, 'BTC-PERP', 2, (2, 'a')))
+        self.assertTrue(arbiter.accept(0, 'BTC-PERP', 2, (2, 'b')))
+        self.assertTrue(arbiter.accept(0, 'BTC-PERP', 3, (3, 'c')))
+        self.assertFalse(arbiter.accept(1, 'BTC-PERP', 2, (2, 'b')))
+        self.assertFalse(arbiter.accept(1, 'BTC-PERP', 3, (3, 'c')))
+
+        # a copy that has left the window is still rejected by its sequence
+        for sequence in range(4, 8):
+            self.assertTrue(arbiter.accept(0, 'BTC-PERP', sequence))
+        self.assertFalse(arbiter.accept(1, 'BTC-PERP', 4))
+
+        stats = arbiter.get_stats()
+        self.assertEqual((7, 3), (stats['updates'], stats['duplicates']))
+        self.assertEqual((1, 1 / 7, 1, 1), (stats['feeds'][1]['wins'], stats['feeds'][1]['win_rate'],
+                                           stats['feeds'][1]['lead']['count'], stats['feeds'][1]['stale']))
+        self.assertEqual((6, 2, 0), (stats['feeds'][0]['wins'], stats['feeds'][0]['lead']['count'],
+                                     stats['feeds'][0]['stale']))
+
+        # the books are kept while a feed is up, reset once all are down
+        arbiter.feed_down(0)
+        self.assertFalse(arbiter.accept_snapshot(0, 'BTC-PERP'))
+        arbiter.feed_down(1)
+        self.assertTrue(arbiter.accept_snapshot(0, 'BTC-PERP'))
+
+    def test_FtxManager_book_feeds(self):
+        manager = ftx.FtxManager('BTC-PERP', book_feeds=2)
+        books = []
+        manager.register_depth_callback(lambda symbol, book: books.append(book))
+        feed = manager._init_book_feed_router(1)
+
+        def book(action: str, time: float, bids: list) -> str:
+            return json.dumps({'channel': 'orderbook', 'market': 'BTC-PERP', 'type': action,
+                               'data': {'action': action, 'time': time, 'checksum': int(time), 'bids': bids,
+                                        'asks': [[50000.0, 1.0]]}})
+
+        manager._process_websocket_message(book('partial', 1.0, [[40000.0, 1.0]]))
+        self.assertTrue(manager._ready_check.depth_stream_ready)
+        # the snapshot of the second connection is dropped, the book is kept
+        manager._ready_check.depth_stream_ready = False
+        feed.route(book('partial', 1.5, [[39000.0, 1.0]]))
+        self.assertTrue(manager._ready_check.depth_stream_ready)
+        self.assertEqual(1, len(books))
+
+        # an update is applied from the first connection delivering it
+        feed.route(book('update', 2.0, [[40001.0, 1.0]]))
+        manager._process_websocket_message(book('update', 2.0, [[40001.0, 1.0]]))
+        manager._process_websocket_message(book('update', 3.0, [[40002.0, 1.0]]))
+        feed.route(book('update', 3.0, [[40002.0, 1.0]]))
+        self.assertEqual(3, len(books))
+        self.assertEqual([40002.0, 40001.0, 40000.0], [tier.price for tier in manager.get_ticker('BTC-PERP').bids])
+
+        stats = manager.get_feed_stats()
+        self.assertEqual((2, 2), (stats['updates'], stats['duplicates']))
+        self.assertEqual((1, 1), (stats['feeds'][0]['wins'], stats['feeds'][1]['wins']))
+        self.assertIsNone(ftx.FtxManager('BTC-PERP').get_feed_stats())
+
+    def test_GatewayRuntime(self):
+        runtime = GatewayRuntime(name='test-runtime')
+        managers = [ftx.FtxManager('BTC-PERP', name='ftx-a', runtime=runtime),
+                    ftx.FtxManager('ETH-PERP', name='ftx-b', runtime=runtime)]
+        self.assertTrue(all(manager._loop is runtime.loop and manager._loop_thread is None for manager in managers))
+
+        # the tasks are accounted by gateway name, a name is hosted once
+        with self.assertRaises(ValueError):
+            ftx.FtxManager('SOL-PERP', name='ftx-a', runtime=runtime)
+
+        class QueueWebSocket:
+            def __init__(self):
+                self.queue = asyncio.Queue()
+
+            async def recv(self):
+                return await self.queue.get()
+
+            async def send(self, message):
+                pass
+
+        threads = []
+        done = Future()
+
+        def on_book(symbol, book):
+            threads.append(get_ident())
+            if len(threads) == 2:
+                done.set_result(None)
+
+        for manager in managers:
+            manager._ws = QueueWebSocket()
+            manager.register_depth_callback(on_book)
+            for coro in manager._async_tasks():
+                runtime.spawn(manager._name, coro)
+        self.assertEqual(42, runtime.run('other', asyncio.sleep(0, 42)))
+
+        # the books of both gateways are received on the runtime thread
+        for manager, market in zip(managers, ('BTC-PERP', 'ETH-PERP')):
+            frame = json.dumps({'channel': 'orderbook', 'market': market, 'type': 'partial',
+                                'data': {'action': 'partial', 'time': 1.0, 'checksum': 0,
+                                         'bids': [[100.0, 1.0]], 'asks': [[101.0, 1.0]]}})
+            runtime.call_soon(manager._ws.queue.put_nowait, frame)
+        done.result(5)
+        self.assertEqual({runtime._thread.ident}, set(threads))
+        with self.assertRaises(RuntimeError):
+            runtime.spawn('other', self._run_on_runtime(runtime)).result(5)
+
+        stats = runtime.get_task_stats()
+        self.assertEqual((2, 2), (stats['ftx-a']['running'], stats['ftx-a']['started']))
+        self.assertTrue(stats['ftx-a']['steps'] > 0)
+        self.assertEqual((2, 1, 1), (stats['other']['started'], stats['other']['finished'], stats['other']['failed']))
+
+        # stopping a gateway cancels its tasks only
+        managers[0].stop()
+        for _ in range(100):
+            stats = runtime.get_task_stats()
+            if not stats['ftx-a']['running']:
+                break
+            time.sleep(0.01)
+        self.assertEqual((0, 2), (stats['ftx-a']['running'], stats['ftx-a']['cancelled']))
+        self.assertEqual(2, stats['ftx-b']['running'])
+        ftx.FtxManager('SOL-PERP', name='ftx-a', runtime=runtime)
+        runtime.stop()
+
+    @staticmethod
+    async def _run_on_runtime(runtime: GatewayRuntime):
+        return runtime.run('other', asyncio.sleep(0))
+
+    def test_ShardedManager(self):
+        symbols = {'BTC-PERP', 'ETH-PERP', 'SOL-PERP', 'AVAX-PERP', 'DOGE-PERP'}
+        self.assertEqual(zlib.crc32(b'BTC-PERP') % 3, shard_of('BTC-PERP', 3))
+        shards = assign_shards(symbols, 3)
+        self.assertEqual(symbols, set().union(*shards))
+        self.assertEqual(len(symbols), sum(len(shard) for shard in shards))
+
+        manager = ShardedManager(ftx.FtxManager, symbols, 3, name='test', depth_levels=2)
+        self.assertEqual(len([shard for shard in shards if shard]), len(manager.managers))
+        for symbol in symbols:
+            shard = manager.get_manager(symbol)
+            self.assertIn(symbol, shard._symbol)
+            self.assertEqual(shards[manager.get_shard(symbol)], shard._symbol)
+            self.assertEqual('test-{}'.format(manager.get_shard(symbol)), shard._name)
+
+        # routed to the manager of the symbol
+        book = OrderBook(1.0, [Tier(100.0, 1.0)], [Tier(101.0, 1.0)])
+        manager.get_manager('ETH-PERP')._orderbooks['ETH-PERP'] = book
+        self.assertIs(book, manager.get_ticker('ETH-PERP'))
+        self.assertIsNone(manager.get_ticker('BTC-PERP'))
+
+        callback = lambda symbol, book: None
+        manager.register_depth_callback(callback)
+        self.assertTrue(all(shard._depth_callback is callback for shard in manager.managers))
+        manager.register_signal_callback(callback)
+        self.assertTrue(all(shard._signal_callback is callback for shard in manager.managers))
+
+        # a subscriber of some symbols is added to the managers of these symbols only
+        subscribers = manager.add_depth_subscriber(callback, symbols={'BTC-PERP', 'ETH-PERP'})
+        self.assertEqual({manager.get_shard('BTC-PERP'), manager.get_shard('ETH-PERP')}, set(subscribers))
+        for index, subscriber in subscribers.items():
+            self.assertEqual(shards[index] & {'BTC-PERP', 'ETH-PERP'}, subscriber.symbols)
+        self.assertEqual(len(manager.managers), len(manager.add_execution_subscriber(lambda event: None)))
+        manager.remove_subscriber(subscribers)
+        self.assertTrue(all(not shard._subscribers._depth for shard in manager.managers))
+
+        # the stats are reported per shard
+        self.assertEqual({shard._name for shard in manager.managers}, set(manager.get_reconnect_stats()))
+        self.assertTrue(all(stats is None for stats in manager.get_feed_stats().values()))
+
+        # batches are split by shard, the results keep the order of the orders
+        for shard in manager.managers:
+            shard.place_orders = lambda orders: [OrderResult(nos.symbol, nos.symbol + '-id', success=True) for nos in orders]
+        orders = [NewOrderSingle(symbol, Side.Buy, 1, OrderType.Limit, price=1.0) for symbol in sorted(symbols)]
+        results = manager.place_orders(orders)
+        self.assertEqual([symbol + '-id' for symbol in sorted(symbols)], [result.client_id for result in results])
+        manager.stop()
+
+        # the shards are named after the manager default name
+        manager = ShardedManager(ftx.FtxManager, symbols, 3)
+        self.assertEqual(['FTX-{}'.format(index) for index, shard in enumerate(shards) if shard],
+                         [shard._name for shard in manager.managers])
+        manager.stop()
+
+    def test_get_place_order_message_rounding(self):
+        rng = random.Random(3)
+        for quantity_size in (0.0001, 0.001, 0.1, 1.0, 0.5):
+            instrument_static = InstrumentDetails('BTC-PERP', tick_size=1.0, quantity_size=quantity_size)
+            quantity_ticks = PriceTicks(quantity_size)
+            for _ in range(200):
+                order = NewOrderSingle('BTC-PERP', Side.Buy, rng.uniform(0, 20), OrderType.Market)
+                self.assertEqual(ftx.get_place_order_message(order, instrument_static, 'id')['size'],
+                                 ftx.get_place_order_message(order, instrument_static, 'id', quantity_ticks)['size'])
+
+    def test_OrderIdGenerator_threads(self):
+        generator = OrderIdGenerator('FTX')
+        ids = []
+
+        def generate():
+            ids.extend([generator.next() for _ in range(10000)])
+
+        threads = [Thread(target=generate) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(40000, len(set(ids)))
+
+    def test_HttpClient(self):
+        server = ThreadingHTTPServer(('localhost', 0), MarketsHandler)
+        Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            client = HttpClient('http://localhost:{}'.format(server.server_port), pool_size=2)
+
+            # the first request opens a connection, the second reuses it
+            self.assertEqual([], client.get('/markets').json()['result'])
+            self.assertEqual(200, client.get('/markets').status_code)
+            first, second = client.timings
+            self.assertTrue(first.new_connection)
+            self.assertTrue(first.dns >= 0 and first.connect > 0)
+            self.assertFalse(second.new_connection)
+            self.assertEqual(0, second.connect)
+            self.assertTrue(0 < second.first_byte <= second.total)
+
+            client.prewarm()
+            self.assertEqual(4, len(client.timings))
+
+            # a third-party session mounted on the pool is timed too
+            session = requests.Session()
+            client.mount(session)
+            self.assertEqual(200, session.get(client.base_url + '/markets').status_code)
+            self.assertEqual(5, len(client.timings))
+            self.assertFalse(client.timings[-1].new_connection)
+            client.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_LegExecutor(self):
+        class Gateway:
+            """ Order entry responses are completed by the test """
+            def __init__(self, name):
+                self.ids = OrderIdGenerator(name)
+                self.sent = []
+
+            def submit_order(self, nos):
+                future = Future()
+                self.sent.append((nos, future))
+                return future
+
+            def get_tick_size(self, contract_name):
+                return 0.5
+
+        reference, target = Gateway('ftx'), Gateway('dydx')
+        executor = LegExecutor()
+
+        # both legs filled, the target events come before its order entry response
+        group = executor.execute([(reference, NewOrderSingle('ETH-PERP', Side.Buy, 1, OrderType.IOC, price=3000)),
+                                  (target, NewOrderSingle('ETH-USD', Side.Sell, 1, OrderType.IOC, price=3001))])
+        self.assertEqual(1, len(reference.sent))
+        self.assertEqual(1, len(target.sent))
+        reference.sent[0][1].set_result('ftx-1')
+        executor.on_execution(OrderEvent('ETH-USD', 'd1', OrderStatus.OPEN, client_id='dydx-1'))
+        executor.on_execution(OrderEvent('ETH-PERP', 'f1', OrderStatus.MATCHED, client_id='ftx-1'))
+        executor.on_execution(OrderEvent('ETH-USD', 'd1', OrderStatus.MATCHED, client_id='dydx-1'))
+        self.assertFalse(group.is_done())
+        target.sent[0][1].set_result('dydx-1')
+        self.assertTrue(group.is_filled())
+        stats = executor.get_stats()
+        self.assertEqual((1, 0, 1, 0), (stats['groups'], stats['active'], stats['filled'], stats['failed']))
+        self.assertEqual(1, stats['ack_skew']['count'])
+        self.assertEqual(1, stats['fill_skew']['count'])
+
+        # the target leg is canceled, the filled reference leg is unwound
+        group = executor.execute([(reference, NewOrderSingle('ETH-PERP', Side.Buy, 1, OrderType.IOC, price=3000)),
+                                  (target, NewOrderSingle('ETH-USD', Side.Sell, 1, OrderType.IOC, price=3001))])
+        reference.sent[1][1].set_result('ftx-2')
+        target.sent[1][1].set_result('dydx-2')
+        executor.on_execution(OrderEvent('ETH-PERP', 'f2', OrderStatus.MATCHED, client_id='ftx-2'))
+        executor.on_execution(OrderEvent('ETH-USD', 'd2', OrderStatus.CANCELED, client_id='dydx-2'))
+        self.assertEqual([LegState.FILLED, LegState.CANCELED], [leg.state for leg in group.legs])
+        self.assertTrue(group.hedged)
+        unwind, _ = reference.sent[2]
+        self.assertEqual((Side.Sell, 1, OrderType.IOC, 2994.0),
+                         (unwind.side, unwind.quantity, unwind.type, unwind.price))
+        self.assertEqual(2, len(target.sent))
+
+        # a rejected leg without hedging
+        executor.hedge_action = HedgeAction.NONE
+        group = executor.execute([(reference, NewOrderSingle('ETH-PERP', Side.Buy, 1, OrderType.IOC, price=3000)),
+                                  (target, NewOrderSingle('ETH-USD', Side.Sell, 1, OrderType.IOC, price=3001))])
+        reference.sent[3][1].set_result('ftx-3')
+        target.sent[2][1].set_exception(ValueError('rejected'))
+        executor.on_execution(OrderEvent('ETH-PERP', 'f3', OrderStatus.MATCHED, client_id='ftx-3'))
+        self.assertEqual(LegState.REJECTED, group.legs[1].state)
+        self.assertFalse(group.hedged)
+        stats = executor.get_stats()
+        self.assertEqual((3, 0, 1, 2, 1), (stats['groups'], stats['active'], stats['filled'], stats['failed'],
+                                           stats['hedged']))
+
+        # partial fills, reported as matched by FTX and as canceled by dYdX: only the filled quantities are unwound
+        executor.hedge_action = HedgeAction.UNWIND
+        group = executor.execute([(reference, NewOrderSingle('ETH-PERP', Side.Buy, 1, OrderType.IOC, price=3000)),
+                                  (target, NewOrderSingle('ETH-USD', Side.Sell, 1, OrderType.IOC, price=3001))])
+        reference.sent[4][1].set_result('ftx-4')
+        target.sent[3][1].set_result('dydx-4')
+        partial = OrderEvent('ETH-PERP', 'f4', OrderStatus.MATCHED, client_id='ftx-4')
+        partial.filled_quantity = 0.4
+        executor.on_execution(partial)
+        canceled = OrderEvent('ETH-USD', 'd4', OrderStatus.CANCELED, client_id='dydx-4')
+        canceled.filled_quantity = 0.3
+        self.assertFalse(group.is_settled())
+        executor.on_execution(canceled)
+        self.assertEqual([LegState.PARTIALLY_FILLED, LegState.PARTIALLY_FILLED], [leg.state for leg in group.legs])
+        self.assertEqual([(Side.Sell, 0.4), (Side.Buy, 0.3)],
+                         [(order.side, order.quantity) for _, order, _ in group.hedge_orders])
+        self.assertFalse(group.is_settled())
+        reference.sent[5][1].set_result('ftx-5')
+        target.sent[4][1].set_result('dydx-5')
+        self.assertTrue(group.is_settled())